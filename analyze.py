@@ -1,23 +1,41 @@
 # For analysis on data, WSB data via ticker list, sentiment analysis
+import numpy as np
 import pandas as pd
-import json
 import os
 import matplotlib.pyplot as plt
 import seaborn as sns
+from for_data.aggregates import encode_tickers, encode_sentiment, SENTIMENT_CLASSES, ALL_TICKERS
+from for_data.aggregate_cube import AggregateCube, sentiment_table
+from for_data.processed_store import load_processed, iter_processed
 
 PROCESSED_FILE_PATH = 'wsb_sub_processed.csv'
-def load_processed_data(file_path):
-    """Load the processed data from a CSV file."""
+PROCESSED_PARQUET_PATH = 'wsb_sub_processed_parquet' # used instead of the CSV when it exists
+# the charts here only need these, so the text columns are never loaded
+ANALYSIS_COLUMNS = ['date', 'sentiment', 'tickers']
+# rows per chunk in streaming mode: the data is folded into running counts chunk by chunk, so memory is bounded by the
+# chunk size (plus a few counters) instead of the dataset. None loads everything at once like before
+STREAM_CHUNK_ROWS = 200_000
+STREAM_PERIODS = ('W',) # periods analyze_sentiment_by_period can be shown for after a streaming pass
+TOP_TICKERS = 20
+# charts from the materialized ticker x day cube (for_data/aggregate_cube.py) when True: after it's built once, no
+# rows are read at all. Only posts with a valid sentiment are in it
+USE_AGGREGATE_CUBE = True
+CUBE_PERIODS = {'D': 'D', 'W': 'W', 'M': 'M', 'ME': 'M', 'Q': 'Q', 'QE': 'Q'} # resample frequency -> cube period
+
+def load_processed_data(file_path, columns=None, start=None, end=None):
+    """Load the processed data (Parquet store or CSV), optionally only some columns and a date range."""
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Processed file not found: {file_path}")
-    df = pd.read_csv(file_path)
+    df = load_processed(file_path, columns, start, end)
     df['date'] = pd.to_datetime(df['date'])
 
     return df
 
 def analyze_sentiment_distribution(df):
     """Analyze the distribution of sentiment in the DataFrame."""
-    sentiment_counts = df['sentiment'].value_counts()
+    show_sentiment_distribution(df['sentiment'].value_counts())
+
+def show_sentiment_distribution(sentiment_counts):
     print("Sentiment Distribution:")
     print(sentiment_counts)
 
@@ -42,7 +60,9 @@ def analyze_sentiment_by_period(df, period='W'):
     sentiment_by_period = df_resampled.groupby(pd.Grouper(freq=period))['sentiment'] \
                                       .value_counts() \
                                       .unstack(fill_value=0)
-    
+    return show_sentiment_by_period(sentiment_by_period, period)
+
+def show_sentiment_by_period(sentiment_by_period, period='W'):
     print(f"Sentiment Distribution by {period}:")
     print(sentiment_by_period.head())
 
@@ -68,18 +88,20 @@ def analyze_fully(df):
     valid_sentiments = ['Positive', 'Negative', 'Neutral']
     df_clean_sentiment = df[df['sentiment'].isin(valid_sentiments)].copy()
     sentiment_map = {'Positive': 1, 'Neutral': 0, 'Negative': -1}
-    df_clean_sentiment['sentiment_score'] = df_clean_sentiment['sentiment'].map(sentiment_map)
-    # Parse the JSON string into actual lists
-    df_clean_sentiment['tickers_list'] = df_clean_sentiment['tickers'].apply(lambda x: json.loads(x) if isinstance(x, str) and x.startswith('[') else [])
-
-    df_exploded_tickers = df_clean_sentiment.explode('tickers_list')
-    df_exploded_tickers.rename(columns={'tickers_list': 'ticker_symbol'}, inplace=True)
-    df_ticker_analysis = df_exploded_tickers[df_exploded_tickers['ticker_symbol'].notna()].copy()
+    df_clean_sentiment['sentiment_score'] = df_clean_sentiment['sentiment'].astype(object).map(sentiment_map)
+    # Integer-code the tickers (JSON strings in the CSV, arrays in Parquet) and repeat each row once per ticker,
+    # instead of apply(json.loads) + explode
+    offsets, ticker_codes, ticker_names = encode_tickers(df_clean_sentiment['tickers'])
+    rows = np.repeat(np.arange(len(df_clean_sentiment)), np.diff(offsets))
+    df_ticker_analysis = df_clean_sentiment.iloc[rows].copy()
+    df_ticker_analysis['ticker_symbol'] = np.asarray(ticker_names, dtype=object)[ticker_codes]
     return df_ticker_analysis, df_clean_sentiment
 
 def analyze_ticker_sentiment(df_ticker_analysis):
-    top_n = 20
-    most_mentioned_tickers = df_ticker_analysis['ticker_symbol'].value_counts().nlargest(top_n)
+    show_ticker_sentiment(df_ticker_analysis['ticker_symbol'].value_counts())
+
+def show_ticker_sentiment(ticker_counts, top_n=TOP_TICKERS):
+    most_mentioned_tickers = ticker_counts.nlargest(top_n)
     print(f"\nTop {top_n} Most Mentioned Tickers:")
     print(most_mentioned_tickers)
 
@@ -90,16 +112,98 @@ def analyze_ticker_sentiment(df_ticker_analysis):
     plt.tight_layout()
     plt.show()
 
+class StreamingAnalysis:
+    """Running totals behind the three analyses above, filled one chunk at a time with add(). Only counts are kept:
+    sentiment -> rows, (period end, sentiment) -> rows per period, and per ticker Negative/Neutral/Positive mentions.
+    The results equal what the DataFrame versions compute on all rows at once, ties in the same (first seen) order."""
+
+    def __init__(self, periods=STREAM_PERIODS):
+        self.periods = periods
+        self.rows = 0
+        self.sentiments = {} # sentiment -> rows, in order of first appearance like value_counts' ties
+        self.by_period = {period: None for period in periods} # (date, sentiment) -> rows Series
+        self.ticker_codes = {} # ticker -> row in ticker_tallies, in order of first appearance
+        self.ticker_tallies = np.zeros((0, len(SENTIMENT_CLASSES)), dtype=np.int64)
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        sentiment = chunk['sentiment'].astype(object)
+        for value, count in sentiment.value_counts(sort=False).items():
+            self.sentiments[value] = self.sentiments.get(value, 0) + int(count)
+
+        dated = pd.DataFrame({'date': pd.to_datetime(chunk['date']), 'sentiment': sentiment}).set_index('date')
+        for period in self.periods:
+            counts = dated.groupby(pd.Grouper(freq=period))['sentiment'].value_counts()
+            running = self.by_period[period]
+            # a period split across chunks gets its counts summed, the table stays periods x sentiments small
+            self.by_period[period] = counts if running is None else pd.concat([running, counts]).groupby(level=[0, 1], sort=False).sum()
+
+        # per ticker mentions by sentiment class, only rows with a valid sentiment (like analyze_fully)
+        codes = encode_sentiment(sentiment)
+        valid = codes >= 0
+        offsets, ticker_codes, ticker_names = encode_tickers(chunk['tickers'][valid])
+        if len(ticker_names):
+            global_codes = np.array([self.ticker_codes.setdefault(name, len(self.ticker_codes)) for name in ticker_names])
+            if len(self.ticker_codes) > len(self.ticker_tallies):
+                grown = np.zeros((len(self.ticker_codes), len(SENTIMENT_CLASSES)), dtype=np.int64)
+                grown[:len(self.ticker_tallies)] = self.ticker_tallies
+                self.ticker_tallies = grown
+            classes = np.repeat(codes[valid].astype(np.int64), np.diff(offsets))
+            np.add.at(self.ticker_tallies, (global_codes[ticker_codes], classes), 1)
+
+    def sentiment_distribution(self):
+        counts = pd.Series(self.sentiments, dtype=np.int64, name='count').rename_axis('sentiment')
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def sentiment_by_period(self, period='W'):
+        counts = self.by_period[period]
+        if counts is None:
+            return pd.DataFrame()
+        return counts.sort_index().unstack(fill_value=0)
+
+    def ticker_mentions(self):
+        counts = pd.Series(self.ticker_tallies.sum(axis=1), index=pd.Index(list(self.ticker_codes), name='ticker_symbol'), name='count')
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def ticker_sentiment(self):
+        """Per ticker mention counts by sentiment class and the mean score (-1 Negative, 0 Neutral, 1 Positive)."""
+        table = pd.DataFrame(self.ticker_tallies, index=pd.Index(list(self.ticker_codes), name='ticker_symbol'), columns=SENTIMENT_CLASSES)
+        table['count'] = table[SENTIMENT_CLASSES].sum(axis=1)
+        table['mean_score'] = (table['Positive'] - table['Negative']) / table['count']
+        return table.sort_values('count', ascending=False, kind='stable')
+
+def analyze_sentiment_by_period_cube(cube, period='W'):
+    """analyze_sentiment_by_period() from an AggregateCube, a period x Negative/Neutral/Positive table of all posts."""
+    sentiment_by_period = sentiment_table(cube.aggregates((CUBE_PERIODS[period],), tickers=[ALL_TICKERS]), CUBE_PERIODS[period])
+    return show_sentiment_by_period(sentiment_by_period, period)
+
+def analyze_streaming(file_path, columns=ANALYSIS_COLUMNS, chunk_rows=STREAM_CHUNK_ROWS, periods=STREAM_PERIODS, start=None, end=None):
+    """One pass over the processed data in chunks of chunk_rows, returns the filled StreamingAnalysis."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Processed file not found: {file_path}")
+    analysis = StreamingAnalysis(periods)
+    for chunk in iter_processed(file_path, columns, start, end, chunk_rows):
+        analysis.add(chunk)
+        print(f"Analyzed {analysis.rows:,} rows from {file_path}")
+    return analysis
+
 if __name__ == "__main__":
     try:
         # Load the processed data
-        df = load_processed_data(PROCESSED_FILE_PATH)
-        
-        print("First few rows of the DataFrame:")
-        print(df.head())
-        
-        df_ticker_analysis, df_clean_sentiment = analyze_fully(df)
-        analyze_ticker_sentiment(df_ticker_analysis)
+        data_path = PROCESSED_PARQUET_PATH if os.path.isdir(PROCESSED_PARQUET_PATH) else PROCESSED_FILE_PATH
+        if USE_AGGREGATE_CUBE:
+            show_ticker_sentiment(AggregateCube(data_path).ticker_totals())
+        elif STREAM_CHUNK_ROWS:
+            analysis = analyze_streaming(data_path)
+            show_ticker_sentiment(analysis.ticker_mentions())
+        else:
+            df = load_processed_data(data_path, columns=ANALYSIS_COLUMNS)
+
+            print("First few rows of the DataFrame:")
+            print(df.head())
+
+            df_ticker_analysis, df_clean_sentiment = analyze_fully(df)
+            analyze_ticker_sentiment(df_ticker_analysis)
         
     except Exception as e:
         print(f"An error occurred: {e}")
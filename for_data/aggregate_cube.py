@@ -0,0 +1,160 @@
+# Materialized ticker x day sentiment cube: per (ticker, day) the post count, Negative/Neutral/Positive counts and the
+# score sum (Positive - Negative), ALL_TICKERS included. That's all any period/ticker chart needs: weekly, monthly and
+# quarterly numbers are sums of days, so rollup() derives them from the cube without touching a row of the dataset.
+# The cube is a small Parquet file per processed data path, tagged with the aggregates.input_version() it matches.
+# A stale cube is rebuilt chunk by chunk, ingest.py folds appended rows into it with update().
+#   python aggregate_cube.py [wsb_sub_processed_parquet | wsb_sub_processed.csv] [TICKER]
+# builds or refreshes the cube and shows what rendering one ticker's weekly numbers from it costs.
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+try:
+    from aggregates import ALL_TICKERS, COUNT_COLUMNS, SENTIMENT_CLASSES, add_scores, aggregate_sentiment, input_version, period_labels
+    from processed_store import iter_processed
+except ImportError: # imported from the repo root as for_data.aggregate_cube
+    from for_data.aggregates import ALL_TICKERS, COUNT_COLUMNS, SENTIMENT_CLASSES, add_scores, aggregate_sentiment, input_version, period_labels
+    from for_data.processed_store import iter_processed
+
+PROCESSED_PATH = 'wsb_sub_processed_parquet'
+CUBE_DIR = 'aggregate_cube'
+CUBE_COLUMNS = ['ticker', 'date'] + COUNT_COLUMNS + ['score_sum']
+BUILD_CHUNK_ROWS = 200_000
+ROW_GROUP_ROWS = 16_384 # sorted by ticker, so reading a few tickers only touches their row groups
+
+
+def daily_cube(df):
+    """Cube rows for a frame of processed rows (date, sentiment, tickers), rows without a valid sentiment left out."""
+    daily = aggregate_sentiment(df, periods=('D',))
+    cube = daily[['ticker', 'date'] + COUNT_COLUMNS].copy()
+    cube['score_sum'] = cube['Positive'] - cube['Negative']
+    return cube
+
+
+def merge_cubes(cube, more):
+    # counts and score sums add up per (ticker, date)
+    merged = pd.concat([cube, more], ignore_index=True)
+    merged = merged.groupby(['ticker', 'date'], as_index=False, sort=False)[COUNT_COLUMNS + ['score_sum']].sum()
+    return merged.sort_values(['ticker', 'date'], ignore_index=True)
+
+
+def rollup(cube, periods=('D', 'W', 'M', 'Q')):
+    """aggregate_sentiment()'s tidy table (ticker, period, date, counts, mean_score, *_proportion) from cube rows
+    instead of from posts. Same numbers, the period sums are just sums of days."""
+    tables = []
+    for period in periods:
+        dates = cube['date'].to_numpy() if period == 'D' else period_labels(cube['date'], period)
+        table = cube[['ticker'] + COUNT_COLUMNS].assign(date=dates)
+        table = table.groupby(['ticker', 'date'], as_index=False, sort=False)[COUNT_COLUMNS].sum()
+        table.insert(1, 'period', period)
+        tables.append(table)
+    if not tables or cube.empty:
+        return add_scores(pd.DataFrame({'ticker': pd.Series(dtype=object), 'period': pd.Series(dtype=object),
+                                        'date': pd.Series(dtype='datetime64[ns]'), **{name: pd.Series(dtype=np.int64) for name in COUNT_COLUMNS}}))
+    result = add_scores(pd.concat(tables, ignore_index=True))
+    return result.sort_values(['ticker', 'period', 'date'], ignore_index=True)
+
+
+class AggregateCube:
+    """The cube of the processed data at data_path. read()/aggregates() rebuild it first when the data changed since."""
+
+    def __init__(self, data_path, cube_dir=CUBE_DIR):
+        self.data_path = data_path
+        self.path = os.path.join(cube_dir, f"{os.path.basename(os.path.normpath(data_path))}.parquet")
+
+    def stored_version(self):
+        if not os.path.exists(self.path):
+            return None
+        metadata = pq.read_schema(self.path).metadata or {}
+        return metadata.get(b'input_version', b'').decode('utf-8') or None
+
+    def is_current(self):
+        return self.stored_version() == input_version(self.data_path)
+
+    def write(self, cube, version):
+        table = pa.Table.from_pandas(cube[CUBE_COLUMNS].astype({name: np.int32 for name in COUNT_COLUMNS + ['score_sum']}), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'input_version': version.encode('utf-8')})
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        pq.write_table(table, temp_path, row_group_size=ROW_GROUP_ROWS)
+        os.replace(temp_path, self.path) # atomic, readers see the old cube or the new one
+
+    def build(self, chunk_size=BUILD_CHUNK_ROWS):
+        """Aggregate the whole dataset, a chunk at a time so memory stays flat. Returns the cube."""
+        if not os.path.exists(self.data_path):
+            raise FileNotFoundError(f"Processed file not found: {self.data_path}")
+        version = input_version(self.data_path)
+        cube = None
+        for chunk in iter_processed(self.data_path, ['date', 'sentiment', 'tickers'], chunk_size=chunk_size):
+            part = daily_cube(chunk)
+            cube = part if cube is None else merge_cubes(cube, part)
+        if cube is None:
+            cube = pd.DataFrame({'ticker': pd.Series(dtype=object), 'date': pd.Series(dtype='datetime64[ns]'),
+                                 **{name: pd.Series(dtype=np.int64) for name in COUNT_COLUMNS + ['score_sum']}})
+        self.write(cube, version)
+        return cube
+
+    def update(self, previous_version, new_rows):
+        """After new_rows (date, sentiment, tickers) were appended to the data, fold them into a cube that matched its
+        previous version. False when there was no such cube, the next read() rebuilds it then."""
+        if self.stored_version() != previous_version:
+            return False
+        cube = pd.read_parquet(self.path)
+        if len(new_rows):
+            cube = merge_cubes(cube, daily_cube(new_rows))
+        self.write(cube, input_version(self.data_path))
+        return True
+
+    def read(self, tickers=None, start=None, end=None):
+        """Cube rows, only for the given tickers and days start..end when those are set."""
+        if not self.is_current():
+            self.build()
+        filters = []
+        if tickers is not None:
+            filters.append(('ticker', 'in', list(tickers)))
+        if start is not None:
+            filters.append(('date', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('date', '<=', pd.Timestamp(end)))
+        cube = pd.read_parquet(self.path, filters=filters or None)
+        cube['ticker'] = cube['ticker'].astype(object)
+        return cube.astype({name: np.int64 for name in COUNT_COLUMNS + ['score_sum']}) # stored as int32
+
+    def aggregates(self, periods=('D', 'W', 'M', 'Q'), tickers=None, start=None, end=None):
+        """rollup() of the cube, what aggregate_sentiment() gives on the same rows."""
+        return rollup(self.read(tickers, start, end), periods)
+
+    def ticker_totals(self):
+        """Labeled posts mentioning each ticker over the whole data, most mentioned first (ALL_TICKERS left out)."""
+        cube = self.read()
+        totals = cube[cube['ticker'] != ALL_TICKERS].groupby('ticker', sort=False)['count'].sum()
+        return totals.sort_values(ascending=False, kind='stable').rename_axis('ticker_symbol')
+
+
+def sentiment_table(aggregates, period, ticker=ALL_TICKERS):
+    """period x sentiment class counts for one ticker (all posts by default), the table analyze.py charts."""
+    rows = aggregates[(aggregates['ticker'] == ticker) & (aggregates['period'] == period)]
+    return rows.set_index('date')[SENTIMENT_CLASSES].rename_axis(columns='sentiment')
+
+
+if __name__ == "__main__":
+    data_path = sys.argv[1] if len(sys.argv) > 1 else PROCESSED_PATH
+    if not os.path.exists(data_path):
+        print(f"Error: The file '{data_path}' was not found.")
+        exit(1)
+    cube = AggregateCube(data_path)
+    started = time.perf_counter()
+    if cube.is_current():
+        print(f"'{cube.path}' is up to date")
+    else:
+        built = cube.build()
+        print(f"Built '{cube.path}' from '{data_path}' in {time.perf_counter() - started:.1f}s: {len(built):,} ticker days")
+    print(f"{os.path.getsize(cube.path) / 1024:,.0f} KB on disk")
+    ticker = sys.argv[2].upper() if len(sys.argv) > 2 else cube.ticker_totals().index[0]
+    started = time.perf_counter()
+    weekly = cube.aggregates(('W',), tickers=[ticker])
+    print(f"{ticker} weekly from the cube: {len(weekly):,} weeks in {(time.perf_counter() - started) * 1000:.0f} ms")
+    print(weekly.tail().to_string(index=False))
@@ -0,0 +1,111 @@
+# Sentiment aggregates for every ticker x period in one vectorized pass over integer-coded arrays,
+# instead of a groupby/resample chain per ticker per chart. Results are a tidy table; aggregate_cube.py keeps the
+# materialized copy the scripts read.
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+try:
+    from processed_store import parse_tickers
+except ImportError: # imported from the repo root as for_data.aggregates
+    from for_data.processed_store import parse_tickers
+
+SENTIMENT_CLASSES = ['Negative', 'Neutral', 'Positive'] # code order, score = code - 1
+ALL_TICKERS = '*' # pseudo ticker covering every labeled post, with or without tickers
+# period -> pandas period frequency. Labels are the period's last day, like resample('W'/'ME'/'QE') uses
+PERIOD_FREQUENCIES = {'D': 'D', 'W': 'W-SUN', 'M': 'M', 'Q': 'Q-DEC'}
+COUNT_COLUMNS = ['count'] + SENTIMENT_CLASSES
+
+
+def encode_sentiment(sentiment):
+    """int8 codes into SENTIMENT_CLASSES, -1 for anything else (missing, errors)."""
+    return pd.Categorical(pd.Series(sentiment).astype(object), categories=SENTIMENT_CLASSES).codes.astype(np.int8)
+
+
+def encode_tickers(tickers):
+    """CSR form of the tickers column: (offsets, ticker codes, ticker names). Row i owns codes[offsets[i]:offsets[i+1]]."""
+    lists = [parse_tickers(value) for value in tickers]
+    lengths = np.fromiter((len(values) for values in lists), dtype=np.int64, count=len(lists))
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    flat = [ticker for values in lists for ticker in values]
+    codes, names = pd.factorize(pd.Series(flat, dtype=object))
+    return offsets, codes.astype(np.int32), list(names)
+
+
+def period_labels(dates, period):
+    return pd.Series(pd.to_datetime(dates)).dt.to_period(PERIOD_FREQUENCIES[period]).dt.end_time.dt.normalize().to_numpy()
+
+
+def aggregate_sentiment(df, periods=('D', 'W', 'M', 'Q'), include_all=True):
+    """Tidy table with one row per (ticker, period, date) that has labeled posts.
+
+    Columns: ticker, period, date, count, Negative/Neutral/Positive counts, mean_score and *_proportion.
+    """
+    sentiment_codes = encode_sentiment(df['sentiment'])
+    offsets, ticker_codes, ticker_names = encode_tickers(df['tickers'])
+    row_of_posting = np.repeat(np.arange(len(df)), np.diff(offsets))
+    if include_all:
+        # every labeled row counts once towards ALL_TICKERS
+        row_of_posting = np.concatenate([row_of_posting, np.arange(len(df))])
+        ticker_codes = np.concatenate([ticker_codes, np.full(len(df), len(ticker_names), dtype=np.int32)])
+        ticker_names = ticker_names + [ALL_TICKERS]
+    labeled = sentiment_codes[row_of_posting] >= 0
+    row_of_posting = row_of_posting[labeled]
+    ticker_codes = ticker_codes[labeled]
+    posting_sentiment = sentiment_codes[row_of_posting].astype(np.int64)
+
+    tables = []
+    classes = len(SENTIMENT_CLASSES)
+    for period in periods:
+        period_codes, period_dates = pd.factorize(period_labels(df['date'], period))
+        n_periods = len(period_dates)
+        posting_periods = period_codes[row_of_posting]
+        dated = posting_periods >= 0 # missing dates factorize to -1
+        keys = (ticker_codes[dated].astype(np.int64) * n_periods + posting_periods[dated]) * classes + posting_sentiment[dated]
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        cells, class_codes = np.divmod(unique_keys, classes)
+        cell_keys, cell_index = np.unique(cells, return_inverse=True)
+        class_counts = np.zeros((len(cell_keys), classes), dtype=np.int64)
+        np.add.at(class_counts, (cell_index, class_codes), counts)
+        ticker_of_cell, period_of_cell = np.divmod(cell_keys, n_periods)
+        table = pd.DataFrame({
+            'ticker': np.asarray(ticker_names, dtype=object)[ticker_of_cell],
+            'period': period,
+            'date': np.asarray(period_dates)[period_of_cell],
+            'count': class_counts.sum(axis=1),
+        })
+        for code, name in enumerate(SENTIMENT_CLASSES):
+            table[name] = class_counts[:, code]
+        tables.append(table)
+    result = add_scores(pd.concat(tables, ignore_index=True))
+    return result.sort_values(['ticker', 'period', 'date'], ignore_index=True)
+
+
+def add_scores(table):
+    """mean_score and the *_proportion columns, from the count columns."""
+    total = table['count'].to_numpy()
+    table['mean_score'] = (table['Positive'].to_numpy() - table['Negative'].to_numpy()) / total
+    for name in SENTIMENT_CLASSES:
+        table[f'{name}_proportion'] = table[name].to_numpy() / total
+    return table
+
+
+def input_version(path):
+    """Changes whenever the CSV or any file in the parquet store changes."""
+    digest = hashlib.sha256(os.path.abspath(path).encode('utf-8'))
+    if os.path.isdir(path):
+        for folder, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(folder, name))
+                digest.update(f"{folder}/{name}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    else:
+        stat = os.stat(path)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def ticker_period(aggregates, ticker, period):
+    """One ticker's rows for one period, indexed by date."""
+    selected = aggregates[(aggregates['ticker'] == ticker) & (aggregates['period'] == period)]
+    return selected.set_index('date').drop(columns=['ticker', 'period'])
@@ -0,0 +1,51 @@
+# Compares one-post-per-request against packed requests: rows/s, tokens per row and cost per 1k rows.
+#   python bench_sentiment.py [input.csv] [rows] [--mock]
+# With --mock it runs against mock_openai_server.py in-process (throughput only, the token counts are rough there);
+# without it, it spends real API credits on `rows` posts per mode.
+import json
+import sys
+import time
+import pandas as pd
+from sentiment_client import AsyncSentimentClient
+
+file_path = 'wsb_sub_processed.csv'
+rows = 1000
+PACK_TOKEN_BUDGET = 4000
+
+
+def sample_texts(file_path, rows):
+    # ticker-matched rows, with the same combined text extraction() sends
+    texts = []
+    for chunk in pd.read_csv(file_path, chunksize=50_000, usecols=['title', 'selftext', 'tickers']):
+        chunk = chunk[chunk['tickers'].notna() & (chunk['tickers'] != '[]')]
+        texts.extend((chunk['title'].fillna('').astype(str).str.lower() + " "
+                      + chunk['selftext'].fillna('').astype(str).str.lower()).tolist())
+        if len(texts) >= rows:
+            break
+    return texts[:rows]
+
+
+def run_mode(texts, base_url, pack_token_budget):
+    client = AsyncSentimentClient(base_url=base_url, pack_token_budget=pack_token_budget)
+    start = time.perf_counter()
+    results = client.analyze_texts(texts)
+    report = client.report(len(texts), time.perf_counter() - start)
+    report['unlabeled'] = sum(1 for sentiment, _ in results if sentiment is None)
+    report['packed_fallbacks'] = client.stats['packed_fallbacks']
+    return report
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != '--mock']
+    if args:
+        file_path = args[0]
+    if len(args) > 1:
+        rows = int(args[1])
+    base_url = None
+    if '--mock' in sys.argv:
+        from mock_openai_server import start_server
+        server, base_url = start_server(latency_ms=400, jitter_ms=100, packed_drop_probability=0.02)
+    texts = sample_texts(file_path, rows)
+    print(f"Benchmarking {len(texts):,} ticker rows from '{file_path}'")
+    reports = {'single': run_mode(texts, base_url, None), 'packed': run_mode(texts, base_url, PACK_TOKEN_BUDGET)}
+    print(json.dumps(reports, indent=2))
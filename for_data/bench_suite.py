@@ -0,0 +1,266 @@
+# Reproducible benchmarks on synthetic dumps (make_synthetic_dump.py), so a performance change can be measured
+# without the private Pushshift file. At each size it times read_lines_zst, dig_through.process_file (every post,
+# and a selective substring filter), sentimize_data.extraction() (tickers only on every row, with the local sentiment
+# backend on every row, and with the sentiment calls against mock_openai_server.py) and aggregates.aggregate_sentiment. Results go to RESULTS_DIR as JSON.
+#   python bench_suite.py [10k] [1m] [10m]
+#   python bench_suite.py --compare bench_results/before.json bench_results/after.json
+# The dumps are generated once per size and kept in DATA_DIR. The 10m size needs ~10 GB of disk and a while.
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import make_synthetic_dump
+from mock_openai_server import start_server
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DEFAULT_SIZES = ['10k', '1m', '10m']
+DATA_DIR = 'bench_data'
+RESULTS_DIR = 'bench_results'
+ticker_file = 'ticker_list.txt'
+COLUMN_NAMES = ['score', 'date', 'title', 'author', 'permalink', 'selftext'] # what process_file writes for submissions
+CHUNK_SIZE = 500 # rows per extraction() call, like sentimize_data.py
+# the selective process_file run: posts whose title or selftext contains one of these
+FILTER_FIELD = ["title", "selftext"]
+FILTER_VALUES = ["gme", "tsla", "amc"]
+# the mocked OpenAI endpoint. Only the first API_ROWS rows of each size go through it, the rest would just
+# measure the mock's latency over and over
+MOCK_LATENCY_MS = 50
+MOCK_JITTER_MS = 10
+API_ROWS = 5_000
+MAX_CONCURRENT_REQUESTS = 50
+LOCAL_BACKEND = 'lexicon' # sentiment_backends.py backend for the extraction_local run
+# --compare flags a benchmark as a regression when it got this much slower
+REGRESSION_THRESHOLD = 1.10
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def throughput(rows, seconds, **extra):
+    return {'seconds': round(seconds, 3), 'rows': rows, 'rows_per_second': round(rows / seconds, 1) if seconds else None, **extra}
+
+
+def ensure_dump(rows, tickers):
+    """The synthetic dump for this size, generated the first time it's needed."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"synthetic_{rows}_v{make_synthetic_dump.GENERATOR_VERSION}_s{make_synthetic_dump.SEED}_submissions.zst")
+    if not os.path.exists(path):
+        print(f"Generating {rows:,} rows into '{path}'")
+        # written under a temporary name, an interrupted run shouldn't leave a short file that looks finished
+        make_synthetic_dump.generate(path + ".tmp", rows, tickers, comments=False)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def bench_read_lines(dump_path):
+    from dig_through import read_lines_zst
+    start = time.perf_counter()
+    lines = 0
+    decompressed_bytes = 0
+    for _, _, decompressed_bytes in read_lines_zst(dump_path):
+        lines += 1
+    seconds = time.perf_counter() - start
+    return throughput(lines, seconds, mb_per_second=round(decompressed_bytes / 2**20 / seconds, 1), decompressed_bytes=decompressed_bytes)
+
+
+def bench_process_file(dump_path, output_file, field, values):
+    import dig_through
+    dig_through.write_metrics = True
+    _, seconds = timed(dig_through.process_file, dump_path, output_file, "csv", field, values, make_synthetic_dump.FROM_DATE,
+                       make_synthetic_dump.TO_DATE, None, False, 1, dig_through.pre_filter)
+    with open(f"{output_file}.metrics.json", 'r', encoding='utf-8') as handle:
+        report = json.load(handle)
+    result = throughput(report['counters']['lines'], seconds, matched=report['counters']['matched'],
+                        csv_bytes=os.path.getsize(f"{output_file}.csv"))
+    result['stages'] = {stage: entry['seconds'] for stage, entry in report['stages'].items()}
+    return result
+
+
+def read_rows(csv_path):
+    return pd.read_csv(csv_path, header=None, names=COLUMN_NAMES, chunksize=CHUNK_SIZE)
+
+
+def bench_extraction_tickers(csv_path, matcher):
+    """extraction() on every row without sentiment calls. Returns the result and the date and tickers columns."""
+    import sentimize_data
+    sentimize_data.DEFER_TO_BATCH_API = True
+    rows = 0
+    kept = []
+    start = time.perf_counter()
+    for chunk in read_rows(csv_path):
+        processed = sentimize_data.extraction(chunk, matcher)
+        rows += len(processed)
+        kept.append(processed[['date', 'tickers']])
+    seconds = time.perf_counter() - start
+    labeled = pd.concat(kept, ignore_index=True)
+    with_tickers = int((labeled['tickers'] != '[]').sum())
+    return throughput(rows, seconds, rows_with_tickers=with_tickers), labeled
+
+
+def bench_extraction_local(csv_path, matcher):
+    """extraction() on every row with sentiment_backends' local scorer labeling the ticker rows, no API at all."""
+    import sentimize_data
+    from sentiment_backends import LocalFirstClient, make_backend
+    sentimize_data.DEFER_TO_BATCH_API = False
+    client = LocalFirstClient(make_backend(LOCAL_BACKEND))
+    rows = 0
+    start = time.perf_counter()
+    for chunk in read_rows(csv_path):
+        rows += len(sentimize_data.extraction(chunk, matcher, client))
+    seconds = time.perf_counter() - start
+    return throughput(rows, seconds, labeled=client.stats['local'], local=client.report())
+
+
+def bench_extraction_api(csv_path, matcher, base_url, rows):
+    import sentimize_data
+    from sentiment_client import AsyncSentimentClient
+    sentimize_data.DEFER_TO_BATCH_API = False
+    sentimize_data.sentiment_cache = None # a warm cache would make every run after the first look free
+    client = AsyncSentimentClient(max_concurrency=MAX_CONCURRENT_REQUESTS, base_url=base_url)
+    done = 0
+    start = time.perf_counter()
+    for chunk in read_rows(csv_path):
+        chunk = chunk.iloc[:rows - done]
+        sentimize_data.extraction(chunk, matcher, client)
+        done += len(chunk)
+        if done >= rows:
+            break
+    seconds = time.perf_counter() - start
+    result = throughput(done, seconds)
+    result['api'] = client.report(done, seconds)
+    return result
+
+
+def bench_aggregates(labeled, seed=make_synthetic_dump.SEED):
+    from aggregates import SENTIMENT_CLASSES, aggregate_sentiment
+    # the mock's labels aren't the point here, any fixed mix of classes does
+    rng = np.random.default_rng(seed)
+    df = labeled.copy()
+    df['sentiment'] = np.asarray(SENTIMENT_CLASSES, dtype=object)[rng.integers(0, 3, len(df))]
+    result, seconds = timed(aggregate_sentiment, df)
+    return throughput(len(df), seconds, output_rows=len(result))
+
+
+def run_size(name, rows, tickers, base_url):
+    from ticker_matcher import build_ticker_matcher
+    dump_path = ensure_dump(rows, tickers)
+    work_dir = os.path.join(DATA_DIR, f"work_{name}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    matcher = build_ticker_matcher(tickers)
+    result = {'rows': rows, 'dump_bytes': os.path.getsize(dump_path), 'benchmarks': {}}
+    benchmarks = result['benchmarks']
+    try:
+        print(f"[{name}] read_lines_zst")
+        benchmarks['read_lines_zst'] = bench_read_lines(dump_path)
+        print(f"[{name}] process_file, every post")
+        all_posts = os.path.join(work_dir, "all_posts")
+        benchmarks['process_file'] = bench_process_file(dump_path, all_posts, None, [])
+        print(f"[{name}] process_file, filtered on {', '.join(FILTER_VALUES)}")
+        benchmarks['process_file_filtered'] = bench_process_file(dump_path, os.path.join(work_dir, "filtered_posts"), FILTER_FIELD, FILTER_VALUES)
+        print(f"[{name}] extraction, tickers only")
+        benchmarks['extraction_tickers'], labeled = bench_extraction_tickers(f"{all_posts}.csv", matcher)
+        print(f"[{name}] extraction with the {LOCAL_BACKEND} sentiment backend")
+        benchmarks['extraction_local'] = bench_extraction_local(f"{all_posts}.csv", matcher)
+        print(f"[{name}] extraction with {min(rows, API_ROWS):,} rows against the mock API")
+        benchmarks['extraction_api'] = bench_extraction_api(f"{all_posts}.csv", matcher, base_url, min(rows, API_ROWS))
+        print(f"[{name}] aggregate_sentiment")
+        benchmarks['aggregate_sentiment'] = bench_aggregates(labeled)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """Prints new/old time for every benchmark both runs have. Returns the number of regressions."""
+    with open(old_path, 'r', encoding='utf-8') as handle:
+        old = json.load(handle)
+    with open(new_path, 'r', encoding='utf-8') as handle:
+        new = json.load(handle)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for size, new_size in new['results'].items():
+        old_size = old['results'].get(size)
+        if old_size is None:
+            continue
+        for bench, new_bench in new_size['benchmarks'].items():
+            old_bench = old_size['benchmarks'].get(bench)
+            if old_bench is None or not old_bench['seconds']:
+                continue
+            ratio = new_bench['seconds'] / old_bench['seconds']
+            flag = ""
+            if ratio > threshold:
+                flag = "  <-- slower"
+                regressions += 1
+            elif ratio < 1 / threshold:
+                flag = "  faster"
+            print(f"{size:>4} {bench:<22} {old_bench['seconds']:>10.3f}s -> {new_bench['seconds']:>10.3f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--compare':
+        if len(sys.argv) != 4:
+            print("Usage: python bench_suite.py --compare before.json after.json")
+            exit(1)
+        exit(1 if compare(sys.argv[2], sys.argv[3]) else 0)
+    sizes = sys.argv[1:] or DEFAULT_SIZES
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        print(f"Error: unknown size(s) {', '.join(unknown)}, pick from {', '.join(SIZES)}")
+        exit(1)
+    try:
+        with open(ticker_file, 'r') as f:
+            tickers = [line.strip().lower() for line in f if line.strip()]
+    except FileNotFoundError:
+        print(f"Error: The file '{ticker_file}' was not found.")
+        exit(1)
+
+    server, base_url = start_server(latency_ms=MOCK_LATENCY_MS, jitter_ms=MOCK_JITTER_MS)
+    # sentimize_data.py makes its OpenAI client when it's imported, so point it at the mock first
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'test')
+    import dig_through
+    import sentimize_data
+    dig_through.log.setLevel("WARNING") # one line per batch is too much here
+    sentimize_data.VERBOSE_CHUNK_OUTPUT = False
+
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit, 'dirty': dirty, 'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+        'json_backend': dig_through.json_backend, 'pre_filter': dig_through.pre_filter,
+        'settings': {'generator_version': make_synthetic_dump.GENERATOR_VERSION, 'seed': make_synthetic_dump.SEED,
+                     'mock_latency_ms': MOCK_LATENCY_MS, 'mock_jitter_ms': MOCK_JITTER_MS, 'api_rows': API_ROWS,
+                     'max_concurrent_requests': MAX_CONCURRENT_REQUESTS, 'chunk_size': CHUNK_SIZE},
+        'results': {},
+    }
+    for size in sizes:
+        report['results'][size] = run_size(size, SIZES[size], tickers, base_url)
+        for bench, result in report['results'][size]['benchmarks'].items():
+            print(f"{size:>4} {bench:<22} {result['seconds']:>10.3f}s  {result['rows_per_second'] or 0:>12,.0f} rows/s")
+    server.shutdown()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}{'_dirty' if dirty else ''}.json")
+    with open(results_path, 'w', encoding='utf-8') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Results saved to '{results_path}'")
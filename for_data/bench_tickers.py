@@ -0,0 +1,60 @@
+# Checks the compiled ticker matcher against the old per-ticker loop and times both.
+# Run it on the full dump (wsb_sub_sentiment.csv, ~2.1 million rows) before trusting a matcher change.
+import sys
+import time
+import pandas as pd
+from ticker_matcher import build_ticker_matcher, match_tickers, match_tickers_loop
+
+file_path = 'wsb_sub_sentiment.csv'
+ticker_file = 'ticker_list.txt'
+chunk_size = 50_000
+SKIP_LOOP = False # Set to True to only time the compiled matcher (the loop takes hours on the full dump)
+
+
+def combined_texts(chunk, title_col='title', selftext_col='selftext'):
+    # same text extraction() builds before searching
+    titles = chunk[title_col].fillna('').astype(str).str.lower()
+    selftexts = chunk[selftext_col].fillna('').astype(str).str.lower()
+    return (titles + " " + selftexts).tolist()
+
+
+def compare(file_path, tickers):
+    matcher = build_ticker_matcher(tickers)
+    print(f"{len(tickers)} tickers compiled into {len(matcher)} pattern(s)")
+    rows = 0
+    mismatches = 0
+    matcher_seconds = 0.0
+    loop_seconds = 0.0
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        texts = [text for text in combined_texts(chunk) if text.strip()]
+        rows += len(chunk)
+
+        start = time.perf_counter()
+        fast = [match_tickers(matcher, text) for text in texts]
+        matcher_seconds += time.perf_counter() - start
+
+        if SKIP_LOOP:
+            continue
+        start = time.perf_counter()
+        slow = [match_tickers_loop(tickers, text) for text in texts]
+        loop_seconds += time.perf_counter() - start
+
+        for text, fast_set, slow_set in zip(texts, fast, slow):
+            if fast_set != slow_set:
+                mismatches += 1
+                print(f"MISMATCH: {sorted(fast_set)} != {sorted(slow_set)} for {text[:80]!r}")
+        print(f"{rows:,} rows : matcher {matcher_seconds:.1f}s : loop {loop_seconds:.1f}s : {mismatches} mismatches")
+
+    print(f"Done: {rows:,} rows, {mismatches} mismatches")
+    print(f"Compiled matcher: {matcher_seconds:.2f}s ({rows / max(matcher_seconds, 1e-9):,.0f} rows/s)")
+    if not SKIP_LOOP:
+        print(f"Per-ticker loop:  {loop_seconds:.2f}s ({rows / max(loop_seconds, 1e-9):,.0f} rows/s)")
+    return mismatches
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        file_path = sys.argv[1]
+    with open(ticker_file, 'r') as f:
+        tickers = [line.strip().lower() for line in f if line.strip()]
+    sys.exit(1 if compare(file_path, tickers) else 0)
@@ -0,0 +1,84 @@
+# Times dig_through.py's bytes-level zstd line reader against the old str-decoding generator and checks they yield the same lines.
+#   python bench_zst_reader.py [wallstreetbets_submissions.zst]
+import sys
+import time
+import zstandard
+from dig_through import read_lines_zst
+
+file_path = 'wallstreetbets_submissions.zst'
+SKIP_OLD = False # Set to True to only time the new reader
+
+
+def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
+	# the previous reader: decode every chunk to str, re-reading (recursively) when a character is split
+	chunk = reader.read(chunk_size)
+	bytes_read += chunk_size
+	if previous_chunk is not None:
+		chunk = previous_chunk + chunk
+	try:
+		return chunk.decode()
+	except UnicodeDecodeError:
+		if bytes_read > max_window_size:
+			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
+		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+
+
+def read_lines_zst_old(file_name):
+	with open(file_name, 'rb') as file_handle:
+		buffer = ''
+		reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+		while True:
+			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
+
+			if not chunk:
+				break
+			lines = (buffer + chunk).split("\n")
+
+			for line in lines[:-1]:
+				yield line.strip(), file_handle.tell()
+
+			buffer = lines[-1]
+
+		reader.close()
+
+
+def time_new(file_path):
+	start = time.perf_counter()
+	lines = 0
+	decompressed_bytes = 0
+	for line, _, decompressed_bytes in read_lines_zst(file_path):
+		lines += 1
+	return lines, decompressed_bytes, time.perf_counter() - start
+
+
+def time_old(file_path):
+	start = time.perf_counter()
+	lines = 0
+	for line, _ in read_lines_zst_old(file_path):
+		lines += 1
+	return lines, time.perf_counter() - start
+
+
+def compare(file_path):
+	mismatches = 0
+	for (new_line, *_), (old_line, _) in zip(read_lines_zst(file_path), read_lines_zst_old(file_path)):
+		if new_line.decode('utf-8', errors='replace') != old_line:
+			mismatches += 1
+	return mismatches
+
+
+if __name__ == "__main__":
+	if len(sys.argv) > 1:
+		file_path = sys.argv[1]
+	lines, decompressed_bytes, seconds = time_new(file_path)
+	megabytes = decompressed_bytes / 2**20
+	print(f"new reader: {lines:,} lines, {megabytes:,.1f} MB in {seconds:.2f}s, {megabytes / seconds:,.1f} MB/s")
+	if SKIP_OLD:
+		exit(0)
+	old_lines, old_seconds = time_old(file_path)
+	print(f"old reader: {old_lines:,} lines, {megabytes:,.1f} MB in {old_seconds:.2f}s, {megabytes / old_seconds:,.1f} MB/s")
+	print(f"speedup {old_seconds / seconds:.2f}x")
+	mismatches = compare(file_path)
+	print(f"{mismatches:,} mismatched lines" if mismatches else "identical lines")
+	if mismatches or lines != old_lines:
+		exit(1)
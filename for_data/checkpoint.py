@@ -0,0 +1,134 @@
+# Crash-safe resume for sentimize_data.py. The journal records how far into the input CSV we are (rows and
+# byte offset) and how big the output was after the last fully written chunk. On restart the input is seeked
+# straight to the first unprocessed row and any half-written chunk is cut off the output, so rows are never
+# lost or duplicated.
+import csv
+import io
+import json
+import os
+import pandas as pd
+
+
+class Checkpoint:
+    """JSON journal of the last committed chunk, replaced atomically on every save."""
+
+    def __init__(self, path, input_path, output_path):
+        self.path = path
+        self.input_path = input_path
+        self.output_path = output_path
+        self.input_offset = 0 # byte offset of the first unprocessed row (0 = right after the header)
+        self.rows_done = 0
+        self.chunks_done = 0
+        self.output_size = 0
+
+    @classmethod
+    def load(cls, path, input_path, output_path):
+        checkpoint = cls(path, input_path, output_path)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state['input_path'] != os.path.abspath(input_path) or state['output_path'] != os.path.abspath(output_path):
+                raise ValueError(f"Checkpoint '{path}' belongs to {state['input_path']} -> {state['output_path']}")
+            checkpoint.input_offset = state['input_offset']
+            checkpoint.rows_done = state['rows_done']
+            checkpoint.chunks_done = state['chunks_done']
+            checkpoint.output_size = state['output_size']
+        return checkpoint
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self):
+        state = {
+            'input_path': os.path.abspath(self.input_path),
+            'output_path': os.path.abspath(self.output_path),
+            'input_offset': self.input_offset,
+            'rows_done': self.rows_done,
+            'chunks_done': self.chunks_done,
+            'output_size': self.output_size,
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path) # atomic, a crash leaves either the old or the new journal
+
+    def repair_output(self):
+        """Cut anything written after the last committed chunk off the output file."""
+        if not os.path.exists(self.output_path):
+            if self.output_size:
+                raise ValueError(f"Checkpoint expects {self.output_size:,} bytes in '{self.output_path}' but it is missing")
+            return
+        size = os.path.getsize(self.output_path)
+        if size < self.output_size:
+            raise ValueError(f"'{self.output_path}' is {size:,} bytes, smaller than the {self.output_size:,} committed")
+        if size > self.output_size:
+            print(f"Truncating {size - self.output_size:,} uncommitted bytes from '{self.output_path}'")
+            with open(self.output_path, 'r+b') as f:
+                f.truncate(self.output_size)
+
+    def record_output_rewrite(self):
+        """Call after the committed output was rewritten in place (e.g. batch results merged into it)."""
+        if self.exists():
+            self.output_size = os.path.getsize(self.output_path)
+            self.save()
+
+    def commit(self, input_offset, rows, output_size):
+        self.input_offset = input_offset
+        self.rows_done += rows
+        self.chunks_done += 1
+        self.output_size = output_size
+        self.save()
+
+
+def _lines_with_offsets(handle, positions):
+    # feeds csv.reader one physical line at a time and remembers where each ended, so after the reader
+    # hands back a record we know the exact byte offset of the next one (quoted selftext spans lines)
+    while True:
+        line = handle.readline()
+        if not line:
+            return
+        positions.append((handle.tell(), line))
+        yield line.decode('utf-8')
+
+
+def iter_csv_chunks(file_path, chunk_size, start_offset=0):
+    """Yield (chunk DataFrame, byte offset after the chunk) from a headered CSV, starting at a byte offset.
+
+    Each chunk is parsed by pd.read_csv from its own raw bytes, so dtypes match reading the whole file.
+    """
+    with open(file_path, 'rb') as handle:
+        header = handle.readline()
+        if start_offset:
+            handle.seek(start_offset)
+        positions = []
+        reader = csv.reader(_lines_with_offsets(handle, positions))
+        rows = 0
+        for _ in reader:
+            rows += 1
+            if rows == chunk_size:
+                end_offset = positions[-1][0]
+                yield pd.read_csv(io.BytesIO(header + b''.join(line for _, line in positions))), end_offset
+                positions.clear()
+                rows = 0
+        if rows:
+            end_offset = positions[-1][0]
+            yield pd.read_csv(io.BytesIO(header + b''.join(line for _, line in positions))), end_offset
+
+
+def offset_after_rows(file_path, rows_to_skip):
+    """Byte offset of the first row after `rows_to_skip` data rows, without building any DataFrames."""
+    with open(file_path, 'rb') as handle:
+        handle.readline()
+        if rows_to_skip <= 0:
+            return 0
+        positions = []
+        reader = csv.reader(_lines_with_offsets(handle, positions))
+        offset = handle.tell()
+        for rows, _ in enumerate(reader, start=1):
+            offset = positions[-1][0]
+            positions.clear()
+            if rows == rows_to_skip:
+                break
+        return offset
@@ -0,0 +1,242 @@
+# Compact in-memory form of the processed dataset, for analyses that keep all of it loaded.
+# load_processed() gives object strings per row: sentiment, the tickers JSON (plus a list once parsed), "u/author",
+# a full permalink and the texts. load_compact() reads the same data chunk by chunk into typed arrays instead:
+#   date datetime64, score int32, sentiment categorical (int8 codes, SENTIMENT_CLASSES first), author categorical
+#   without the "u/", post_id (the permalink's base 36 id as int64), row_id, and tickers as CSR arrays of ticker codes
+# Text columns are dropped unless asked for, CompactPosts.text() reads them back for just the rows that need them.
+# Ticker filtering is an integer comparison over the codes (ticker_mask) instead of a lambda per row.
+#   python compact_data.py [wsb_sub_processed.csv | wsb_sub_processed_parquet]
+# compares the memory of both forms and the time to find a ticker's rows.
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+try:
+    from aggregates import SENTIMENT_CLASSES, encode_tickers
+    from processed_store import iter_processed, load_processed, read_processed
+except ImportError: # imported from the repo root as for_data.compact_data
+    from for_data.aggregates import SENTIMENT_CLASSES, encode_tickers
+    from for_data.processed_store import iter_processed, load_processed, read_processed
+
+PROCESSED_PATH = 'wsb_sub_processed.csv'
+ARRAY_COLUMNS = ['score', 'date', 'author', 'permalink', 'sentiment', 'tickers']
+TEXT_COLUMNS = ['title', 'selftext', 'ai_reason', 'permalink'] # what text() can read back, permalink in full
+PERMALINK_URL = 'https://www.reddit.com/r/wallstreetbets/comments/{}/' # reddit redirects it to the full permalink
+AUTHOR_PREFIX = 'u/'
+CHUNK_ROWS = 200_000
+
+
+def smallest_int(values, at_least=np.int32):
+    # int32 unless the values need int64
+    values = np.asarray(values)
+    if len(values) and (values.max() > np.iinfo(at_least).max or values.min() < np.iinfo(at_least).min):
+        return values.astype(np.int64)
+    return values.astype(at_least)
+
+
+def encode_values(values, lookup, transform=None):
+    """Codes of values into lookup (value -> code), adding values it hasn't seen yet, -1 for missing ones. Only the
+    distinct values of the chunk go through Python."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    if transform is not None:
+        uniques = [transform(value) for value in uniques]
+    mapping = np.array([lookup.setdefault(value, len(lookup)) for value in uniques], dtype=np.int64)
+    return np.where(codes >= 0, mapping[codes] if len(mapping) else -1, -1)
+
+
+def post_ids(permalinks):
+    """The base 36 post id out of each permalink as int64, -1 where there isn't one."""
+    ids = pd.Series(permalinks, dtype=object).str.extract(r'/comments/([0-9a-z]+)', expand=False)
+    return np.array([int(value, 36) if isinstance(value, str) else -1 for value in ids], dtype=np.int64)
+
+
+def base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while True:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+        if not number:
+            return text
+
+
+class CompactPosts:
+    """The processed dataset as typed arrays: `frame` holds the per row columns, the tickers are CSR arrays so row i
+    mentions ticker_names[ticker_codes[ticker_offsets[i]:ticker_offsets[i + 1]]]. `source` is where text() reads the
+    text columns from, row_ids() the rows' 0-based data rows there (the Parquet store's row_id). Those are only
+    stored (frame['row_id']) when they aren't simply 0..n-1."""
+
+    def __init__(self, frame, ticker_offsets, ticker_codes, ticker_names, source=None):
+        self.frame = frame
+        self.ticker_offsets = ticker_offsets
+        self.ticker_codes = ticker_codes
+        self.ticker_names = list(ticker_names)
+        self.ticker_lookup = {name: code for code, name in enumerate(self.ticker_names)}
+        self.source = source
+
+    def __len__(self):
+        return len(self.frame)
+
+    def row_ids(self):
+        return self.frame['row_id'].to_numpy() if 'row_id' in self.frame.columns else np.arange(len(self.frame))
+
+    def memory_usage(self):
+        """Bytes held, the frame (deep) and the ticker arrays."""
+        return int(self.frame.memory_usage(deep=True).sum()) + self.ticker_offsets.nbytes + self.ticker_codes.nbytes \
+            + sum(sys.getsizeof(name) for name in self.ticker_names)
+
+    def ticker_mask(self, *tickers):
+        """Boolean array, True for the rows that mention any of tickers."""
+        wanted = [self.ticker_lookup[ticker] for ticker in tickers if ticker in self.ticker_lookup]
+        hits = np.zeros(len(self.ticker_codes) + 1, dtype=np.int64)
+        np.cumsum(np.isin(self.ticker_codes, wanted), out=hits[1:])
+        # hits per row from the running count at both ends of its slice, no per row loop
+        return hits[self.ticker_offsets[1:]] > hits[self.ticker_offsets[:-1]]
+
+    def ticker_counts(self):
+        """Rows mentioning each ticker, most mentioned first."""
+        counts = np.bincount(self.ticker_codes, minlength=len(self.ticker_names))
+        return pd.Series(counts, index=pd.Index(self.ticker_names, name='ticker'), name='count').sort_values(ascending=False, kind='stable')
+
+    def tickers(self, row):
+        return [self.ticker_names[code] for code in self.ticker_codes[self.ticker_offsets[row]:self.ticker_offsets[row + 1]]]
+
+    def select(self, mask):
+        """CompactPosts of only the rows where mask (boolean array) is True, or of the given row positions."""
+        rows = np.flatnonzero(mask) if np.asarray(mask).dtype == bool else np.asarray(mask, dtype=np.int64)
+        starts = self.ticker_offsets[:-1][rows]
+        lengths = self.ticker_offsets[1:][rows] - starts
+        offsets = np.zeros(len(rows) + 1, dtype=self.ticker_offsets.dtype)
+        np.cumsum(lengths, out=offsets[1:])
+        postings = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        frame = self.frame.iloc[rows].reset_index(drop=True)
+        if 'row_id' not in frame.columns:
+            frame.insert(0, 'row_id', smallest_int(rows))
+        return CompactPosts(frame, offsets, self.ticker_codes[postings], self.ticker_names, self.source)
+
+    def permalinks(self):
+        """Short permalink per row, rebuilt from post_id."""
+        return pd.Series([PERMALINK_URL.format(base36(post_id)) if post_id >= 0 else None for post_id in self.frame['post_id']], dtype=object)
+
+    def text(self, column, rows=None):
+        """One text column for the given row positions (all when None), read back from source. Series on those
+        positions."""
+        rows = np.arange(len(self)) if rows is None else (np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows, dtype=np.int64))
+        if column in self.frame.columns:
+            return self.frame[column].iloc[rows].set_axis(rows)
+        if self.source is None:
+            raise ValueError(f"'{column}' wasn't loaded and there is no source to read it from")
+        if not len(rows):
+            return pd.Series([], index=rows, dtype=object, name=column) # nothing to read, and an empty wanted has no [-1]
+        row_ids = self.row_ids()[rows]
+        if os.path.isdir(self.source):
+            values = read_processed(self.source, ['row_id', column], row_ids=row_ids.tolist()).set_index('row_id')[column]
+        else:
+            # the CSV can only be read front to back, keep the wanted rows of each chunk
+            wanted = np.unique(row_ids)
+            parts = []
+            for chunk in pd.read_csv(self.source, usecols=[column], chunksize=CHUNK_ROWS):
+                keep = wanted[(wanted >= chunk.index[0]) & (wanted <= chunk.index[-1])]
+                if len(keep):
+                    parts.append(chunk[column].loc[keep])
+                if wanted[-1] <= chunk.index[-1]:
+                    break
+            values = pd.concat(parts) if parts else pd.Series(dtype=object)
+        return pd.Series(values.reindex(row_ids).to_numpy(), index=rows, name=column)
+
+    def to_frame(self, rows=None):
+        """Plain DataFrame like load_processed() gives (tickers as lists), for code that wants one. Only for the given
+        row positions when rows isn't None, which is what keeps it cheap."""
+        posts = self if rows is None else self.select(rows)
+        frame = posts.frame.copy()
+        frame['tickers'] = [posts.tickers(row) for row in range(len(posts))]
+        return frame
+
+
+def load_compact(path, text_columns=(), start=None, end=None, chunk_size=CHUNK_ROWS):
+    """CompactPosts of the processed data at path (Parquet store or CSV), rows dated start..end. text_columns are
+    loaded as they are, the others are left for CompactPosts.text()."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Processed file not found: {path}")
+    text_columns = [column for column in text_columns if column in TEXT_COLUMNS]
+    columns = list(dict.fromkeys(ARRAY_COLUMNS + text_columns))
+    if os.path.isdir(path):
+        columns = ['row_id'] + columns
+    sentiments = {name: code for code, name in enumerate(SENTIMENT_CLASSES)}
+    authors, tickers = {}, {}
+    parts = {name: [] for name in ['row_id', 'date', 'score', 'sentiment', 'author', 'post_id'] + text_columns}
+    offsets, codes, postings = [np.zeros(1, dtype=np.int64)], [], 0
+    for chunk in iter_processed(path, columns, start, end, chunk_size):
+        # the CSV reader numbers rows across chunks, which is the CSV's data row
+        parts['row_id'].append(chunk['row_id'].to_numpy(dtype=np.int64) if 'row_id' in chunk.columns else chunk.index.to_numpy(dtype=np.int64))
+        parts['date'].append(pd.to_datetime(chunk['date']).to_numpy(dtype='datetime64[ms]'))
+        parts['score'].append(pd.to_numeric(chunk['score'], errors='coerce').fillna(0).to_numpy(dtype=np.int64))
+        parts['sentiment'].append(encode_values(chunk['sentiment'].astype(object), sentiments))
+        parts['author'].append(encode_values(chunk['author'].astype(object), authors,
+                                             lambda name: name[len(AUTHOR_PREFIX):] if isinstance(name, str) and name.startswith(AUTHOR_PREFIX) else name))
+        parts['post_id'].append(post_ids(chunk['permalink']))
+        for column in text_columns:
+            parts[column].append(chunk[column].to_numpy())
+        chunk_offsets, chunk_codes, chunk_names = encode_tickers(chunk['tickers'])
+        mapping = np.array([tickers.setdefault(name, len(tickers)) for name in chunk_names], dtype=np.int64)
+        codes.append(mapping[chunk_codes] if len(chunk_codes) else np.zeros(0, dtype=np.int64))
+        offsets.append(chunk_offsets[1:] + postings)
+        postings += len(chunk_codes)
+
+    def joined(name, dtype):
+        return np.concatenate(parts[name]).astype(dtype) if parts[name] else np.zeros(0, dtype=dtype)
+
+    row_ids = joined('row_id', np.int64)
+    frame = pd.DataFrame({
+        'date': joined('date', 'datetime64[ms]'),
+        'score': smallest_int(joined('score', np.int64)),
+        'sentiment': pd.Categorical.from_codes(joined('sentiment', np.int64), categories=list(sentiments)),
+        'author': pd.Categorical.from_codes(joined('author', np.int64), categories=[str(name) for name in authors]),
+        'post_id': joined('post_id', np.int64),
+    })
+    for column in text_columns:
+        frame[column] = joined(column, object)
+    ticker_codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+    ticker_codes = ticker_codes.astype(np.int16 if len(tickers) <= np.iinfo(np.int16).max else np.int32)
+    frame.insert(0, 'row_id', smallest_int(row_ids))
+    posts = CompactPosts(frame, smallest_int(np.concatenate(offsets)), ticker_codes, list(tickers), source=path)
+    if not np.all(row_ids[1:] > row_ids[:-1]):
+        # Parquet partitions come back in directory order, keep the CSV's row order like read_processed() does
+        posts = posts.select(np.argsort(row_ids, kind='stable'))
+    if np.array_equal(posts.row_ids(), np.arange(len(posts))):
+        posts.frame = posts.frame.drop(columns='row_id') # the whole file in order, row_ids() gives them for free
+    return posts
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else PROCESSED_PATH
+    if not os.path.exists(path):
+        print(f"Error: The file '{path}' was not found.")
+        exit(1)
+    started = time.perf_counter()
+    posts = load_compact(path)
+    compact_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    df = load_processed(path)
+    plain_seconds = time.perf_counter() - started
+    plain = int(df.memory_usage(deep=True).sum())
+    print(f"{len(posts):,} rows: compact {posts.memory_usage() / 2**20:,.1f} MB in {compact_seconds:.1f}s, "
+          f"load_processed() {plain / 2**20:,.1f} MB in {plain_seconds:.1f}s ({plain / max(posts.memory_usage(), 1):.1f}x)")
+    without_text = int(df.drop(columns=[column for column in TEXT_COLUMNS if column != 'permalink'], errors='ignore').memory_usage(deep=True).sum())
+    print(f"without title/selftext/ai_reason: {without_text / 2**20:,.1f} MB ({without_text / max(posts.memory_usage(), 1):.1f}x)")
+
+    ticker = posts.ticker_counts().index[0] if len(posts.ticker_names) else None
+    if ticker is not None:
+        started = time.perf_counter()
+        mask = posts.ticker_mask(ticker)
+        mask_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        # what filtering the plain frame takes: parse every row's tickers and look for the ticker
+        lambda_mask = df['tickers'].apply(lambda value: ticker in (json.loads(value) if isinstance(value, str) else list(value)))
+        lambda_seconds = time.perf_counter() - started
+        if not np.array_equal(mask, lambda_mask.to_numpy()):
+            print(f"Error: ticker_mask('{ticker}') doesn't match the rows that mention it")
+            exit(1)
+        print(f"rows mentioning {ticker}: {mask.sum():,}, ticker_mask {mask_seconds * 1000:.1f} ms, apply(lambda) {lambda_seconds * 1000:.1f} ms")
@@ -5,8 +5,33 @@ import os
 import json
 import sys
 import csv
+import re
+import time
+import io
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import logging.handlers
+from metrics import Metrics
+# orjson (or simdjson) parses the lines that survive the pre-filter several times faster, plain json works too
+try:
+	import orjson
+	fast_loads = orjson.loads
+	json_backend = "orjson"
+except ImportError:
+	try:
+		import simdjson
+		fast_loads = simdjson.loads
+		json_backend = "simdjson"
+	except ImportError:
+		fast_loads = None
+		json_backend = "json"
+# substring filters use an Aho-Corasick automaton when pyahocorasick is installed, otherwise a trie shaped regex
+try:
+	import ahocorasick
+except ImportError:
+	ahocorasick = None
 
 # put the path to the input file, or a folder of files to process all of
 input_file = r"/Users/deboy/Projects/2025/SocialMediaStockPulse/send/wallstreetbets_submissions.zst"
@@ -78,13 +103,33 @@ to_date = datetime.strptime("2022-12-31", "%Y-%m-%d")
 # if you want only top level comments instead of all comments, you can set field to "parent_id" instead of "link_id"
 
 # change this to field = None if you don't want to filter by anything
+# a list of fields matches if any of them matches, for example field = ["title", "selftext"]
 field = "selftext"
 values = ['']
 # if you have a long list of values, you can put them in a file and put the filename here. If set this overrides the value list above
-# if this list is very large, it could greatly slow down the process
+# exact matches are a set lookup and substring matches go through one prebuilt automaton, so tens of thousands of values cost about the same as one
 values_file = None # stock stickers, on different lines (check out ticker_list.txt)
 exact_match = False
 
+# number of worker processes that decode and filter lines. 1 keeps everything in this process
+# the main process only decompresses and writes, so this scales until zstd becomes the bottleneck
+workers = 1
+# lines handed to a worker at a time. Output is written in the same order the batches were read
+batch_lines = 100000
+# time spent decompressing, pre-filtering, parsing, matching, formatting and writing is logged at the end of each file
+# and saved as json next to the output ({output_file}.metrics.json). Set to False to skip the file
+write_metrics = True
+# reject lines from their raw bytes (created_utc outside the dates, none of the values anywhere in the line) before
+# parsing the json. The matched output is the same, but lines dropped this way aren't counted as bad lines even if
+# their json is broken. Set to False to parse every line
+pre_filter = True
+# a dump re-encoded with make_seekable_zst.py is a series of independent zstd frames with a sidecar index
+# (<file>.index.json) of the created_utc range in each. With this on, only the frames overlapping from_date/to_date
+# are decompressed instead of the whole file. Files without an index are read from the start as usual
+use_time_index = True
+# decompressed size of each frame when re-encoding. Smaller frames skip more precisely but compress a bit worse
+seekable_frame_bytes = 16 * 2**20
+
 
 # sets up logging to the console as well as a file
 log = logging.getLogger("bot")
@@ -118,7 +163,7 @@ def write_line_single(handle, obj, field):
 	handle.write("\n")
 
 
-def write_line_csv(writer, obj, is_submission):
+def csv_row(obj, is_submission):
 	output_list = []
 	output_list.append(str(obj['score']))
 	output_list.append(datetime.fromtimestamp(int(obj['created_utc'])).strftime("%Y-%m-%d"))
@@ -139,115 +184,498 @@ def write_line_csv(writer, obj, is_submission):
 			output_list.append(obj['url'])
 	else:
 		output_list.append(obj['body'])
-	writer.writerow(output_list)
+	return output_list
 
 
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		log.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+def write_line_csv(writer, obj, is_submission):
+	writer.writerow(csv_row(obj, is_submission))
 
 
-def read_lines_zst(file_name):
+def read_lines_zst(file_name, chunk_size=2**27):
+	# yields (line bytes, compressed bytes read, decompressed bytes read). Lines are split on b"\n" inside one reusable
+	# buffer and left undecoded, json.loads takes bytes and only matched lines get decoded for output. A newline byte
+	# never occurs inside a multibyte UTF-8 character, so a character split across two reads needs no special handling
 	with open(file_name, 'rb') as file_handle:
-		buffer = ''
 		reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
+		buffer = bytearray(chunk_size)
+		view = memoryview(buffer)
+		filled = 0
+		decompressed_bytes = 0
 		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
-
-			if not chunk:
+			if filled == len(buffer):
+				# a single line bigger than the buffer, make room for the rest of it
+				view.release()
+				buffer.extend(bytes(len(buffer)))
+				view = memoryview(buffer)
+			read = reader.readinto(view[filled:])
+			if not read:
 				break
-			lines = (buffer + chunk).split("\n")
-
-			for line in lines[:-1]:
-				yield line.strip(), file_handle.tell()
-
-			buffer = lines[-1]
-
+			end = filled + read
+			file_bytes_processed = file_handle.tell()
+			start = 0
+			while True:
+				newline = buffer.find(b"\n", start, end)
+				if newline < 0:
+					break
+				yield bytes(view[start:newline]).strip(), file_bytes_processed, decompressed_bytes + newline + 1
+				start = newline + 1
+			# move the partial last line to the front, the next read continues after it
+			decompressed_bytes += start
+			buffer[:end - start] = buffer[start:end]
+			filled = end - start
+
+		if filled:
+			yield bytes(view[:filled]).strip(), file_handle.tell(), decompressed_bytes + filled
+		view.release()
 		reader.close()
 
 
-def process_file(input_file, output_file, output_format, field, values, from_date, to_date, single_field, exact_match):
-	output_path = f"{output_file}.{output_format}"
-	is_submission = "submission" in input_file
-	log.info(f"Input: {input_file} : Output: {output_path} : Is submission {is_submission}")
-	writer = None
-	if output_format == "zst":
-		handle = zstandard.ZstdCompressor().stream_writer(open(output_path, 'wb'))
-	elif output_format == "txt":
-		handle = open(output_path, 'w', encoding='UTF-8')
-	elif output_format == "csv":
-		handle = open(output_path, 'w', encoding='UTF-8', newline='')
-		writer = csv.writer(handle)
-	else:
-		log.error(f"Unsupported output format {output_format}")
-		sys.exit()
+def utc_timestamp(date):
+	# the same comparison the filter does on datetimes, as a raw timestamp (utcfromtimestamp treats it as UTC)
+	return (date - datetime(1970, 1, 1)).total_seconds()
 
-	file_size = os.stat(input_file).st_size
-	created = None
+
+def read_lines_zst_frames(file_name, frames):
+	# same as read_lines_zst, but only for the given frames of a seekable file (entries of its time index)
+	decompressor = zstandard.ZstdDecompressor(max_window_size=2**31)
+	with open(file_name, 'rb') as file_handle:
+		for frame in frames:
+			file_handle.seek(frame['offset'])
+			data = decompressor.decompress(file_handle.read(frame['size']), max_output_size=frame['decompressed_size'])
+			file_bytes_processed = frame['offset'] + frame['size']
+			start = 0
+			while True:
+				newline = data.find(b"\n", start)
+				if newline < 0:
+					break
+				yield data[start:newline].strip(), file_bytes_processed, frame['decompressed_offset'] + newline + 1
+				start = newline + 1
+			if start < len(data):
+				yield data[start:].strip(), file_bytes_processed, frame['decompressed_offset'] + len(data)
+
+
+CREATED_KEY = b'"created_utc":'
+CREATED_VALUE = re.compile(rb'"created_utc":\s*(?:(\d+)(?:\.\d*)?|"(\d+)")\s*[,}]')
+# the only characters that lowercase to something containing ascii are U+0130 (I with dot) and U+212A (kelvin sign).
+# A line with one of them, raw or as a json escape, can match a value that isn't in its raw bytes
+ASCII_LOWERCASE_UTF8 = (b'\xc4\xb0', b'\xe2\x84\xaa')
+ASCII_LOWERCASE_ESCAPES = (b'\\u0130', b'\\u212a')
+value_matchers = {}
+raw_matchers = {}
+
+
+def line_created_utc(line):
+	# created_utc of a raw line, None if it has none. Crossposts embed their parent's, so those are parsed
+	start = line.find(CREATED_KEY)
+	if start < 0:
+		return None
+	if line.find(CREATED_KEY, start + 1) < 0:
+		found = CREATED_VALUE.match(line, start)
+		if found is not None:
+			number, quoted = found.groups()
+			return int(number or quoted)
+	try:
+		return int(parse_line(line)['created_utc'])
+	except (KeyError, TypeError, ValueError, UnicodeDecodeError):
+		return None
+
+
+def time_index_path(file_name):
+	return f"{file_name}.index.json"
+
+
+def write_frame(handle, compressor, lines, decompressed_offset, created_range):
+	data = b"\n".join(lines) + b"\n"
+	offset = handle.tell()
+	handle.write(compressor.compress(data))
+	return {'offset': offset, 'size': handle.tell() - offset, 'decompressed_offset': decompressed_offset,
+		'decompressed_size': len(data), 'lines': len(lines), 'min_created_utc': created_range[0], 'max_created_utc': created_range[1]}
+
+
+def write_seekable(input_file, output_file, frame_bytes=seekable_frame_bytes, level=3):
+	# re-encodes a dump as independent frames of about frame_bytes (cut at line boundaries, lines stripped like
+	# read_lines_zst yields them) and writes the time index next to it. Returns the index
+	compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+	frames = []
+	lines = []
+	frame_size = 0
+	decompressed_offset = 0
+	created_range = [None, None]
+	temp_file = f"{output_file}.tmp"
+	with open(temp_file, 'wb') as handle:
+		for line, _, _ in read_lines_zst(input_file):
+			lines.append(line)
+			frame_size += len(line) + 1
+			created_utc = line_created_utc(line)
+			if created_utc is not None:
+				# the dumps are only roughly in time order, so every frame keeps its own min and max
+				created_range[0] = created_utc if created_range[0] is None else min(created_range[0], created_utc)
+				created_range[1] = created_utc if created_range[1] is None else max(created_range[1], created_utc)
+			if frame_size >= frame_bytes:
+				frames.append(write_frame(handle, compressor, lines, decompressed_offset, created_range))
+				decompressed_offset += frame_size
+				lines = []
+				frame_size = 0
+				created_range = [None, None]
+		if lines:
+			frames.append(write_frame(handle, compressor, lines, decompressed_offset, created_range))
+	os.replace(temp_file, output_file)
+	index = {'version': 1, 'source': os.path.basename(input_file), 'file_size': os.path.getsize(output_file),
+		'frame_bytes': frame_bytes, 'lines': sum(frame['lines'] for frame in frames), 'frames': frames}
+	with open(time_index_path(output_file), 'w', encoding='utf-8') as index_handle:
+		json.dump(index, index_handle)
+	return index
+
+
+def load_time_index(file_name):
+	# the sidecar index of a seekable file, None if there isn't one or it belongs to a different version of the file
+	path = time_index_path(file_name)
+	if not os.path.exists(path):
+		return None
+	with open(path, 'r', encoding='utf-8') as index_handle:
+		index = json.load(index_handle)
+	if index.get('file_size') != os.path.getsize(file_name):
+		log.warning(f"Ignoring {path}, it was made for a different version of {file_name}")
+		return None
+	return index
+
+
+def frames_in_range(index, from_timestamp, to_timestamp):
+	# frames that can hold a line between the two timestamps. A frame without any created_utc is kept, the
+	# filter decides about its lines like it would without the index
+	return [frame for frame in index['frames']
+		if frame['min_created_utc'] is None or (frame['max_created_utc'] >= from_timestamp and frame['min_created_utc'] <= to_timestamp)]
+
+
+def parse_line(line):
+	if fast_loads is None:
+		return json.loads(line)
+	try:
+		return fast_loads(line)
+	except ValueError:
+		# orjson rejects a few things json accepts (lone surrogates, huge ints), so json has the final say
+		return json.loads(line)
+
+
+def field_names(field):
+	if field is None:
+		return ()
+	if isinstance(field, str):
+		return (field,)
+	return tuple(field)
+
+
+def trie_pattern(values):
+	# regex source for "any of values" with shared prefixes factored out, (?:a(?:al|pl)|...), so the regex engine
+	# follows one branch per character instead of trying every value at every position
+	trie = {}
+	for value in values:
+		node = trie
+		for char in value:
+			node = node.setdefault(char, {})
+		node[''] = True
+
+	def emit(node):
+		branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char != '']
+		if not branches:
+			return ''
+		if len(branches) == 1 and '' not in node:
+			return branches[0]
+		return f"(?:{'|'.join(branches)}){'?' if '' in node else ''}"
+	return emit(trie)
+
+
+def value_matcher(values, exact_match):
+	# returns a function telling whether a lowercased field value matches. Built once per process and values list
+	key = (tuple(values), exact_match)
+	if key not in value_matchers:
+		if exact_match:
+			matches = frozenset(values).__contains__
+		elif '' in values:
+			matches = lambda text: True # the empty string is in everything
+		elif not values:
+			matches = lambda text: False
+		elif ahocorasick is not None:
+			automaton = ahocorasick.Automaton()
+			for value in values:
+				automaton.add_word(value, value)
+			automaton.make_automaton()
+			matches = lambda text: next(automaton.iter(text), None) is not None
+		else:
+			search = re.compile(trie_pattern(values)).search
+			matches = lambda text: search(text) is not None
+		value_matchers[key] = matches
+	return value_matchers[key]
+
+
+def raw_matcher(values, exact_match):
+	# what the pre-filter looks for in a field's lowercased raw string: the set of encoded values for exact matches,
+	# otherwise a compiled search. None if a value could be written differently in the raw json (escaped or non
+	# ascii characters), or is empty and so matches everything
+	key = (tuple(values), exact_match)
+	if key not in raw_matchers:
+		usable = len(values) > 0 and all(value and value.isascii() and value.isprintable() and not any(c in value for c in '"\\/') for value in values)
+		if not usable:
+			raw_matchers[key] = None
+		elif exact_match:
+			raw_matchers[key] = frozenset(value.encode('ascii') for value in values)
+		else:
+			raw_matchers[key] = re.compile(trie_pattern(values).encode('ascii'))
+	return raw_matchers[key]
+
+
+def raw_string_span(line, key):
+	# start and end of the raw (still escaped) string value after key, None if key isn't there exactly once
+	# (crossposts embed their parent's fields) or its value isn't a string
+	start = line.find(key)
+	if start < 0 or line.find(key, start + 1) >= 0:
+		return None
+	start += len(key)
+	while line[start:start + 1] == b' ':
+		start += 1
+	if line[start:start + 1] != b'"':
+		return None
+	end = start + 1
+	while True:
+		end = line.find(b'"', end)
+		if end < 0:
+			return None
+		backslashes = 0
+		while line[end - 1 - backslashes] == 0x5c:
+			backslashes += 1
+		if backslashes % 2 == 0:
+			return start + 1, end
+		end += 1
+
+
+def raw_field_may_match(line, field_key, matcher):
+	# False only when field_key's value in the raw line certainly doesn't match
+	if field_key not in line:
+		return False # missing field, nothing to match
+	span = raw_string_span(line, field_key)
+	raw = line[span[0]:span[1]] if span is not None else line
+	lowered = raw.lower()
+	if isinstance(matcher, frozenset):
+		if span is not None and b'\\' not in raw and raw.isascii():
+			return lowered in matcher # no escapes, so the raw string is the value
+		return True
+	if matcher.search(lowered) is not None:
+		return True
+	if b'\\u' in lowered and (ASCII_LOWERCASE_ESCAPES[0] in lowered or ASCII_LOWERCASE_ESCAPES[1] in lowered):
+		return True
+	return not raw.isascii() and (ASCII_LOWERCASE_UTF8[0] in raw or ASCII_LOWERCASE_UTF8[1] in raw)
+
+
+def pre_filter_lines(lines, fields, matcher, from_timestamp, to_timestamp):
+	# returns the lines that can still match and the last created_utc seen, looking only at the raw bytes.
+	# A line whose created_utc isn't a single plain number (missing, or a crosspost that embeds its parent's)
+	# is kept for the json parse to decide. The values are looked for in each field's raw string when it can be
+	# found, otherwise anywhere in the line
+	survivors = []
+	field_keys = [f'"{name}":'.encode('utf-8') for name in fields] if matcher is not None else []
+	created_utc = None
+	match_created = CREATED_VALUE.match
+	for line in lines:
+		start = line.find(CREATED_KEY)
+		if start >= 0 and line.find(CREATED_KEY, start + 1) < 0:
+			found = match_created(line, start)
+			if found is not None:
+				number, quoted = found.groups()
+				created_utc = int(number or quoted)
+				if created_utc < from_timestamp or created_utc > to_timestamp:
+					continue
+		if field_keys and not any(raw_field_may_match(line, field_key, matcher) for field_key in field_keys):
+			continue
+		survivors.append(line)
+	return survivors, created_utc
+
+
+def filter_lines(lines, output_format, field, values, from_date, to_date, single_field, exact_match, is_submission, pre_filter=False):
+	# decodes and filters one batch of lines, returning the formatted output so it can run in a worker process.
+	# output_format "rows" returns the csv rows as lists instead of text, for pipeline.py.
+	# The last value returned is the seconds spent per step, {pre_filter, parse, filter, format}, for metrics.py
+	output = io.StringIO(newline='')
+	writer = csv.writer(output) if output_format == "csv" else None
+	rows = []
+	created_utc = None
 	matched_lines = 0
 	bad_lines = 0
-	total_lines = 0
-	for line, file_bytes_processed in read_lines_zst(input_file):
-		total_lines += 1
-		if total_lines % 100000 == 0:
-			log.info(f"{created.strftime('%Y-%m-%d %H:%M:%S')} : {total_lines:,} : {matched_lines:,} : {bad_lines:,} : {file_bytes_processed:,}:{(file_bytes_processed / file_size) * 100:.0f}%")
-
+	warnings = []
+	# the same date comparison as below, done on the raw timestamp
+	from_timestamp = utc_timestamp(from_date)
+	to_timestamp = utc_timestamp(to_date)
+	fields = field_names(field)
+	matches = value_matcher(values, exact_match)
+	total_lines = len(lines)
+	clock = time.perf_counter
+	started = clock()
+	if pre_filter:
+		lines, raw_created_utc = pre_filter_lines(lines, fields, raw_matcher(values, exact_match) if fields else None, from_timestamp, to_timestamp)
+	loop_started = clock()
+	parse_seconds = 0.0
+	format_seconds = 0.0
+	for line in lines:
 		try:
-			obj = json.loads(line)
-			created = datetime.utcfromtimestamp(int(obj['created_utc']))
+			parse_started = clock()
+			obj = parse_line(line) # bytes, decoded here only because json needs the fields anyway
+			parse_seconds += clock() - parse_started
+			created_utc = int(obj['created_utc'])
+			created = datetime.utcfromtimestamp(created_utc)
 
 			if created < from_date:
 				continue
 			if created > to_date:
 				continue
 
-			if field is not None:
-				field_value = obj[field].lower()
-				matched = False
-				for value in values:
-					if exact_match:
-						if value == field_value:
-							matched = True
-							break
-					else:
-						if value in field_value:
-							matched = True
-							break
-				if not matched:
+			if fields:
+				field_values = [obj[name].lower() for name in fields if name in obj]
+				if not field_values:
+					raise KeyError(", ".join(fields))
+				if not any(matches(field_value) for field_value in field_values):
 					continue
 
 			matched_lines += 1
+			format_started = clock()
 			if output_format == "zst":
-				write_line_zst(handle, line)
+				output.write(line.decode('utf-8'))
+				output.write("\n")
 			elif output_format == "csv":
 				write_line_csv(writer, obj, is_submission)
+			elif output_format == "rows":
+				rows.append(csv_row(obj, is_submission))
 			elif output_format == "txt":
 				if single_field is not None:
-					write_line_single(handle, obj, single_field)
+					write_line_single(output, obj, single_field)
 				else:
-					write_line_json(handle, obj)
+					write_line_json(output, obj)
 			else:
-				log.info(f"Something went wrong, invalid output format {output_format}")
-		except (KeyError, json.JSONDecodeError) as err:
+				warnings.append(f"Something went wrong, invalid output format {output_format}")
+			format_seconds += clock() - format_started
+		except (KeyError, json.JSONDecodeError, UnicodeDecodeError) as err:
 			bad_lines += 1
 			if write_bad_lines:
 				if isinstance(err, KeyError):
-					log.warning(f"Key {field} is not in the object: {err}")
-				elif isinstance(err, json.JSONDecodeError):
-					log.warning(f"Line decoding failed: {err}")
-				log.warning(line)
+					warnings.append(f"Key {field} is not in the object: {err}")
+				else:
+					warnings.append(f"Line decoding failed: {err}")
+				warnings.append(line.decode('utf-8', errors='replace'))
+
+	if pre_filter and raw_created_utc is not None:
+		created_utc = raw_created_utc # from the last line of the batch, not the last one that survived
+	created = datetime.utcfromtimestamp(created_utc) if created_utc is not None else None
+	loop_seconds = clock() - loop_started
+	timings = {'pre_filter': loop_started - started, 'parse': parse_seconds, 'filter': loop_seconds - parse_seconds - format_seconds, 'format': format_seconds}
+	return rows if output_format == "rows" else output.getvalue(), total_lines, matched_lines, bad_lines, created, warnings, timings
+
+
+def read_batches(file_name, size, from_date=None, to_date=None):
+	# yields (lines, compressed bytes read, decompressed bytes read, seconds spent decompressing and splitting this batch).
+	# With both dates and a time index only the frames in that window are read
+	source = None
+	if use_time_index and from_date is not None and to_date is not None:
+		index = load_time_index(file_name)
+		if index is not None:
+			frames = frames_in_range(index, utc_timestamp(from_date), utc_timestamp(to_date))
+			skipped_bytes = index['file_size'] - sum(frame['size'] for frame in frames)
+			log.info(f"Time index: reading {len(frames):,} of {len(index['frames']):,} frames, skipping {skipped_bytes:,} compressed bytes")
+			source = read_lines_zst_frames(file_name, frames)
+	if source is None:
+		source = read_lines_zst(file_name)
+	lines = []
+	file_bytes_processed = 0
+	decompressed_bytes = 0
+	started = time.perf_counter()
+	for line, file_bytes_processed, decompressed_bytes in source:
+		lines.append(line)
+		if len(lines) >= size:
+			yield lines, file_bytes_processed, decompressed_bytes, time.perf_counter() - started
+			lines = []
+			started = time.perf_counter() # the time the consumer held on to the batch isn't ours
+	if lines:
+		yield lines, file_bytes_processed, decompressed_bytes, time.perf_counter() - started
+
+
+def filter_batches(batches, filter_args, workers):
+	# yields filter_lines results in input order. With workers > 1 at most 2 batches per worker are in flight,
+	# so a slow writer applies backpressure to the reader instead of the whole file ending up in memory
+	if workers <= 1:
+		for lines, *progress in batches:
+			yield filter_lines(lines, *filter_args), *progress
+		return
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		pending = deque()
+		for lines, *progress in batches:
+			pending.append((executor.submit(filter_lines, lines, *filter_args), progress))
+			if len(pending) >= workers * 2:
+				future, progress_at_submit = pending.popleft()
+				yield future.result(), *progress_at_submit
+		while pending:
+			future, progress_at_submit = pending.popleft()
+			yield future.result(), *progress_at_submit
+
+
+def process_file(input_file, output_file, output_format, field, values, from_date, to_date, single_field, exact_match, workers=1, pre_filter=False):
+	output_path = f"{output_file}.{output_format}"
+	is_submission = "submission" in input_file
+	log.info(f"Input: {input_file} : Output: {output_path} : Is submission {is_submission} : Workers {workers}")
+	if output_format == "zst":
+		handle = zstandard.ZstdCompressor().stream_writer(open(output_path, 'wb'))
+	elif output_format == "txt":
+		handle = open(output_path, 'w', encoding='UTF-8')
+	elif output_format == "csv":
+		handle = open(output_path, 'w', encoding='UTF-8', newline='')
+	else:
+		log.error(f"Unsupported output format {output_format}")
+		sys.exit()
 
-	handle.close()
-	log.info(f"Complete : {total_lines:,} : {matched_lines:,} : {bad_lines:,}")
+	file_size = os.stat(input_file).st_size
+	created = None
+	matched_lines = 0
+	bad_lines = 0
+	total_lines = 0
+	filter_args = (output_format, field, values, from_date, to_date, single_field, exact_match, is_submission, pre_filter)
+	decompressed_bytes = 0
+	start_time = time.perf_counter()
+	metrics = Metrics()
+	batches = read_batches(input_file, batch_lines, from_date, to_date)
+	for result, file_bytes_processed, decompressed_bytes, read_seconds in filter_batches(batches, filter_args, workers):
+		output, batch_total, batch_matched, batch_bad, batch_created, warnings, timings = result
+		metrics.add_time('decompress', read_seconds, batch_total)
+		metrics.add_timings(timings, batch_total)
+		metrics.count('lines', batch_total)
+		metrics.count('matched', batch_matched)
+		metrics.count('bad_lines', batch_bad)
+		total_lines += batch_total
+		matched_lines += batch_matched
+		bad_lines += batch_bad
+		if batch_created is not None:
+			created = batch_created
+		for warning in warnings:
+			log.warning(warning)
+
+		if output:
+			with metrics.time('write', batch_matched):
+				if output_format == "zst":
+					handle.write(output.encode('utf-8'))
+				else:
+					handle.write(output)
+
+		created_str = created.strftime('%Y-%m-%d %H:%M:%S') if created is not None else "-"
+		megabytes_per_second = decompressed_bytes / 2**20 / max(time.perf_counter() - start_time, 1e-9)
+		log.info(f"{created_str} : {total_lines:,} : {matched_lines:,} : {bad_lines:,} : {file_bytes_processed:,}:{(file_bytes_processed / file_size) * 100:.0f}% : {megabytes_per_second:,.1f} MB/s")
+
+	with metrics.time('write'):
+		handle.close()
+	seconds = time.perf_counter() - start_time
+	log.info(f"Complete : {total_lines:,} : {matched_lines:,} : {bad_lines:,} : {decompressed_bytes:,} bytes decompressed in {seconds:,.1f}s, {decompressed_bytes / 2**20 / max(seconds, 1e-9):,.1f} MB/s")
+	# with workers > 1 the filter steps run in parallel, so their seconds add up to more than the wall time
+	details = {'input_file': input_file, 'output_file': output_path, 'workers': workers, 'json_backend': json_backend, 'decompressed_bytes': decompressed_bytes}
+	if write_metrics:
+		report = metrics.write_report(f"{output_file}.metrics.json", total_lines, **details)
+	else:
+		report = metrics.snapshot(total_lines, **details)
+	log.info("Time per step: " + ", ".join(f"{stage} {entry['seconds']:,.1f}s" for stage, entry in report['stages'].items()))
 
 
 if __name__ == "__main__":
@@ -274,6 +702,7 @@ if __name__ == "__main__":
 	log.info(f"Exact match {('on' if exact_match else 'off')}. Single field {single_field}.")
 	log.info(f"From date {from_date.strftime('%Y-%m-%d')} to date {to_date.strftime('%Y-%m-%d')}")
 	log.info(f"Output format set to {output_format}")
+	log.info(f"Workers {workers}, {batch_lines:,} lines per batch. Pre-filter {('on' if pre_filter else 'off')}, parsing with {json_backend}. Time index {('on' if use_time_index else 'off')}")
 
 	input_files = []
 	if os.path.isdir(input_file):
@@ -288,7 +717,7 @@ if __name__ == "__main__":
 	log.info(f"Processing {len(input_files)} files")
 	for file_in, file_out in input_files:
 		try:
-			process_file(file_in, file_out, output_format, field, values, from_date, to_date, single_field, exact_match)
+			process_file(file_in, file_out, output_format, field, values, from_date, to_date, single_field, exact_match, workers, pre_filter)
 		except Exception as err:
 			log.warning(f"Error processing {file_in}: {err}")
 			log.warning(traceback.format_exc())
\ No newline at end of file
@@ -0,0 +1,228 @@
+# Incremental ingestion: append only what's new in a dump to the outputs pipeline.py writes (wsb_sub_processed.csv,
+# the parquet store and the ticker index) instead of redoing the whole history, then bring the aggregate cubes
+# (aggregate_cube.py) up to date by aggregating just the new rows.
+# Ingesting one monthly file costs about one month of work.
+#   python ingest.py RS_2023-01.zst [RS_2023-02.zst ...]
+# ingest_state.json holds the watermark (newest created_utc ingested) and the committed row count and CSV size.
+# Only posts from OVERLAP_SECONDS before the watermark on are looked at; their submission ids are checked against
+# ingested_ids.sqlite, so a post that shows up twice (overlapping files, the same file twice) is only added once.
+# Filter, sentiment and output settings are the ones in pipeline.py.
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+import pandas as pd
+import pipeline
+import processed_store
+import aggregates
+from aggregate_cube import AggregateCube
+from metrics import Metrics
+from ticker_index import TickerIndex
+
+INGEST_STATE_PATH = 'ingest_state.json'
+INGESTED_IDS_PATH = 'ingested_ids.sqlite'
+OVERLAP_SECONDS = 24 * 3600 # posts this much older than the watermark are still checked, dumps are only roughly in time order
+# pipeline.TO_DATE bounds a one-off run, new files are newer than that by definition
+TO_DATE = datetime(2100, 1, 1)
+PERMALINK_ID = re.compile(r'/comments/([a-z0-9]+)/')
+
+
+def submission_id(permalink):
+    found = PERMALINK_ID.search(permalink) if isinstance(permalink, str) else None
+    return found.group(1) if found else None
+
+
+class IngestState:
+    """JSON journal of what's been ingested, replaced atomically on every save (like checkpoint.Checkpoint)."""
+
+    def __init__(self, path=INGEST_STATE_PATH):
+        self.path = path
+        self.rows = 0 # committed data rows in the outputs
+        self.output_size = 0 # bytes of the CSV after the last committed chunk
+        self.watermark = None # newest created_utc read from an ingested file
+        self.files = [] # one summary per ingested file
+
+    @classmethod
+    def load(cls, path=INGEST_STATE_PATH):
+        state = cls(path)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            state.rows = saved['rows']
+            state.output_size = saved['output_size']
+            state.watermark = saved['watermark']
+            state.files = saved['files']
+        return state
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'rows': self.rows, 'output_size': self.output_size, 'watermark': self.watermark, 'files': self.files}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+class IngestedIds:
+    """Submission ids already in the outputs, with the row they went to so an uncommitted tail can be dropped."""
+
+    def __init__(self, path=INGESTED_IDS_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY, row_id INTEGER NOT NULL) WITHOUT ROWID")
+        self.connection.commit()
+
+    def existing(self, ids):
+        found = set()
+        ids = list(ids)
+        for start in range(0, len(ids), 500): # sqlite's bound parameter limit
+            batch = ids[start:start + 500]
+            query = f"SELECT id FROM ids WHERE id IN ({','.join('?' * len(batch))})"
+            found.update(row[0] for row in self.connection.execute(query, batch))
+        return found
+
+    def add(self, ids, first_row_id):
+        self.connection.executemany("INSERT OR IGNORE INTO ids VALUES (?, ?)",
+                                    [(post_id, first_row_id + offset) for offset, post_id in enumerate(ids) if post_id])
+        self.connection.commit()
+
+    def delete_from(self, first_row_id):
+        self.connection.execute("DELETE FROM ids WHERE row_id >= ?", (first_row_id,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def seed_state(state):
+    """First run over outputs written by pipeline.py or sentimize_data.py: take rows, ids and watermark from them."""
+    if not os.path.exists(pipeline.output_path):
+        return
+    source = pipeline.PARQUET_PATH if pipeline.WRITE_PARQUET and os.path.isdir(pipeline.PARQUET_PATH) else pipeline.output_path
+    existing = processed_store.load_processed(source, ['date', 'permalink'])
+    ids = IngestedIds()
+    ids.add([submission_id(permalink) for permalink in existing['permalink']], 0)
+    ids.close()
+    state.rows = len(existing)
+    state.output_size = os.path.getsize(pipeline.output_path)
+    if len(existing):
+        # the outputs only have days, so start at the newest one and let the id check sort out that day
+        state.watermark = int((pd.to_datetime(existing['date']).max() - pd.Timestamp(1970, 1, 1)).total_seconds())
+    state.save()
+    print(f"Seeded {state.path} from '{source}': {state.rows:,} rows, {len(existing):,} ids")
+
+
+def repair_outputs(state):
+    """Drop whatever a crashed run wrote past the last committed chunk, in every output."""
+    if os.path.exists(pipeline.output_path) and os.path.getsize(pipeline.output_path) > state.output_size:
+        print(f"Truncating {os.path.getsize(pipeline.output_path) - state.output_size:,} uncommitted bytes from '{pipeline.output_path}'")
+        with open(pipeline.output_path, 'r+b') as f:
+            f.truncate(state.output_size)
+    if pipeline.WRITE_PARQUET:
+        processed_store.delete_from(pipeline.PARQUET_PATH, state.rows)
+    if pipeline.WRITE_TICKER_INDEX and os.path.exists(pipeline.TICKER_INDEX_PATH):
+        index = TickerIndex(pipeline.TICKER_INDEX_PATH)
+        index.delete_from(state.rows)
+        index.close()
+    ids = IngestedIds()
+    ids.delete_from(state.rows)
+    ids.close()
+
+
+def new_rows(row_batches, stats):
+    """Drops rows whose submission id is already ingested, or was seen earlier in this run."""
+    ids = IngestedIds() # opened here, in the thread that runs this stage
+    seen = set()
+    for rows in row_batches:
+        batch_ids = [submission_id(row[4]) for row in rows] # permalink, see pipeline.COLUMN_NAMES
+        known = ids.existing(post_id for post_id in batch_ids if post_id)
+        kept = []
+        for row, post_id in zip(rows, batch_ids):
+            if post_id is not None and (post_id in known or post_id in seen):
+                stats['duplicates'] += 1
+                continue
+            seen.add(post_id)
+            kept.append(row)
+        if kept:
+            yield kept
+    ids.close()
+
+
+def data_versions():
+    # aggregates are cached per version of whichever form of the data the analysis reads
+    paths = [path for path in (pipeline.PARQUET_PATH if pipeline.WRITE_PARQUET else None, pipeline.output_path)
+             if path is not None and os.path.exists(path)]
+    return {path: aggregates.input_version(path) for path in paths}
+
+
+def ingest_file(input_file, state, tickers):
+    stats = {'lines': 0, 'matched': 0, 'bad_lines': 0, 'duplicates': 0, 'rows_written': 0, 'labeled': 0}
+    metrics = Metrics(pipeline.PROGRESS_SECONDS)
+    from_date = pipeline.FROM_DATE
+    if state.watermark is not None:
+        from_date = max(from_date, datetime(1970, 1, 1) + timedelta(seconds=state.watermark - OVERLAP_SECONDS))
+    print(f"Ingesting '{input_file}' from {from_date:%Y-%m-%d %H:%M:%S} on, after {state.rows:,} rows")
+    previous_versions = data_versions()
+    ids = IngestedIds()
+    appended = [] # date/sentiment/tickers of the new rows, for the aggregates
+
+    def commit(chunk, first_row_id, output_size):
+        ids.add([submission_id(permalink) for permalink in chunk['permalink']], first_row_id)
+        appended.append(chunk[['date', 'sentiment', 'tickers']].copy())
+        state.rows = first_row_id + len(chunk)
+        state.output_size = output_size
+        state.save()
+
+    rows = pipeline.threaded(new_rows(pipeline.filtered_rows(input_file, stats, metrics, from_date, TO_DATE), stats))
+    chunks = pipeline.threaded(pipeline.labeled_chunks(pipeline.rechunk(rows, pipeline.CHUNK_SIZE), tickers, stats, metrics))
+    pipeline.write_chunks(chunks, pipeline.output_path, stats, metrics, first_row_id=state.rows, commit=commit)
+    ids.close()
+
+    # only now, a run that dies halfway re-reads the file and the id check skips what it already added
+    if stats.get('newest_created') is not None:
+        newest = int((stats['newest_created'] - datetime(1970, 1, 1)).total_seconds())
+        state.watermark = newest if state.watermark is None else max(state.watermark, newest)
+    stats['seconds'] = round(metrics.elapsed(), 2)
+    summary = {key: value for key, value in stats.items() if key not in ('api', 'newest_created')}
+    state.files.append({'file': os.path.basename(input_file), 'ingested_at': datetime.now().isoformat(timespec='seconds'),
+                        'from': from_date.isoformat(), 'rows_after': state.rows, **summary})
+    state.save()
+
+    new_data = pd.concat(appended, ignore_index=True) if appended else pd.DataFrame(columns=['date', 'sentiment', 'tickers'])
+    for path, previous_version in previous_versions.items():
+        if AggregateCube(path).update(previous_version, new_data):
+            print(f"Updated the aggregate cube of '{path}' with {len(new_data):,} new rows")
+    return summary
+
+
+if __name__ == "__main__":
+    input_files = sys.argv[1:]
+    if not input_files:
+        print("Usage: python ingest.py dump.zst [more.zst ...]")
+        exit(1)
+    for input_file in input_files:
+        if not os.path.exists(input_file):
+            print(f"Error: The file '{input_file}' was not found.")
+            exit(1)
+        if "submission" not in input_file and not os.path.basename(input_file).startswith("RS_"):
+            print(f"Error: '{input_file}' doesn't look like a submissions dump, the pipeline needs titles and selftext.")
+            exit(1)
+    try:
+        with open(pipeline.ticker_file, 'r') as f:
+            tickers = [line.strip().lower() for line in f if line.strip()]
+    except FileNotFoundError:
+        print(f"Error: The file '{pipeline.ticker_file}' was not found.")
+        exit(1)
+
+    state = IngestState.load()
+    if not state.exists():
+        seed_state(state)
+    repair_outputs(state)
+    for input_file in input_files:
+        summary = ingest_file(input_file, state, tickers)
+        print(f"Ingested '{input_file}': {summary}")
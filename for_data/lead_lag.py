@@ -0,0 +1,290 @@
+# Does WSB sentiment lead prices? Every ticker x lag x window at once instead of eyeballing one chart in tsla.py.
+# Works on price_store.join_sentiment()'s table, turned into (trading days x tickers) arrays:
+#   causes:  sentiment (daily mean_score, NaN on days without posts) and posts (log1p of the daily post count)
+#   effects: return (close-to-close adj_close) and volume (change in log volume)
+# and computes, with every ticker handled by the same array operations:
+#  - lagged cross-correlations corr(cause[t], effect[t + lag]) for lag -MAX_LAG..MAX_LAG. Positive lags are the cause
+#    leading, negative ones the effect leading
+#  - rolling correlations over each of WINDOWS trading days, at every lag, summarised per ticker
+#  - Granger-style F tests: do `order` lags of the cause improve a regression of the effect on its own lags (both ways)
+# Missing days are left out pairwise, never filled in.
+#   python lead_lag.py [wsb_sub_processed_parquet] [2018-01-01] [2022-12-31]
+# prices come from price_store.py (only missing ranges are downloaded), results go to RESULTS_DIR as CSV.
+import math
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+try:
+    from aggregate_cube import AggregateCube
+    from aggregates import ALL_TICKERS
+    from price_store import PriceStore, join_sentiment
+except ImportError: # imported from the repo root as for_data.lead_lag
+    from for_data.aggregate_cube import AggregateCube
+    from for_data.aggregates import ALL_TICKERS
+    from for_data.price_store import PriceStore, join_sentiment
+
+PROCESSED_PATH = 'wsb_sub_processed_parquet'
+PRICE_DIR = 'price_data'
+RESULTS_DIR = 'lead_lag_results'
+FROM_DATE = '2018-01-01'
+TO_DATE = '2022-12-31'
+FETCH_PRICES = True # False to only use what's in the price store already
+MAX_LAG = 10 # trading days each way
+WINDOWS = (20, 60, 120) # rolling correlation windows, trading days
+ROLLING_BLOCK = 8 # tickers per batch of rolling correlations, the arrays are days x tickers x lags big
+GRANGER_ORDERS = (1, 2, 5)
+MIN_OBSERVATIONS = 30 # fewer paired days than this and a ticker's result is NaN
+SIGNIFICANCE = 0.05
+CAUSES = ('sentiment', 'posts')
+EFFECTS = ('return', 'volume')
+
+
+def wide_series(joined):
+    """{name: (days x tickers) float array} for CAUSES and EFFECTS, plus the dates and tickers they're indexed by."""
+    def wide(column):
+        return joined.pivot(index='date', columns='ticker', values=column).sort_index()
+    counts = wide('count')
+    dates, tickers = counts.index, counts.columns
+    counts = counts.to_numpy(dtype=np.float64)
+    volume = wide('volume').reindex(index=dates, columns=tickers).to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_volume = np.where(volume > 0, np.log(volume), np.nan)
+    volume_change = np.full_like(log_volume, np.nan)
+    volume_change[1:] = np.diff(log_volume, axis=0)
+    series = {
+        'sentiment': wide('mean_score').reindex(index=dates, columns=tickers).to_numpy(dtype=np.float64),
+        'posts': np.log1p(counts), # NaN where the ticker has no price that day
+        'return': wide('return').reindex(index=dates, columns=tickers).to_numpy(dtype=np.float64),
+        'volume': volume_change,
+    }
+    return series, dates, list(tickers)
+
+
+def _masked(a, b):
+    # both zeroed wherever either is missing, so every sum below only sees the pairs that exist
+    mask = ~(np.isnan(a) | np.isnan(b))
+    return np.where(mask, a, 0.0), np.where(mask, b, 0.0), mask.astype(np.float64)
+
+
+def _correlation(n, sx, sy, sxx, syy, sxy, min_observations):
+    # works in place on the sums (all temporaries where it's called), the rolling ones are days x tickers x lags big
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scratch = np.multiply(sx, sy)
+        scratch /= n
+        sxy -= scratch # covariance, times n
+        np.multiply(sx, sx, out=scratch)
+        scratch /= n
+        sxx -= scratch
+        np.multiply(sy, sy, out=scratch)
+        scratch /= n
+        syy -= scratch
+        np.multiply(sxx, syy, out=scratch)
+        sxy /= np.sqrt(scratch, out=sxx)
+    np.copyto(sxy, np.nan, where=(n < min_observations) | ~(scratch > 1e-12))
+    return np.clip(sxy, -1.0, 1.0, out=sxy)
+
+
+def lagged_effect(effect, max_lag):
+    """(days x tickers x lags) view where [t, :, j] is effect[t + j - max_lag], NaN past either end."""
+    pad = np.full((max_lag, effect.shape[1]), np.nan)
+    return sliding_window_view(np.concatenate([pad, effect, pad]), 2 * max_lag + 1, axis=0)
+
+
+def cross_correlation(cause, effect, max_lag=MAX_LAG, min_observations=MIN_OBSERVATIONS):
+    """corr(cause[t], effect[t + lag]) per ticker for lag -max_lag..max_lag. Returns (corr, n), both (lags x tickers)."""
+    x, y, mask = _masked(np.broadcast_to(cause[:, :, None], (*cause.shape, 2 * max_lag + 1)), lagged_effect(effect, max_lag))
+    n = mask.sum(axis=0)
+    corr = _correlation(n, x.sum(axis=0), y.sum(axis=0), (x * x).sum(axis=0), (y * y).sum(axis=0), (x * y).sum(axis=0), min_observations)
+    return corr.T, n.T
+
+
+def rolling_correlation(cause, effect, windows=WINDOWS, max_lag=MAX_LAG):
+    """{window: (windows ending on each day x tickers x lags) correlations}, from running sums so every window costs
+    the same as one subtraction. A window needs at least half its days paired."""
+    x, y, mask = _masked(np.broadcast_to(cause[:, :, None], (*cause.shape, 2 * max_lag + 1)), lagged_effect(effect, max_lag))
+    sums = []
+    for values in (mask, x, y, x * x, y * y, x * y):
+        running = np.zeros((values.shape[0] + 1,) + values.shape[1:])
+        np.cumsum(values, axis=0, out=running[1:])
+        sums.append(running)
+    result = {}
+    for window in windows:
+        if window > cause.shape[0]:
+            continue
+        n, sx, sy, sxx, syy, sxy = (np.subtract(running[window:], running[:-window]) for running in sums)
+        result[window] = _correlation(n, sx, sy, sxx, syy, sxy, max(3, window // 2))
+    return result
+
+
+def summarize_rolling(values):
+    """mean/std/min/max and newest value of (windows x tickers x lags) rolling correlations, NaN windows left out, plus
+    how many windows had a value. Each is (tickers x lags)."""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, values, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = filled.sum(axis=0) / count
+        std = np.sqrt(np.maximum((filled * filled).sum(axis=0) / count - mean * mean, 0.0))
+    last_index = values.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    return {'mean_corr': mean, 'std_corr': std, 'min_corr': np.fmin.reduce(values, axis=0), 'max_corr': np.fmax.reduce(values, axis=0),
+            'last_corr': np.take_along_axis(values, last_index[None], axis=0)[0], 'windows': count}
+
+
+def rolling_summary(cause, effect, windows=WINDOWS, max_lag=MAX_LAG, block=ROLLING_BLOCK):
+    """{window: summarize_rolling()} for every ticker, block tickers at a time so the running sums stay in cache."""
+    parts = {}
+    for start in range(0, cause.shape[1], block):
+        columns = slice(start, start + block)
+        for window, values in rolling_correlation(cause[:, columns], effect[:, columns], windows, max_lag).items():
+            parts.setdefault(window, []).append(summarize_rolling(values))
+    return {window: {name: np.concatenate([part[name] for part in blocks]) for name in blocks[0]} for window, blocks in parts.items()}
+
+
+def _lags(values, order):
+    # (rows x tickers x order): column i is values[t - 1 - i] for the rows t = order..days-1
+    days = values.shape[0]
+    return np.stack([values[order - i:days - i] for i in range(1, order + 1)], axis=-1)
+
+
+def _continued_fraction(a, b, x, iterations=300):
+    # Lentz's method for the incomplete beta continued fraction, elementwise
+    tiny = 1e-300
+    c = np.ones_like(x)
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+    h = d.copy()
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a - 1.0 + 2 * m) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 1.0 + 2 * m))):
+            d = 1.0 + numerator * d
+            d = 1.0 / np.where(np.abs(d) < tiny, tiny, d)
+            c = 1.0 + numerator / c
+            c = np.where(np.abs(c) < tiny, tiny, c)
+            h = h * d * c
+        if not np.any(np.abs(d * c - 1.0) > 1e-15): # NaN (from NaN inputs) counts as done
+            break
+    return h
+
+
+def incomplete_beta(a, b, x):
+    """Regularized incomplete beta I_x(a, b), elementwise."""
+    a, b, x = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64),
+                                  np.clip(np.asarray(x, dtype=np.float64), 0.0, 1.0))
+    lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        front = np.exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * np.log(x) + b * np.log1p(-x))
+        direct = front * _continued_fraction(a, b, x) / a
+        flipped = 1.0 - front * _continued_fraction(b, a, 1.0 - x) / b
+    result = np.where(x < (a + 1.0) / (a + b + 2.0), direct, flipped)
+    return np.where(x <= 0.0, 0.0, np.where(x >= 1.0, 1.0, result))
+
+
+def f_survival(f, numerator_df, denominator_df):
+    """P(F >= f) for the F distribution, elementwise (what scipy.stats.f.sf gives)."""
+    f = np.asarray(f, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = incomplete_beta(denominator_df / 2.0, numerator_df / 2.0, denominator_df / (denominator_df + numerator_df * f))
+    return np.where(np.isfinite(f) & (denominator_df > 0), p, np.nan)
+
+
+def granger(cause, effect, order, min_observations=MIN_OBSERVATIONS):
+    """F test per ticker: do `order` lags of cause explain effect beyond `order` lags of effect itself?
+    Returns (F, p value, observations), each one value per ticker."""
+    target = effect[order:]
+    # constant, the effect's own lags, then the cause's: the restricted model is the first 1 + order columns
+    design = np.concatenate([np.ones(target.shape + (1,)), _lags(effect, order), _lags(cause, order)], axis=-1)
+    valid = ~(np.isnan(target) | np.isnan(design).any(axis=-1))
+    # rows with anything missing are zeroed out, which drops them from every sum below. Then per ticker least squares
+    # from the normal equations, all tickers in one batched matmul/pinv
+    design = np.where(valid[..., None], design, 0.0).transpose(1, 0, 2)
+    target = np.where(valid, target, 0.0).T[..., None]
+    gram = design.transpose(0, 2, 1) @ design
+    moments = design.transpose(0, 2, 1) @ target
+    total = (target * target).sum(axis=(1, 2))
+
+    def residual_sum_of_squares(columns):
+        beta = np.linalg.pinv(gram[:, :columns, :columns]) @ moments[:, :columns]
+        return np.maximum(total - (beta * moments[:, :columns]).sum(axis=(1, 2)), 0.0) # y'y - b'X'y
+
+    restricted = residual_sum_of_squares(1 + order)
+    unrestricted = residual_sum_of_squares(1 + 2 * order)
+    n = valid.sum(axis=0)
+    denominator_df = n - 2 * order - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = np.maximum(restricted - unrestricted, 0.0) / order / (unrestricted / denominator_df)
+    f[(n < min_observations) | (denominator_df <= 0)] = np.nan
+    return f, f_survival(f, order, denominator_df.astype(np.float64)), n
+
+
+def scan(joined, max_lag=MAX_LAG, windows=WINDOWS, orders=GRANGER_ORDERS, min_observations=MIN_OBSERVATIONS):
+    """All three analyses for every ticker in price_store.join_sentiment()'s table. Returns tidy DataFrames:
+    cross_correlation (ticker, cause, effect, lag, corr, n), rolling_correlation (ticker, cause, effect, window, lag,
+    mean/std/min/max/last of the rolling values, windows) and granger (ticker, cause, effect, order, f, p_value, n),
+    the last one in both directions."""
+    series, dates, tickers = wide_series(joined)
+    # for the regressions a traded day without posts counts as neutral sentiment (0), like tsla.py's empty weeks,
+    # otherwise every lag window touching a quiet day would be dropped
+    regression_series = dict(series, sentiment=np.where(np.isnan(series['sentiment']) & ~np.isnan(series['posts']), 0.0, series['sentiment']))
+    lags = np.arange(-max_lag, max_lag + 1)
+    ticker_names = np.asarray(tickers, dtype=object)
+    cross, rolling, tests = [], [], []
+    for cause in CAUSES:
+        for effect in EFFECTS:
+            corr, n = cross_correlation(series[cause], series[effect], max_lag, min_observations)
+            cross.append(pd.DataFrame({'ticker': np.tile(ticker_names, len(lags)), 'cause': cause, 'effect': effect,
+                                       'lag': np.repeat(lags, len(tickers)), 'corr': corr.ravel(), 'n': n.ravel().astype(np.int64)}))
+            for window, summary in rolling_summary(series[cause], series[effect], windows, max_lag).items():
+                rolling.append(pd.DataFrame({'ticker': np.repeat(ticker_names, len(lags)), 'cause': cause, 'effect': effect,
+                                             'window': window, 'lag': np.tile(lags, len(tickers)),
+                                             **{name: values.ravel() for name, values in summary.items()}}))
+            for order in orders:
+                for first, second in ((cause, effect), (effect, cause)):
+                    f, p, n = granger(regression_series[first], regression_series[second], order, min_observations)
+                    tests.append(pd.DataFrame({'ticker': ticker_names, 'cause': first, 'effect': second, 'order': order,
+                                               'f': f, 'p_value': p, 'n': n.astype(np.int64)}))
+    return {
+        'cross_correlation': pd.concat(cross, ignore_index=True),
+        'rolling_correlation': pd.concat(rolling, ignore_index=True),
+        'granger': pd.concat(tests, ignore_index=True),
+    }
+
+
+if __name__ == "__main__":
+    processed_path = sys.argv[1] if len(sys.argv) > 1 else PROCESSED_PATH
+    start = sys.argv[2] if len(sys.argv) > 2 else FROM_DATE
+    end = sys.argv[3] if len(sys.argv) > 3 else TO_DATE
+    if not os.path.exists(processed_path):
+        print(f"Error: The file '{processed_path}' was not found.")
+        exit(1)
+    started = time.perf_counter()
+    aggregates = AggregateCube(processed_path).aggregates(('D',), start=start, end=end)
+    tickers = sorted(ticker for ticker in aggregates['ticker'].unique() if ticker != ALL_TICKERS)
+    try:
+        prices = PriceStore(PRICE_DIR).load(tickers, start, end, fetch=FETCH_PRICES)
+    except ImportError as e:
+        print(f"Error: {e}")
+        exit(1)
+    if prices.empty:
+        print(f"Error: no prices for any of the {len(tickers)} tickers in '{PRICE_DIR}', see price_store.py.")
+        exit(1)
+    loaded = time.perf_counter()
+    results = scan(join_sentiment(aggregates, prices))
+    print(f"Scanned {prices['ticker'].nunique()} tickers in {time.perf_counter() - loaded:.2f}s (loading took {loaded - started:.2f}s)")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    for name, table in results.items():
+        table.to_csv(os.path.join(RESULTS_DIR, f"{name}.csv"), index=False)
+
+    cross = results['cross_correlation'].dropna(subset=['corr'])
+    leads = cross[cross['lag'] > 0].reindex(cross.loc[cross['lag'] > 0, 'corr'].abs().sort_values(ascending=False).index)
+    print("\nStrongest correlations with sentiment/posts leading:")
+    print(leads.head(15).to_string(index=False))
+    tests = results['granger'].dropna(subset=['p_value'])
+    significant = tests[tests['p_value'] < SIGNIFICANCE]
+    # with this many tests some pass by chance alone, compare against that before reading anything into one
+    print(f"\nGranger tests: {len(significant):,} of {len(tests):,} significant at {SIGNIFICANCE}, "
+          f"about {len(tests) * SIGNIFICANCE:,.0f} expected by chance")
+    print(significant.sort_values('p_value').head(15).to_string(index=False))
+    print(f"\nResults saved to '{RESULTS_DIR}'")
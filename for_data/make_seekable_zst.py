@@ -0,0 +1,34 @@
+# Re-encodes a Pushshift dump as a seekable zstd file: independent frames of about dig_through.seekable_frame_bytes,
+# plus <output>.index.json with the created_utc range of every frame. dig_through.py and pipeline.py then only
+# decompress the frames that overlap their from_date/to_date, so a 2021 slice doesn't start at 2012.
+#   python make_seekable_zst.py wallstreetbets_submissions.zst [wallstreetbets_submissions_seekable.zst]
+# Do it once per dump, it takes about as long as one full pass of dig_through.py.
+import os
+import sys
+import time
+from datetime import datetime
+import dig_through
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("Usage: python make_seekable_zst.py input.zst [output.zst]")
+		exit(1)
+	input_file = sys.argv[1]
+	# keep "submissions"/"comments" in the name, dig_through.py goes by it
+	output_file = sys.argv[2] if len(sys.argv) > 2 else f"{input_file[:-len('.zst')] if input_file.endswith('.zst') else input_file}_seekable.zst"
+	if not os.path.exists(input_file):
+		print(f"Error: The file '{input_file}' was not found.")
+		exit(1)
+	if os.path.abspath(input_file) == os.path.abspath(output_file):
+		print("Error: the output has to be a different file than the input.")
+		exit(1)
+
+	start = time.perf_counter()
+	index = dig_through.write_seekable(input_file, output_file)
+	dated = [frame for frame in index['frames'] if frame['min_created_utc'] is not None]
+	print(f"Wrote {index['lines']:,} lines in {len(index['frames']):,} frames to '{output_file}' "
+		f"({os.path.getsize(input_file) / 2**20:,.1f} MB -> {index['file_size'] / 2**20:,.1f} MB) in {time.perf_counter() - start:.1f}s")
+	if dated:
+		first = datetime.utcfromtimestamp(min(frame['min_created_utc'] for frame in dated))
+		last = datetime.utcfromtimestamp(max(frame['max_created_utc'] for frame in dated))
+		print(f"Covers {first:%Y-%m-%d} to {last:%Y-%m-%d}, index in '{dig_through.time_index_path(output_file)}'")
@@ -0,0 +1,189 @@
+# Synthetic r/wallstreetbets dump for benchmarks: zstd compressed ndjson shaped like the Pushshift files
+# (submissions or comments), so performance changes can be measured without the private multi-GB dump.
+# Everything is drawn from a seeded generator, the same settings always give the same file.
+#   python make_synthetic_dump.py [rows] [output.zst]
+# A file name containing "comments" makes a comments dump, like dig_through.py tells them apart.
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import zstandard
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ROWS = 100_000
+OUTPUT_FILE = 'synthetic_wallstreetbets_submissions.zst'
+TICKER_FILE = 'ticker_list.txt'
+SEED = 42
+# bump whenever the shape of the generated data changes, bench_suite.py keys its cached dumps on it
+GENERATOR_VERSION = 1
+FROM_DATE = datetime(2018, 1, 1)
+TO_DATE = datetime(2022, 12, 31)
+BATCH_ROWS = 50_000 # rows drawn and written at a time
+
+# roughly what the real submissions dump looks like
+LINK_POST_SHARE = 0.35 # is_self false, a url instead of selftext
+REMOVED_SHARE = 0.15 # selftext "[removed]"
+DELETED_SHARE = 0.05 # author and selftext "[deleted]"
+TICKER_MENTION_SHARE = 0.30 # posts (or comments) mentioning 1 to 3 tickers
+TICKER_ZIPF = 1.2 # a few tickers (GME, TSLA, ...) get most of the mentions
+HOT_TICKERS = ['gme', 'tsla', 'amc', 'spy', 'aapl', 'bb', 'pltr', 'nvda', 'amd', 'nok']
+# text lengths in words are lognormal: (mu, sigma), median exp(mu)
+TITLE_WORDS = (2.0, 0.5) # median ~7 words
+SELFTEXT_WORDS = (4.0, 1.3) # median ~55 words, with a long tail
+COMMENT_WORDS = (2.8, 1.1) # median ~16 words
+MAX_WORDS = 7000 # reddit cuts selftext at 40k characters
+# bodies are picked from a pool drawn from the distribution above, drawing every one fresh makes 10M rows take ages.
+# Titles are always fresh, so no two posts have the same text
+TEXT_POOL_SIZE = 20_000
+
+WORDS = ("the a to and of is it i this my on for in be that you just what are all we they so at with not if can will "
+         "buy sell hold calls puts shares options strike expiry yolo dd moon rocket tendies diamond hands paper apes "
+         "squeeze short float earnings guidance revenue margin bull bear crash dip rally pump dump bags loss gain "
+         "portfolio position account broker robinhood fed rates inflation market stock stocks price target week "
+         "month year today tomorrow retard autist wife boyfriend wendys lambo rip up down green red theta gamma iv "
+         "leaps fd otm itm premium volume chart support resistance breakout technical fundamental value growth").split()
+
+
+def draw_lengths(rng, size, mu_sigma, maximum=MAX_WORDS):
+    return np.clip(np.rint(rng.lognormal(*mu_sigma, size)).astype(np.int64), 1, maximum)
+
+
+def draw_texts(rng, lengths):
+    vocabulary = np.asarray(WORDS, dtype=object)
+    words = vocabulary[rng.integers(0, len(WORDS), int(lengths.sum()))]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(words[offsets[i]:offsets[i + 1]]) for i in range(len(lengths))]
+
+
+def ticker_weights(tickers):
+    # hot tickers first, then Zipf weights down the list
+    order = [ticker for ticker in HOT_TICKERS if ticker in tickers] + [ticker for ticker in tickers if ticker not in HOT_TICKERS]
+    weights = 1.0 / np.arange(1, len(order) + 1) ** TICKER_ZIPF
+    return order, weights / weights.sum()
+
+
+def mention(ticker, form):
+    # the forms people actually write: $TSLA, TSLA, tsla, #tsla
+    return (f"${ticker.upper()}", ticker.upper(), ticker, f"#{ticker}")[form]
+
+
+def base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        text = digits[remainder] + text
+        if not number:
+            return text
+
+
+def submission(row_id, created_utc, rng_values, title, selftext, is_self, removed, deleted, score, num_comments):
+    post_id = base36(row_id)
+    author = "[deleted]" if deleted else f"user_{rng_values % 500_000}"
+    obj = {
+        'all_awardings': [], 'author': author, 'author_flair_text': None, 'created_utc': created_utc,
+        'domain': "self.wallstreetbets" if is_self else "i.redd.it", 'gilded': 0, 'id': post_id,
+        'is_self': is_self, 'link_flair_text': ("DD", "YOLO", "Discussion", "Gain", "Loss", "Meme")[rng_values % 6],
+        'locked': False, 'name': f"t3_{post_id}", 'num_comments': num_comments, 'over_18': False,
+        'permalink': f"/r/wallstreetbets/comments/{post_id}/{'_'.join(title.split()[:6]).lower()}/",
+        'retrieved_on': created_utc + 3600, 'score': score, 'spoiler': False, 'stickied': False,
+        'subreddit': "wallstreetbets", 'subreddit_id': "t5_2th52", 'thumbnail': "self" if is_self else "default",
+        'title': title, 'upvote_ratio': round(0.5 + (rng_values % 50) / 100, 2),
+    }
+    if is_self:
+        obj['selftext'] = "[deleted]" if deleted else "[removed]" if removed else selftext
+        obj['url'] = f"https://www.reddit.com{obj['permalink']}"
+    else:
+        obj['selftext'] = ""
+        obj['url'] = f"https://i.redd.it/{base36(rng_values)}.jpg"
+    return obj
+
+
+def comment(row_id, created_utc, rng_values, body, deleted, score, link_number):
+    comment_id = base36(row_id)
+    link_id = base36(link_number)
+    top_level = rng_values % 3 == 0
+    return {
+        'all_awardings': [], 'author': "[deleted]" if deleted else f"user_{rng_values % 500_000}",
+        'author_flair_text': None, 'body': "[deleted]" if deleted else body, 'created_utc': created_utc,
+        'gilded': 0, 'id': comment_id, 'link_id': f"t3_{link_id}", 'locked': False,
+        'parent_id': f"t3_{link_id}" if top_level else f"t1_{base36(max(row_id - 1 - rng_values % 50, 0))}",
+        'permalink': f"/r/wallstreetbets/comments/{link_id}/_/{comment_id}/", 'retrieved_on': created_utc + 3600,
+        'score': score, 'stickied': False, 'subreddit': "wallstreetbets", 'subreddit_id': "t5_2th52",
+    }
+
+
+def generate(output_file=OUTPUT_FILE, rows=ROWS, tickers=None, seed=SEED, comments=None):
+    """Write `rows` synthetic submissions (or comments) to output_file. Returns the number of bytes written."""
+    if comments is None:
+        comments = "comment" in output_file
+    rng = np.random.default_rng(seed)
+    tickers, weights = ticker_weights(tickers or [])
+    from_timestamp = int((FROM_DATE - datetime(1970, 1, 1)).total_seconds())
+    to_timestamp = int((TO_DATE - datetime(1970, 1, 1)).total_seconds())
+    # dumps are in time order
+    created = np.sort(rng.integers(from_timestamp, to_timestamp, rows))
+    pool = draw_texts(rng, draw_lengths(rng, TEXT_POOL_SIZE, COMMENT_WORDS if comments else SELFTEXT_WORDS))
+    dumps = (lambda obj: orjson.dumps(obj)) if orjson is not None else (lambda obj: json.dumps(obj).encode('utf-8'))
+    first_id = 36 ** 5 # six character ids, like 2018's
+    with open(output_file, 'wb') as handle, zstandard.ZstdCompressor(level=3).stream_writer(handle, closefd=False) as writer:
+        for start in range(0, rows, BATCH_ROWS):
+            size = min(BATCH_ROWS, rows - start)
+            texts = [pool[i] for i in rng.integers(0, len(pool), size)]
+            titles = draw_texts(rng, draw_lengths(rng, size, TITLE_WORDS, 60)) if not comments else None
+            values = rng.integers(0, 2**31, size)
+            scores = np.maximum(np.rint(rng.lognormal(1.0, 1.8, size)).astype(np.int64) - 2, 0)
+            is_self = rng.random(size) >= LINK_POST_SHARE
+            removed = rng.random(size) < REMOVED_SHARE
+            deleted = rng.random(size) < DELETED_SHARE
+            mentions = (rng.random(size) < TICKER_MENTION_SHARE) if tickers else np.zeros(size, dtype=bool)
+            in_title = rng.random(size) < 0.6
+            # 1 to 3 tickers per mentioning row, all drawn at once
+            mention_counts = np.where(mentions, rng.integers(1, 4, size), 0)
+            mention_ends = np.cumsum(mention_counts)
+            picked = rng.choice(len(tickers), int(mention_ends[-1]), p=weights) if tickers else []
+            forms = rng.integers(0, 4, len(picked))
+            lines = []
+            for i in range(size):
+                text = texts[i]
+                if mentions[i]:
+                    first = mention_ends[i] - mention_counts[i]
+                    words = " ".join(mention(tickers[picked[j]], forms[j]) for j in range(first, mention_ends[i]))
+                    if comments:
+                        text = f"{words} {text}"
+                    elif in_title[i]:
+                        titles[i] = f"{words} {titles[i]}"
+                    else:
+                        text = f"{text} {words}"
+                row_id = first_id + start + i
+                if comments:
+                    obj = comment(row_id, int(created[start + i]), int(values[i]), text, deleted[i], int(scores[i]),
+                                  first_id + int(values[i] % (start + i + 1)))
+                else:
+                    obj = submission(row_id, int(created[start + i]), int(values[i]), titles[i], text, bool(is_self[i]),
+                                     removed[i], deleted[i], int(scores[i]), int(values[i] % 300))
+                lines.append(dumps(obj))
+            lines.append(b"")
+            writer.write(b"\n".join(lines))
+    return os.path.getsize(output_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        ROWS = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        OUTPUT_FILE = sys.argv[2]
+    try:
+        with open(TICKER_FILE, 'r') as f:
+            ticker_list = [line.strip().lower() for line in f if line.strip()]
+    except FileNotFoundError:
+        print(f"Error: The file '{TICKER_FILE}' was not found.")
+        exit(1)
+    start = time.perf_counter()
+    written = generate(OUTPUT_FILE, ROWS, ticker_list)
+    print(f"Wrote {ROWS:,} rows to '{OUTPUT_FILE}' ({written / 2**20:,.1f} MB) in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,128 @@
+# Lightweight instrumentation for the processing scripts: wall time and items per stage, counters, and latency samples
+# with p50/p95/p99. log_progress() prints rows/sec (and whatever else it's given, like the cost so far) at most every
+# few seconds, write_report() dumps everything as JSON at the end of a run.
+# Stages are timed per batch or chunk, never per line, so leaving this on costs next to nothing.
+import json
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+import numpy as np
+
+LOG_EVERY_SECONDS = 30
+PERCENTILES = (50, 95, 99)
+
+
+def percentiles(samples, points=PERCENTILES):
+    """count, mean, max and the given percentiles of a sequence of numbers, all None when it's empty."""
+    values = np.asarray(samples, dtype=np.float64)
+    if not len(values):
+        return {'count': 0, 'mean': None, **{f'p{point}': None for point in points}, 'max': None}
+    summary = {'count': int(len(values)), 'mean': round(float(values.mean()), 4)}
+    for point, value in zip(points, np.percentile(values, points)):
+        summary[f'p{point}'] = round(float(value), 4)
+    summary['max'] = round(float(values.max()), 4)
+    return summary
+
+
+class Metrics:
+    """Accumulates stage timings, counters and samples. Safe to share between the threads of pipeline.py."""
+
+    def __init__(self, log_every_seconds=LOG_EVERY_SECONDS, printer=print):
+        self.start = time.perf_counter()
+        self.stages = {} # stage -> [seconds, items, calls]
+        self.counters = {}
+        self.samples = {} # name -> array of floats
+        self.log_every_seconds = log_every_seconds
+        self.printer = printer
+        self.last_log = self.start
+        self.lock = threading.Lock()
+
+    def add_time(self, stage, seconds, items=0):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += items
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, stage, items=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - started, items)
+
+    def add_timings(self, timings, items=0):
+        """Merge a {stage: seconds} dict, e.g. the one dig_through.filter_lines returns from a worker process."""
+        for stage, seconds in timings.items():
+            self.add_time(stage, seconds, items)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            self.samples.setdefault(name, array('d')).append(value)
+
+    def share_samples(self, name, samples):
+        """Report a sample list another object keeps appending to, like AsyncSentimentClient.latencies."""
+        with self.lock:
+            self.samples[name] = samples
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def snapshot(self, rows=None, **extra):
+        """Everything so far as a JSON-ready dict. Stages running in different threads overlap, so shares can add up to more than 1."""
+        elapsed = self.elapsed()
+        with self.lock:
+            stages = {stage: list(entry) for stage, entry in self.stages.items()}
+            counters = dict(self.counters)
+            samples = {name: array('d', values) for name, values in self.samples.items()}
+        report = {'elapsed_seconds': round(elapsed, 2)}
+        if rows is not None:
+            report['rows'] = rows
+            report['rows_per_second'] = round(rows / elapsed, 1) if elapsed else 0.0
+        report['stages'] = {}
+        for stage, (seconds, items, calls) in sorted(stages.items(), key=lambda item: -item[1][0]):
+            report['stages'][stage] = {
+                'seconds': round(seconds, 3),
+                'share': round(seconds / elapsed, 3) if elapsed else 0.0,
+                'calls': calls,
+                'items': items,
+                'items_per_second': round(items / seconds, 1) if seconds and items else None,
+            }
+        report['counters'] = counters
+        report['latencies'] = {name: percentiles(values) for name, values in samples.items()}
+        report.update(extra)
+        return report
+
+    def log_progress(self, rows, force=False, **extra):
+        """One summary line, at most every log_every_seconds unless forced. extra values are printed as key=value."""
+        now = time.perf_counter()
+        if not force and now - self.last_log < self.log_every_seconds:
+            return
+        self.last_log = now
+        snapshot = self.snapshot(rows)
+        parts = [f"{rows:,} rows in {snapshot['elapsed_seconds']:,.0f}s, {snapshot['rows_per_second']:,.1f} rows/s"]
+        stages = snapshot['stages']
+        if stages:
+            parts.append(", ".join(f"{stage} {entry['seconds']:,.1f}s" for stage, entry in stages.items()))
+        for name, summary in snapshot['latencies'].items():
+            if summary['count']:
+                parts.append(f"{name} p50 {summary['p50']:.2f}s p95 {summary['p95']:.2f}s p99 {summary['p99']:.2f}s")
+        if extra:
+            parts.append(", ".join(f"{key}={value}" for key, value in extra.items()))
+        self.printer(" | ".join(parts))
+
+    def write_report(self, path, rows=None, **extra):
+        report = self.snapshot(rows, **extra)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2, default=str)
+        return report
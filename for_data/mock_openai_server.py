@@ -0,0 +1,247 @@
+# Tiny stand-in for the OpenAI chat completions, files and batches endpoints, to exercise sentiment_client.py
+# and openai_batch.py offline. Simulates latency, 429s (with retry-after headers) and failed batch requests. Run it, then:
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python sentimize_data.py
+import argparse
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+POSITIVE_WORDS = ('moon', 'calls', 'buy', 'bull', 'rocket', 'tendies', 'up')
+NEGATIVE_WORDS = ('puts', 'sell', 'bear', 'crash', 'loss', 'down', 'rip')
+
+
+def fake_sentiment(text):
+    text = text.lower()
+    score = sum(word in text for word in POSITIVE_WORDS) - sum(word in text for word in NEGATIVE_WORDS)
+    if score > 0:
+        return "Positive"
+    if score < 0:
+        return "Negative"
+    return "Neutral"
+
+
+class MockState:
+    def __init__(self, latency_ms, jitter_ms, rate_limit_probability, retry_after, requests_per_minute,
+                 batch_failure_probability=0.0, batch_seconds=1.0, packed_drop_probability=0.0):
+        self.latency_ms = latency_ms
+        self.packed_drop_probability = packed_drop_probability # share of posts left out of packed replies
+        self.jitter_ms = jitter_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.counts = {'requests': 0, 'rate_limited': 0}
+        self.batch_failure_probability = batch_failure_probability
+        self.batch_seconds = batch_seconds
+        self.files = {} # id -> (metadata, bytes)
+        self.batches = {}
+
+    def should_rate_limit(self):
+        with self.lock:
+            self.counts['requests'] += 1
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            limited = random.random() < self.rate_limit_probability
+            if self.requests_per_minute and self.window_count > self.requests_per_minute:
+                limited = True
+            if limited:
+                self.counts['rate_limited'] += 1
+            return limited
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def read_multipart(self):
+            # just enough multipart/form-data parsing for files.create
+            length = int(self.headers.get('Content-Length', 0))
+            raw = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self.rfile.read(length)
+            fields = {}
+            for part in BytesParser(policy=HTTP).parsebytes(raw).iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                fields[name] = (part.get_filename(), part.get_payload(decode=True))
+            return fields
+
+        def do_GET(self):
+            path = self.path.rstrip('/')
+            if path.endswith('/stats'):
+                self.send_json(200, state.counts)
+            elif '/files/' in path and path.endswith('/content'):
+                file_id = path.split('/')[-2]
+                if file_id not in state.files:
+                    self.send_json(404, {"error": {"message": f"No such file {file_id}"}})
+                    return
+                body = state.files[file_id][1]
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif '/batches/' in path:
+                batch_id = path.split('/')[-1]
+                with state.lock:
+                    batch = dict(state.batches[batch_id]) if batch_id in state.batches else None
+                if batch is None:
+                    self.send_json(404, {"error": {"message": f"No such batch {batch_id}"}})
+                else:
+                    self.send_json(200, batch)
+            else:
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_POST(self):
+            path = self.path.rstrip('/')
+            if path.endswith('/files'):
+                fields = self.read_multipart()
+                filename, content = fields['file']
+                self.send_json(200, add_file(state, filename, content, fields['purpose'][1].decode('utf-8')))
+                return
+            if path.endswith('/batches'):
+                self.send_json(200, create_batch(state, self.read_json()))
+                return
+            if not path.endswith('/chat/completions'):
+                self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            request = self.read_json()
+            time.sleep(max(0, random.gauss(state.latency_ms, state.jitter_ms)) / 1000)
+            if state.should_rate_limit():
+                self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                               {'retry-after': str(state.retry_after), 'x-ratelimit-reset-requests': f"{state.retry_after}s"})
+                return
+            self.send_json(200, chat_completion(request, state.packed_drop_probability))
+    return Handler
+
+
+def chat_completion(request, packed_drop_probability=0.0):
+    user_text = request['messages'][-1]['content']
+    try:
+        posts = json.loads(user_text) # packed request: [{"id": ..., "text": ...}, ...]
+    except json.JSONDecodeError:
+        posts = None
+    if isinstance(posts, list):
+        results = [{"id": post['id'], "sentiment": fake_sentiment(post['text']), "ai_reason": "Mock reason based on keywords."}
+                   for post in posts if random.random() >= packed_drop_probability]
+        content = json.dumps({"results": results})
+        completion_tokens = 20 * len(results)
+    else:
+        content = json.dumps({"sentiment": fake_sentiment(user_text), "ai_reason": "Mock reason based on keywords."})
+        completion_tokens = 20
+    prompt_tokens = sum(len(message['content']) for message in request['messages']) // 4
+    return {
+        "id": f"chatcmpl-mock{random.randrange(10**9)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get('model', 'mock'),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def add_file(state, filename, content, purpose):
+    with state.lock:
+        file_id = f"file-mock{len(state.files) + 1}"
+        metadata = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                    "filename": filename or file_id, "purpose": purpose, "status": "processed"}
+        state.files[file_id] = (metadata, content)
+    return metadata
+
+
+def create_batch(state, request):
+    with state.lock:
+        batch_id = f"batch_mock{len(state.batches) + 1}"
+        batch = {"id": batch_id, "object": "batch", "endpoint": request['endpoint'], "input_file_id": request['input_file_id'],
+                 "completion_window": request['completion_window'], "status": "in_progress", "created_at": int(time.time()),
+                 "output_file_id": None, "error_file_id": None,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        state.batches[batch_id] = batch
+    threading.Thread(target=run_batch, args=(state, batch_id), daemon=True).start()
+    return dict(batch)
+
+
+def run_batch(state, batch_id):
+    # answers every request in the input file, failing a random share of them into the error file
+    time.sleep(state.batch_seconds)
+    with state.lock:
+        batch = state.batches[batch_id]
+        content = state.files[batch['input_file_id']][1]
+    outputs = []
+    errors = []
+    for line in content.decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if random.random() < state.batch_failure_probability:
+            errors.append({"id": f"batch_req_{len(errors)}", "custom_id": request['custom_id'], "response": None,
+                           "error": {"code": "server_error", "message": "Mock failure"}})
+        else:
+            outputs.append({"id": f"batch_req_{len(outputs)}", "custom_id": request['custom_id'], "error": None,
+                            "response": {"status_code": 200, "request_id": f"req_{len(outputs)}", "body": chat_completion(request['body'])}})
+    output_file = add_file(state, f"{batch_id}_output.jsonl", "".join(json.dumps(o) + "\n" for o in outputs).encode('utf-8'), "batch_output")
+    error_file = add_file(state, f"{batch_id}_errors.jsonl", "".join(json.dumps(e) + "\n" for e in errors).encode('utf-8'), "batch_output") if errors else None
+    with state.lock:
+        batch.update({"status": "completed", "completed_at": int(time.time()), "output_file_id": output_file['id'],
+                      "error_file_id": error_file['id'] if error_file else None,
+                      "request_counts": {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}})
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256 # the default backlog of 5 resets connections once ~50 requests arrive together
+
+
+def start_server(port=0, latency_ms=200, jitter_ms=50, rate_limit_probability=0.0, retry_after=1, requests_per_minute=0,
+                 batch_failure_probability=0.0, batch_seconds=1.0, packed_drop_probability=0.0):
+    """Start the mock in a background thread. Returns (server, base_url); call server.shutdown() when done."""
+    state = MockState(latency_ms, jitter_ms, rate_limit_probability, retry_after, requests_per_minute,
+                      batch_failure_probability, batch_seconds, packed_drop_probability)
+    server = MockServer(('127.0.0.1', port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI endpoint with latency and 429s")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=50)
+    parser.add_argument('--rate-limit-probability', type=float, default=0.05)
+    parser.add_argument('--retry-after', type=float, default=1)
+    parser.add_argument('--requests-per-minute', type=int, default=0, help="hard limit per minute, 0 for none")
+    parser.add_argument('--batch-failure-probability', type=float, default=0.02)
+    parser.add_argument('--batch-seconds', type=float, default=5, help="how long a batch stays in_progress")
+    parser.add_argument('--packed-drop-probability', type=float, default=0.02, help="share of posts missing from packed replies")
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.latency_ms, args.jitter_ms, args.rate_limit_probability,
+                                    args.retry_after, args.requests_per_minute, args.batch_failure_probability,
+                                    args.batch_seconds, args.packed_drop_probability)
+    print(f"Mock OpenAI server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
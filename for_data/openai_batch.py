@@ -0,0 +1,247 @@
+# Bulk sentiment labeling through the OpenAI Batch API (half the price of the per-row path, no rate limit juggling).
+# Run sentimize_data.py with DEFER_TO_BATCH_API = True first, so wsb_sub_processed.csv has tickers but no sentiment,
+# then run this. It writes JSONL request files for every ticker-matched row that still has no sentiment, submits them,
+# polls until they finish and merges the labels back by row id. Rows that failed are simply still unlabeled,
+# so the next round re-queues only those. Progress is kept in batch_jobs/state.json, so it can be stopped and rerun.
+# Don't run it while sentimize_data.py is appending to the same output.
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python openai_batch.py   (against mock_openai_server.py)
+import json
+import os
+import time
+import pandas as pd
+import openai
+from sentiment_client import OPENAI_MODEL_NAME, MAX_RESPONSE_TOKENS, build_messages, parse_sentiment_response, truncate_text
+from sentiment_cache import SentimentCache, VALID_SENTIMENTS, cache_key
+from row_triage import SKIPPED_PREFIX, dead_kind
+from checkpoint import Checkpoint
+import processed_store
+
+# Configurations
+input_path = 'wsb_sub_sentiment.csv' # only used to find sentimize_data.py's checkpoint
+processed_path = 'wsb_sub_processed.csv'
+CHECKPOINT_PATH = 'wsb_sub_processed.checkpoint.json'
+PARQUET_PATH = 'wsb_sub_processed_parquet' # updated alongside the CSV if sentimize_data.py writes it
+BATCH_DIR = 'batch_jobs'
+STATE_PATH = os.path.join(BATCH_DIR, 'state.json')
+MAX_REQUESTS_PER_FILE = 50_000 # Batch API limit per input file
+POLL_SECONDS = 60
+MAX_ROUNDS = 3 # first pass plus two re-queues of failed rows
+READ_CHUNK_SIZE = 100_000
+USE_SENTIMENT_CACHE = True
+SKIP_DEAD_ROWS = True # removed/deleted/link-only posts (row_triage.dead_kind) aren't worth a request
+SENTIMENT_CACHE_PATH = 'sentiment_cache.sqlite'
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def row_custom_id(row_id):
+    return f"row-{row_id}"
+
+
+def row_id_from_custom_id(custom_id):
+    return int(custom_id.split('-', 1)[1])
+
+
+def combined_text(row, title_col='title', selftext_col='selftext'):
+    # same text extraction() sends to the API
+    title_text = str(row[title_col]).lower() if pd.notna(row[title_col]) else ""
+    self_text = str(row[selftext_col]).lower() if pd.notna(row[selftext_col]) else ""
+    return title_text + " " + self_text
+
+
+def pending_rows(processed_path):
+    """Yield (row_id, text) for rows with tickers but no sentiment. row_id is the 0-based data row in the CSV.
+    Rows row_triage.py skipped on purpose (removed/deleted/link posts) stay unlabeled."""
+    row_id = 0
+    for chunk in pd.read_csv(processed_path, chunksize=READ_CHUNK_SIZE, usecols=['title', 'selftext', 'sentiment', 'ai_reason', 'tickers']):
+        needs_label = chunk['sentiment'].isna() & chunk['tickers'].notna() & (chunk['tickers'] != '[]')
+        needs_label &= ~chunk['ai_reason'].fillna('').astype(str).str.startswith(SKIPPED_PREFIX)
+        for offset, row in chunk[needs_label].iterrows():
+            text = combined_text(row)
+            if SKIP_DEAD_ROWS and dead_kind(*(str(row[column]).lower() if pd.notna(row[column]) else "" for column in ('title', 'selftext'))):
+                continue
+            if text.strip():
+                yield row_id + offset - chunk.index[0], text
+        row_id += len(chunk)
+
+
+def batch_request(row_id, text, model=OPENAI_MODEL_NAME):
+    return {
+        "custom_id": row_custom_id(row_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": model, "messages": build_messages(truncate_text(text)), "temperature": 0.2,
+                 "max_tokens": MAX_RESPONSE_TOKENS, "response_format": {"type": "json_object"}},
+    }
+
+
+def cache_keys_path(path):
+    return f"{path}.cache_keys.json"
+
+
+def write_request_files(rows, round_number):
+    # next to each request file goes a custom_id -> sentiment cache key map, so merged labels can be cached too
+    paths = []
+    handle = None
+    keys = {}
+    for row_id, text in rows:
+        if handle is None or len(keys) >= MAX_REQUESTS_PER_FILE:
+            if handle is not None:
+                handle.close()
+                with open(cache_keys_path(paths[-1]), 'w') as f:
+                    json.dump(keys, f)
+            path = os.path.join(BATCH_DIR, f"round{round_number}_part{len(paths) + 1}.jsonl")
+            handle = open(path, 'w', encoding='utf-8')
+            paths.append(path)
+            keys = {}
+        request = batch_request(row_id, text)
+        handle.write(json.dumps(request))
+        handle.write("\n")
+        keys[request['custom_id']] = cache_key(text)
+    if handle is not None:
+        handle.close()
+        with open(cache_keys_path(paths[-1]), 'w') as f:
+            json.dump(keys, f)
+    return paths
+
+
+def submit(client, path):
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    batch = client.batches.create(input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h')
+    print(f"Submitted {path} as batch {batch.id}")
+    return batch.id
+
+
+def wait_for(client, batch_id):
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            print(f"Batch {batch_id} {batch.status}: {batch.request_counts}")
+            return batch
+        print(f"Batch {batch_id} is {batch.status}, checking again in {POLL_SECONDS}s")
+        time.sleep(POLL_SECONDS)
+
+
+def read_file_lines(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+
+def collect_results(client, batch):
+    """Return ({row_id: (sentiment, reason)}, failed row count). Anything not labeled stays pending."""
+    labels = {}
+    failed = 0
+    for result in read_file_lines(client, batch.output_file_id):
+        response = result.get('response') or {}
+        if response.get('status_code') != 200:
+            failed += 1
+            continue
+        try:
+            sentiment, reason = parse_sentiment_response(response['body']['choices'][0]['message']['content'])
+        except (KeyError, IndexError, json.JSONDecodeError):
+            failed += 1
+            continue
+        if sentiment not in VALID_SENTIMENTS:
+            failed += 1
+            continue
+        labels[row_id_from_custom_id(result['custom_id'])] = (sentiment, reason)
+    failed += len(read_file_lines(client, batch.error_file_id))
+    return labels, failed
+
+
+def merge_results(processed_path, labels):
+    """Fill sentiment/ai_reason by row id, rewriting the CSV through a temp file so a crash can't corrupt it."""
+    temp_path = f"{processed_path}.merging"
+    row_id = 0
+    merged = 0
+    with open(temp_path, 'w', encoding='utf-8', newline='') as handle:
+        for i, chunk in enumerate(pd.read_csv(processed_path, chunksize=READ_CHUNK_SIZE)):
+            chunk['sentiment'] = chunk['sentiment'].astype(object)
+            chunk['ai_reason'] = chunk['ai_reason'].astype(object)
+            for position in range(len(chunk)):
+                label = labels.get(row_id + position)
+                if label is not None:
+                    chunk.iat[position, chunk.columns.get_loc('sentiment')] = label[0]
+                    chunk.iat[position, chunk.columns.get_loc('ai_reason')] = label[1]
+                    merged += 1
+            chunk.to_csv(handle, header=(i == 0), index=False)
+            row_id += len(chunk)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, processed_path)
+    # the checkpoint remembers the output size, so tell it about the rewrite
+    Checkpoint.load(CHECKPOINT_PATH, input_path, processed_path).record_output_rewrite()
+    return merged
+
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, 'r') as f:
+            return json.load(f)
+    return {'round': 0, 'batches': []}
+
+
+def save_state(state):
+    temp_path = f"{STATE_PATH}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, STATE_PATH)
+
+
+def run(client, processed_path, sentiment_cache=None):
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    state = load_state()
+    while True:
+        open_batches = [entry for entry in state['batches'] if not entry['merged']]
+        if open_batches:
+            # wait for the whole round, then rewrite the CSV once instead of once per batch
+            labels = {}
+            for entry in open_batches:
+                batch = wait_for(client, entry['id'])
+                batch_labels, failed = collect_results(client, batch)
+                labels.update(batch_labels)
+                entry['labeled'] = len(batch_labels)
+                entry['failed'] = failed
+                if sentiment_cache is not None and os.path.exists(cache_keys_path(entry['path'])):
+                    with open(cache_keys_path(entry['path']), 'r') as f:
+                        keys = json.load(f)
+                    sentiment_cache.put_many([(keys[row_custom_id(row_id)], sentiment, reason)
+                                              for row_id, (sentiment, reason) in batch_labels.items()])
+            merged = merge_results(processed_path, labels)
+            processed_store.update_labels(PARQUET_PATH, labels)
+            for entry in open_batches:
+                entry['merged'] = True
+            save_state(state)
+            failed = sum(entry['failed'] for entry in open_batches)
+            print(f"Merged {merged:,} labels into '{processed_path}', {failed:,} failed and will be re-queued")
+            continue
+
+        if state['round'] >= MAX_ROUNDS:
+            print(f"Stopping after {MAX_ROUNDS} rounds")
+            break
+        paths = write_request_files(pending_rows(processed_path), state['round'] + 1)
+        if not paths:
+            print("No unlabeled ticker rows left")
+            break
+        state['round'] += 1
+        for path in paths:
+            state['batches'].append({'id': submit(client, path), 'path': path, 'round': state['round'], 'merged': False})
+            save_state(state)
+    return state
+
+
+if __name__ == "__main__":
+    try:
+        client = openai.OpenAI()
+    except openai.OpenAIError as e:
+        print(f"ERROR: OpenAI API key issue or client initialization failed: {e}")
+        print("Ensure OPENAI_API_KEY environment variable is set correctly.")
+        exit()
+    if not os.path.exists(processed_path):
+        print(f"Error: The file '{processed_path}' was not found.")
+        exit(1)
+    sentiment_cache = SentimentCache(SENTIMENT_CACHE_PATH) if USE_SENTIMENT_CACHE else None
+    final_state = run(client, processed_path, sentiment_cache)
+    labeled = sum(entry.get('labeled', 0) for entry in final_state['batches'])
+    print(f"Batch labeling finished: {labeled:,} rows labeled over {final_state['round']} round(s)")
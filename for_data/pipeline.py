@@ -0,0 +1,277 @@
+# One streaming pass from the Pushshift .zst dump to labeled rows, instead of
+# dig_through.py -> wsb_sub.csv -> create_headers.py -> wsb_sub_sentiment.csv -> sentimize_data.py.
+# Stages are generators: decompress -> filter -> ticker extract + sentiment -> sink. Each stage runs in its own thread
+# and hands its output on through a small bounded queue, so a slow stage (usually the API) holds the ones before it
+# back instead of letting batches pile up in memory, and no intermediate CSV is written.
+# The output is the same wsb_sub_processed.csv (plus the parquet store and ticker index) sentimize_data.py writes.
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python pipeline.py   (against mock_openai_server.py)
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import dig_through
+from ticker_matcher import build_ticker_matcher, match_tickers
+from sentiment_client import AsyncSentimentClient, estimated_cost, OPENAI_MODEL_NAME, PACKED_PROMPT_VERSION, PROMPT_VERSION
+from sentiment_cache import SentimentCache
+from sentiment_backends import LocalFirstClient, make_backend
+from row_triage import RowTriage, label_namespace
+import processed_store
+from ticker_index import TickerIndex
+from metrics import Metrics
+
+# Configurations
+input_file = 'wallstreetbets_submissions.zst' # a submissions dump, comments have no title/selftext
+output_path = 'wsb_sub_processed.csv'
+ticker_file = 'ticker_list.txt'
+# what dig_through.py writes for submissions and create_headers.py names
+COLUMN_NAMES = ['score', 'date', 'title', 'author', 'permalink', 'selftext']
+# same meaning as field/values/exact_match/from_date/to_date in dig_through.py, None keeps every post in the dates
+FILTER_FIELD = None
+FILTER_VALUES = []
+EXACT_MATCH = False
+FROM_DATE = datetime.strptime("2018-01-01", "%Y-%m-%d")
+TO_DATE = datetime.strptime("2022-12-31", "%Y-%m-%d")
+FILTER_WORKERS = 1 # worker processes for decoding and filtering, see dig_through.py
+BATCH_LINES = 20_000 # dump lines per filter batch
+CHUNK_SIZE = 500 # rows per labeling chunk and per write, like sentimize_data.py
+QUEUE_SIZE = 2 # items buffered between two stages, this is what bounds memory
+
+# sentiment, same settings as sentimize_data.py
+DEFER_TO_BATCH_API = False # only extract tickers, label later with openai_batch.py
+MAX_CONCURRENT_REQUESTS = 50
+REQUESTS_PER_MINUTE = 5000
+TOKENS_PER_MINUTE = 2_000_000
+MAX_API_RETRIES = 6
+PACK_TOKEN_BUDGET = None # e.g. 4000
+MAX_POSTS_PER_REQUEST = 20
+USE_SENTIMENT_CACHE = True
+SENTIMENT_CACHE_PATH = 'sentiment_cache.sqlite'
+SENTIMENT_CACHE_MAX_ENTRIES = 5_000_000
+# 'api' labels every ticker row with OpenAI, 'local' labels them all on the CPU with LOCAL_BACKEND (sentiment_backends.py),
+# 'hybrid' only sends the rows the local backend is less than LOCAL_CONFIDENCE_THRESHOLD sure about to the API
+SENTIMENT_BACKEND = 'api'
+LOCAL_BACKEND = 'lexicon'
+LOCAL_CONFIDENCE_THRESHOLD = 0.6
+# row_triage.py: removed/deleted/link-only posts are labeled from their title locally ('title'), left unlabeled ('skip')
+# or sent like any other row (None). With DEDUP_TEXTS, texts labeled before, in this run or in earlier ones (kept in
+# the sentiment cache, this run only without USE_SENTIMENT_CACHE), get the same label again
+DEAD_ROW_ACTION = 'title'
+DEDUP_TEXTS = True
+WRITE_PARQUET = True
+PARQUET_PATH = 'wsb_sub_processed_parquet'
+WRITE_TICKER_INDEX = True
+TICKER_INDEX_PATH = 'ticker_index.sqlite'
+# per-stage timings, API latency percentiles and cost (metrics.py): a progress line every PROGRESS_SECONDS,
+# and the whole report as json at the end (None to skip the file)
+PROGRESS_SECONDS = 30
+METRICS_REPORT_PATH = 'pipeline_metrics.json'
+
+
+def threaded(iterable, maxsize=QUEUE_SIZE):
+    """Run an iterator in its own thread and yield its items here. put() blocks while the queue is full, which is the backpressure."""
+    items = queue.Queue(maxsize)
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(('item', item))
+        except BaseException as e: # hand the error to the consumer instead of dying quietly
+            items.put(('error', e))
+            return
+        items.put(('done', None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        kind, item = items.get()
+        if kind == 'done':
+            return
+        if kind == 'error':
+            raise item
+        yield item
+
+
+def filtered_rows(input_file, stats, metrics, from_date=None, to_date=None):
+    """Batches of csv rows (lists, COLUMN_NAMES order) for the posts that pass the filter, between FROM_DATE and TO_DATE unless given."""
+    from_date = from_date or FROM_DATE
+    to_date = to_date or TO_DATE
+    values = [value.lower() for value in FILTER_VALUES]
+    filter_args = ("rows", FILTER_FIELD, values, from_date, to_date, None, EXACT_MATCH, True, dig_through.pre_filter)
+    batches = threaded(dig_through.read_batches(input_file, BATCH_LINES, from_date, to_date))
+    for (rows, total, matched, bad, created, warnings, timings), _, _, read_seconds in dig_through.filter_batches(batches, filter_args, FILTER_WORKERS):
+        metrics.add_time('decompress', read_seconds, total)
+        metrics.add_timings(timings, total)
+        stats['lines'] += total
+        stats['matched'] += matched
+        stats['bad_lines'] += bad
+        if created is not None and (stats.get('newest_created') is None or created > stats['newest_created']):
+            stats['newest_created'] = created # the newest post read, matched or not, for ingest.py
+        if rows:
+            yield rows
+
+
+def rows_to_chunk(rows):
+    # shaped like a chunk of wsb_sub_sentiment.csv read back with pandas
+    chunk = pd.DataFrame(rows, columns=COLUMN_NAMES)
+    chunk['score'] = pd.to_numeric(chunk['score'])
+    for column in COLUMN_NAMES[1:]:
+        chunk[column] = chunk[column].mask(chunk[column] == '', np.nan) # read_csv reads empty fields as NaN
+    chunk['sentiment'] = None
+    chunk['ai_reason'] = None
+    chunk['tickers'] = None
+    return chunk
+
+
+def rechunk(row_batches, chunk_size):
+    buffer = []
+    for rows in row_batches:
+        buffer.extend(rows)
+        start = 0
+        while len(buffer) - start >= chunk_size:
+            yield rows_to_chunk(buffer[start:start + chunk_size])
+            start += chunk_size
+        buffer = buffer[start:]
+    if buffer:
+        yield rows_to_chunk(buffer)
+
+
+def label_chunk(chunk, ticker_matcher, sentiment_client, metrics, row_triage=None):
+    """Tickers for every row, sentiment for the rows with tickers. Same results as sentimize_data.extraction().
+    With a row_triage, dead rows and repeats are handled there and only the rest reach sentiment_client."""
+    started = time.perf_counter()
+    titles = chunk['title'].fillna('').astype(str).str.lower().tolist()
+    selftexts = chunk['selftext'].fillna('').astype(str).str.lower().tolist()
+    texts = [title + " " + selftext for title, selftext in zip(titles, selftexts)]
+    found_tickers = []
+    pending = [] # (position, text) to label
+    for position, text in enumerate(texts):
+        tickers = match_tickers(ticker_matcher, text) if text.strip() else set()
+        found_tickers.append(json.dumps(sorted(tickers)))
+        if tickers and not DEFER_TO_BATCH_API:
+            pending.append((position, text))
+    metrics.add_time('tickers', time.perf_counter() - started, len(chunk))
+    sentiments = [None] * len(chunk)
+    reasons = [None] * len(chunk)
+    if pending:
+        with metrics.time('sentiment', len(pending)):
+            if row_triage is not None:
+                results = row_triage.label([(titles[position], selftexts[position], text) for position, text in pending],
+                                           sentiment_client.analyze_texts)
+            else:
+                results = sentiment_client.analyze_texts([text for _, text in pending])
+        for (position, _), (sentiment, reason) in zip(pending, results):
+            sentiments[position] = sentiment
+            reasons[position] = reason
+    chunk['sentiment'] = sentiments
+    chunk['ai_reason'] = reasons
+    chunk['tickers'] = found_tickers
+    return chunk
+
+
+def labeled_chunks(chunks, tickers, stats, metrics):
+    ticker_matcher = build_ticker_matcher(tickers)
+    sentiment_client = None
+    prompt_version = PACKED_PROMPT_VERSION if PACK_TOKEN_BUDGET else PROMPT_VERSION
+    # the cache's sqlite connection has to be opened in the thread that uses it, which is the one running this
+    sentiment_cache = None
+    if USE_SENTIMENT_CACHE and (SENTIMENT_BACKEND != 'local' or DEDUP_TEXTS):
+        sentiment_cache = SentimentCache(SENTIMENT_CACHE_PATH, SENTIMENT_CACHE_MAX_ENTRIES, OPENAI_MODEL_NAME, prompt_version)
+    if SENTIMENT_BACKEND != 'local':
+        sentiment_client = AsyncSentimentClient(OPENAI_MODEL_NAME, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE,
+                                                TOKENS_PER_MINUTE, MAX_API_RETRIES, cache=sentiment_cache,
+                                                pack_token_budget=PACK_TOKEN_BUDGET, max_posts_per_request=MAX_POSTS_PER_REQUEST)
+        stats['api'] = sentiment_client.stats
+    if SENTIMENT_BACKEND in ('local', 'hybrid'):
+        sentiment_client = LocalFirstClient(make_backend(LOCAL_BACKEND), sentiment_client, LOCAL_CONFIDENCE_THRESHOLD)
+        stats['local'] = sentiment_client.stats
+    metrics.share_samples('api_latency', sentiment_client.latencies)
+    row_triage = None
+    if DEAD_ROW_ACTION is not None or DEDUP_TEXTS:
+        namespace = label_namespace(SENTIMENT_BACKEND, LOCAL_BACKEND, LOCAL_CONFIDENCE_THRESHOLD, OPENAI_MODEL_NAME, prompt_version)
+        row_triage = RowTriage(DEAD_ROW_ACTION, sentiment_cache, namespace, DEDUP_TEXTS)
+        stats['triage'] = row_triage.stats
+    for chunk in chunks:
+        yield label_chunk(chunk, ticker_matcher, sentiment_client, metrics, row_triage)
+    if row_triage is not None:
+        row_triage.close()
+    if sentiment_cache is not None:
+        sentiment_cache.close()
+
+
+def write_chunks(chunks, output_path, stats, metrics, first_row_id=0, commit=None):
+    """The sink: CSV, parquet store and ticker index, all keyed by the same running row id.
+
+    With first_row_id the outputs are appended to. commit(chunk, first_row_id, output_size) is called once each chunk
+    is durably written everywhere, which is what ingest.py journals.
+    """
+    ticker_index = TickerIndex(TICKER_INDEX_PATH) if WRITE_TICKER_INDEX else None
+    row_id = first_row_id
+    with open(output_path, 'a' if first_row_id else 'w', encoding='utf-8', newline='') as handle:
+        for chunk in chunks:
+            with metrics.time('csv_write', len(chunk)):
+                chunk.to_csv(handle, header=(row_id == 0), index=False)
+            if WRITE_PARQUET:
+                with metrics.time('parquet_write', len(chunk)):
+                    processed_store.append_chunk(chunk, row_id, PARQUET_PATH)
+            if ticker_index is not None:
+                with metrics.time('ticker_index', len(chunk)):
+                    ticker_index.add_chunk(chunk, row_id)
+            if commit is not None:
+                with metrics.time('csv_write'):
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                commit(chunk, row_id, os.fstat(handle.fileno()).st_size)
+            row_id += len(chunk)
+            stats['rows_written'] = row_id - first_row_id
+            stats['labeled'] += int(chunk['sentiment'].notna().sum())
+            metrics.log_progress(row_id - first_row_id, lines=f"{stats['lines']:,}", labeled=f"{stats['labeled']:,}",
+                                 calls_avoided=f"{stats['triage']['calls_avoided']:,}" if 'triage' in stats else 0,
+                                 cost_usd=f"{estimated_cost(stats['api']):.4f}" if 'api' in stats else 0)
+        with metrics.time('csv_write'):
+            handle.flush()
+            os.fsync(handle.fileno())
+    if ticker_index is not None:
+        ticker_index.close()
+    return row_id - first_row_id
+
+
+def run(input_file, output_path, tickers, metrics_path=METRICS_REPORT_PATH):
+    stats = {'lines': 0, 'matched': 0, 'bad_lines': 0, 'rows_written': 0, 'labeled': 0}
+    metrics = Metrics(PROGRESS_SECONDS)
+    rows = threaded(filtered_rows(input_file, stats, metrics))
+    chunks = threaded(labeled_chunks(rechunk(rows, CHUNK_SIZE), tickers, stats, metrics))
+    write_chunks(chunks, output_path, stats, metrics)
+    stats['seconds'] = round(metrics.elapsed(), 2)
+    if metrics_path is not None:
+        # stages run in their own threads, so their seconds overlap and can add up to more than the wall time
+        cost = round(estimated_cost(stats['api']), 4) if 'api' in stats else 0.0
+        metrics.write_report(metrics_path, stats['rows_written'], pipeline=stats, cost_usd=cost)
+    return stats
+
+
+if __name__ == "__main__":
+    if not os.path.exists(input_file):
+        print(f"Error: The file '{input_file}' was not found.")
+        exit(1)
+    if SENTIMENT_BACKEND not in ('api', 'local', 'hybrid'):
+        print(f"Error: SENTIMENT_BACKEND has to be 'api', 'local' or 'hybrid', not '{SENTIMENT_BACKEND}'.")
+        exit(1)
+    if "submission" not in input_file:
+        print(f"Error: '{input_file}' doesn't look like a submissions dump, the pipeline needs titles and selftext.")
+        exit(1)
+    for path in (output_path, PARQUET_PATH if WRITE_PARQUET else None, TICKER_INDEX_PATH if WRITE_TICKER_INDEX else None):
+        if path is not None and os.path.exists(path):
+            # the pipeline always starts from the top of the dump, sentimize_data.py is the one that resumes
+            print(f"Error: '{path}' already exists. Move it away first, the pipeline writes a fresh output.")
+            exit(1)
+    try:
+        with open(ticker_file, 'r') as f:
+            tickers = [line.strip().lower() for line in f if line.strip()]
+    except FileNotFoundError:
+        print(f"Error: The file '{ticker_file}' was not found.")
+        exit(1)
+    stats = run(input_file, output_path, tickers)
+    print(f"Pipeline finished: {stats}")
@@ -0,0 +1,310 @@
+# Local daily OHLCV store for the price joins (tsla.py), so an analysis over every ticker in ticker_list.txt doesn't
+# mean one yfinance round-trip per ticker per run. One Parquet file per ticker in PRICE_DIR, plus coverage.json with
+# the date ranges each ticker has been filled for: a covered range can hold no rows at all (weekends, holidays,
+# before the listing), so what's missing can't be told from the rows alone.
+# Fill it offline from CSV exports, or let PriceStore.load() download only the ranges that aren't covered yet, with
+# every ticker missing the same range in a single yfinance call.
+#   python price_store.py import prices/TSLA.csv [more.csv ...]
+#       Yahoo-style Date,Open,High,Low,Close,Adj Close,Volume. The ticker is the file name, or a Ticker/Symbol column
+#   python price_store.py fetch [2018-01-01] [2022-12-31]   (every ticker in ticker_list.txt)
+#   python price_store.py info
+import json
+import os
+import sys
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+try:
+    from aggregates import COUNT_COLUMNS, add_scores
+except ImportError: # imported from the repo root as for_data.price_store
+    from for_data.aggregates import COUNT_COLUMNS, add_scores
+try:
+    import yfinance as yf
+except ImportError:
+    yf = None
+
+PRICE_DIR = 'price_data'
+ticker_file = 'ticker_list.txt'
+FROM_DATE = '2018-01-01'
+TO_DATE = '2022-12-31'
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+DOWNLOAD_BATCH = 50 # tickers per yfinance call
+# how many calendar entries in a row a price is carried over when a ticker has no row: long weekends and market
+# closures, but not months after a delisting
+MAX_FILL_DAYS = 5
+
+
+def yahoo_symbol(ticker):
+    return ticker.upper().replace('.', '-') # BRK.B is BRK-B on Yahoo
+
+
+def normalize_columns(frame):
+    frame = frame.rename(columns=lambda name: str(name).strip().lower().replace(' ', '_'))
+    if 'adj_close' not in frame.columns and 'close' in frame.columns:
+        frame['adj_close'] = frame['close']
+    return frame
+
+
+def clean_prices(frame):
+    """date + PRICE_COLUMNS, one row per trading day, sorted. Rows with no close at all are dropped."""
+    frame = normalize_columns(frame)
+    if 'date' not in frame.columns: # yfinance keeps the date in the index
+        frame = normalize_columns(frame.rename_axis('date').reset_index())
+    missing = [column for column in ['date', 'close'] if column not in frame.columns]
+    if missing:
+        raise ValueError(f"price data has no {', '.join(missing)} column")
+    prices = pd.DataFrame({'date': pd.to_datetime(frame['date']).dt.tz_localize(None).dt.normalize()})
+    for column in PRICE_COLUMNS:
+        prices[column] = pd.to_numeric(frame[column], errors='coerce').to_numpy() if column in frame.columns else np.nan
+    prices = prices.dropna(subset=['close'])
+    return prices.drop_duplicates('date', keep='last').sort_values('date', ignore_index=True)
+
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping (start, end) Timestamps, ranges that touch are joined."""
+    merged = []
+    for start, end in sorted((pd.Timestamp(start), pd.Timestamp(end)) for start, end in ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(covered, start, end):
+    """The parts of [start, end] (days, both included) that no covered range holds."""
+    start, end = pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize()
+    missing = []
+    for covered_start, covered_end in merge_ranges(covered):
+        if covered_end < start:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > start:
+            missing.append((start, covered_start - timedelta(days=1)))
+        start = max(start, covered_end + timedelta(days=1))
+        if start > end:
+            return missing
+    missing.append((start, end))
+    return missing
+
+
+def download_yfinance(tickers, start, end):
+    """{ticker: prices} for start..end (both included), all tickers in one request."""
+    if yf is None:
+        raise ImportError("fetching prices needs the yfinance package, or fill the store offline with 'python price_store.py import'")
+    symbols = {yahoo_symbol(ticker): ticker for ticker in tickers}
+    data = yf.download(list(symbols), start=pd.Timestamp(start).strftime('%Y-%m-%d'),
+                       end=(pd.Timestamp(end) + timedelta(days=1)).strftime('%Y-%m-%d'), # yfinance's end is exclusive
+                       interval='1d', group_by='ticker', auto_adjust=False, progress=False, threads=True)
+    result = {}
+    for symbol, ticker in symbols.items():
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            frame = data[symbol]
+        else:
+            frame = data # older yfinance, single ticker
+        frame = frame.dropna(how='all')
+        if len(frame):
+            result[ticker] = clean_prices(frame)
+    return result
+
+
+def read_price_csv(path):
+    """{ticker: prices} from one CSV, either a single ticker's export or a long file with a ticker/symbol column."""
+    frame = normalize_columns(pd.read_csv(path))
+    ticker_column = next((column for column in ('ticker', 'symbol') if column in frame.columns), None)
+    if ticker_column is None:
+        return {os.path.splitext(os.path.basename(path))[0].upper(): clean_prices(frame)}
+    return {str(ticker).upper(): clean_prices(group) for ticker, group in frame.groupby(ticker_column)}
+
+
+def covered_until(prices, range_end):
+    # the last day that came back, or as far as the range reaches into completed days: a gap there (weekend, holiday,
+    # before the listing, delisted) won't fill in later, while today and the days after can still get rows
+    last_completed = pd.Timestamp.today().normalize() - timedelta(days=1)
+    until = min(pd.Timestamp(range_end), last_completed)
+    return until if prices.empty else max(prices['date'].max(), until)
+
+
+class PriceStore:
+    """Per-ticker Parquet files plus the ranges they cover. Tickers are stored uppercase, like match_tickers() returns them."""
+
+    def __init__(self, root=PRICE_DIR, downloader=download_yfinance):
+        self.root = root
+        self.downloader = downloader
+        self.coverage_path = os.path.join(root, 'coverage.json')
+        self.coverage = {}
+        if os.path.exists(self.coverage_path):
+            with open(self.coverage_path, 'r') as f:
+                self.coverage = {ticker: [(pd.Timestamp(start), pd.Timestamp(end)) for start, end in ranges]
+                                 for ticker, ranges in json.load(f).items()}
+
+    def path(self, ticker):
+        return os.path.join(self.root, f"{ticker.upper()}.parquet")
+
+    def save_coverage(self):
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = f"{self.coverage_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({ticker: [(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')) for start, end in ranges]
+                       for ticker, ranges in sorted(self.coverage.items())}, f, indent=1)
+        os.replace(temp_path, self.coverage_path)
+
+    def read(self, ticker, start=None, end=None):
+        path = self.path(ticker)
+        if not os.path.exists(path):
+            return pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), **{column: pd.Series(dtype=float) for column in PRICE_COLUMNS}})
+        prices = pd.read_parquet(path)
+        if start is not None:
+            prices = prices[prices['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            prices = prices[prices['date'] <= pd.Timestamp(end)]
+        return prices.reset_index(drop=True)
+
+    def write(self, ticker, prices, start=None, end=None):
+        """Merge prices into the ticker's file (new rows win on the same date) and mark start..end as covered
+        (the prices' own first and last day when not given). Call save_coverage() afterwards."""
+        ticker = ticker.upper()
+        prices = clean_prices(prices)
+        if start is None or end is None:
+            if prices.empty:
+                return
+            start, end = prices['date'].min() if start is None else start, prices['date'].max() if end is None else end
+        if len(prices):
+            merged = pd.concat([self.read(ticker), prices], ignore_index=True)
+            merged = merged.drop_duplicates('date', keep='last').sort_values('date', ignore_index=True)
+            os.makedirs(self.root, exist_ok=True)
+            temp_path = f"{self.path(ticker)}.tmp"
+            merged.to_parquet(temp_path, index=False)
+            os.replace(temp_path, self.path(ticker))
+        self.coverage[ticker] = merge_ranges(self.coverage.get(ticker, []) + [(pd.Timestamp(start), pd.Timestamp(end))])
+
+    def missing(self, tickers, start, end):
+        """{ticker: [(start, end), ...]} for the tickers with anything left to fetch in start..end."""
+        result = {}
+        for ticker in tickers:
+            ranges = missing_ranges(self.coverage.get(ticker.upper(), []), start, end)
+            if ranges:
+                result[ticker.upper()] = ranges
+        return result
+
+    def fetch_missing(self, tickers, start, end):
+        """Download what the store doesn't cover yet. Tickers missing the same range share requests. Returns the number of requests."""
+        by_range = {}
+        for ticker, ranges in self.missing(tickers, start, end).items():
+            for missing_range in ranges:
+                by_range.setdefault(missing_range, []).append(ticker)
+        requests = 0
+        for (range_start, range_end), range_tickers in sorted(by_range.items()):
+            for first in range(0, len(range_tickers), DOWNLOAD_BATCH):
+                batch = range_tickers[first:first + DOWNLOAD_BATCH]
+                requests += 1
+                try:
+                    downloaded = self.downloader(batch, range_start, range_end)
+                except ImportError:
+                    raise
+                except Exception as e:
+                    # nothing gets marked covered, the next load() asks again
+                    print(f"Error downloading prices for {len(batch)} tickers, {range_start:%Y-%m-%d} to {range_end:%Y-%m-%d}: {e}")
+                    continue
+                for ticker in batch:
+                    # an empty answer still covers the completed days, a ticker that wasn't listed yet (or isn't
+                    # served any more) stays empty there instead of being asked for again on every load()
+                    prices = clean_prices(downloaded.get(ticker, pd.DataFrame({'date': [], 'close': []})))
+                    until = covered_until(prices, range_end)
+                    if until >= pd.Timestamp(range_start):
+                        self.write(ticker, prices, range_start, until)
+                self.save_coverage()
+        return requests
+
+    def load(self, tickers, start, end, fetch=True):
+        """Long table (ticker, date, PRICE_COLUMNS) for start..end, fetching missing ranges first unless fetch is False."""
+        tickers = [ticker.upper() for ticker in tickers]
+        if fetch:
+            self.fetch_missing(tickers, start, end)
+        frames = [self.read(ticker, start, end).assign(ticker=ticker) for ticker in tickers]
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return pd.DataFrame(columns=['ticker', 'date'] + PRICE_COLUMNS)
+        return pd.concat(frames, ignore_index=True)[['ticker', 'date'] + PRICE_COLUMNS]
+
+
+def trading_calendar(prices):
+    """Every day any of the tickers traded, sorted: the shared calendar the joins are done on."""
+    return pd.DatetimeIndex(np.unique(prices['date'].to_numpy()))
+
+
+def align_prices(prices, field='close', calendar=None):
+    """Wide frame (dates x tickers) of one field. On a calendar with days a ticker didn't trade, its last price carries
+    forward for up to MAX_FILL_DAYS entries, never before its first row."""
+    wide = prices.pivot(index='date', columns='ticker', values=field)
+    if calendar is None:
+        return wide
+    return wide.reindex(wide.index.union(calendar)).ffill(limit=MAX_FILL_DAYS).reindex(calendar)
+
+
+def join_sentiment(aggregates, prices, calendar=None):
+    """aggregates.aggregate_sentiment()'s daily rows joined with prices for every ticker at once.
+
+    Posts are counted towards the first trading day on or after the day they were made (weekend posts meet Monday's
+    price), every (ticker, trading day) with a price gets a row, days without posts have zero counts and NaN scores.
+    Adds 'return', the close-to-close change in adj_close.
+    """
+    calendar = trading_calendar(prices) if calendar is None else pd.DatetimeIndex(calendar)
+    daily = aggregates[aggregates['period'] == 'D']
+    daily = daily[daily['ticker'].isin(prices['ticker'].unique())]
+    position = np.searchsorted(calendar.to_numpy(), pd.to_datetime(daily['date']).to_numpy(), side='left')
+    on_calendar = position < len(calendar)
+    counts = daily.loc[on_calendar, ['ticker'] + COUNT_COLUMNS].assign(date=calendar.to_numpy()[position[on_calendar]])
+    counts = counts.groupby(['ticker', 'date'], as_index=False, sort=False)[COUNT_COLUMNS].sum()
+
+    tickers = np.sort(prices['ticker'].unique())
+    grid = pd.MultiIndex.from_product([tickers, calendar], names=['ticker', 'date'])
+    # carry prices over calendar days a ticker didn't trade, like a trading halt
+    aligned = {field: align_prices(prices, field, calendar).reindex(columns=tickers) for field in PRICE_COLUMNS}
+    joined = pd.DataFrame({field: wide.to_numpy().T.ravel() for field, wide in aligned.items()}, index=grid).reset_index()
+    joined = joined.dropna(subset=['close'])
+    joined = joined.merge(counts, on=['ticker', 'date'], how='left')
+    joined[COUNT_COLUMNS] = joined[COUNT_COLUMNS].fillna(0).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        joined = add_scores(joined)
+    joined['return'] = joined.groupby('ticker', sort=False)['adj_close'].pct_change()
+    return joined.sort_values(['ticker', 'date'], ignore_index=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'fetch', 'info'):
+        print("Usage: python price_store.py import file.csv [...] | fetch [from] [to] | info")
+        exit(1)
+    store = PriceStore()
+    if sys.argv[1] == 'import':
+        for path in sys.argv[2:]:
+            if not os.path.exists(path):
+                print(f"Error: The file '{path}' was not found.")
+                exit(1)
+            for ticker, prices in read_price_csv(path).items():
+                store.write(ticker, prices)
+                print(f"Imported {len(prices):,} days of {ticker} from '{path}'")
+        store.save_coverage()
+    elif sys.argv[1] == 'fetch':
+        start = sys.argv[2] if len(sys.argv) > 2 else FROM_DATE
+        end = sys.argv[3] if len(sys.argv) > 3 else TO_DATE
+        try:
+            with open(ticker_file, 'r') as f:
+                tickers = [line.strip().upper() for line in f if line.strip()]
+        except FileNotFoundError:
+            print(f"Error: The file '{ticker_file}' was not found.")
+            exit(1)
+        print(f"{len(store.missing(tickers, start, end)):,} of {len(tickers):,} tickers have ranges missing in {start}..{end}")
+        try:
+            requests = store.fetch_missing(tickers, start, end)
+        except ImportError as e:
+            print(f"Error: {e}")
+            exit(1)
+        print(f"Done in {requests:,} requests")
+    else:
+        for ticker, ranges in sorted(store.coverage.items()):
+            days = len(store.read(ticker))
+            print(f"{ticker:8} {days:6,} days  " + ", ".join(f"{start:%Y-%m-%d}..{end:%Y-%m-%d}" for start, end in ranges))
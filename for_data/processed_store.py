@@ -0,0 +1,210 @@
+# Columnar copy of wsb_sub_processed.csv: Parquet partitioned by year/month, dictionary-encoded sentiment and a real
+# list<string> tickers column. Readers only load the columns they ask for, and date ranges skip whole partitions.
+# sentimize_data.py appends to it chunk by chunk; convert an existing CSV once with:
+#   python processed_store.py [wsb_sub_processed.csv] [wsb_sub_processed_parquet]
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARQUET_PATH = 'wsb_sub_processed_parquet'
+CSV_PATH = 'wsb_sub_processed.csv'
+
+SCHEMA = pa.schema([
+    ('row_id', pa.int64()), # 0-based data row in wsb_sub_processed.csv, stable across rewrites
+    ('score', pa.int64()),
+    ('date', pa.timestamp('ms')),
+    ('title', pa.string()),
+    ('author', pa.string()),
+    ('permalink', pa.string()),
+    ('selftext', pa.string()),
+    ('sentiment', pa.dictionary(pa.int8(), pa.string())),
+    ('ai_reason', pa.string()),
+    ('tickers', pa.list_(pa.string())),
+    ('year', pa.int16()),
+    ('month', pa.int8()),
+])
+PARTITION_COLUMNS = ['year', 'month']
+
+
+def parse_tickers(value):
+    """Tickers as a list, whether they come from the CSV (JSON string) or from Parquet (list/array)."""
+    if isinstance(value, str):
+        try:
+            return json.loads(value) if value.startswith('[') else []
+        except json.JSONDecodeError:
+            return []
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return list(value)
+    return []
+
+
+def _text_array(series):
+    return pa.array([None if pd.isna(value) else str(value) for value in series], type=pa.string())
+
+
+def chunk_to_table(chunk, first_row_id):
+    """Arrow table for a processed chunk (as written to the CSV) whose first row is data row first_row_id."""
+    dates = pd.to_datetime(chunk['date'])
+    sentiment = pa.array([None if pd.isna(value) else str(value) for value in chunk['sentiment']], type=pa.string())
+    columns = {
+        'row_id': pa.array(np.arange(first_row_id, first_row_id + len(chunk)), type=pa.int64()),
+        'score': pa.array(pd.to_numeric(chunk['score'], errors='coerce').astype('Int64'), type=pa.int64()),
+        'date': pa.array(dates, type=pa.timestamp('ms')),
+        'title': _text_array(chunk['title']),
+        'author': _text_array(chunk['author']),
+        'permalink': _text_array(chunk['permalink']),
+        'selftext': _text_array(chunk['selftext']),
+        'sentiment': sentiment.dictionary_encode().cast(SCHEMA.field('sentiment').type),
+        'ai_reason': _text_array(chunk['ai_reason']),
+        'tickers': pa.array([parse_tickers(value) for value in chunk['tickers']], type=pa.list_(pa.string())),
+        'year': pa.array(dates.dt.year, type=pa.int16()),
+        'month': pa.array(dates.dt.month, type=pa.int8()),
+    }
+    return pa.table(columns, schema=SCHEMA)
+
+
+def append_chunk(chunk, first_row_id, root=PARQUET_PATH):
+    """Write one chunk. File names come from first_row_id, so redoing a chunk after a crash overwrites it instead of duplicating it."""
+    if len(chunk) == 0:
+        return
+    pq.write_to_dataset(chunk_to_table(chunk, first_row_id), root, partition_cols=PARTITION_COLUMNS,
+                        basename_template=f"part-{first_row_id:010d}-{{i}}.parquet",
+                        existing_data_behavior='overwrite_or_ignore')
+
+
+def delete_from(root, first_row_id):
+    """Remove the files written for rows first_row_id and up (chunks are never split across that line). Returns how many."""
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    for folder, _, files in os.walk(root):
+        for name in files:
+            # part-<first row id>-<i>.parquet, see append_chunk
+            if name.startswith('part-') and int(name.split('-')[1]) >= first_row_id:
+                os.remove(os.path.join(folder, name))
+                removed += 1
+    return removed
+
+
+def convert_csv(csv_path=CSV_PATH, root=PARQUET_PATH, chunk_size=100_000):
+    row_id = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        append_chunk(chunk, row_id, root)
+        row_id += len(chunk)
+        print(f"Converted {row_id:,} rows to '{root}'")
+    return row_id
+
+
+def dataset(root=PARQUET_PATH):
+    return ds.dataset(root, format='parquet', partitioning='hive', schema=SCHEMA)
+
+
+def date_filter(start=None, end=None):
+    # the year/month terms let pyarrow skip whole partitions, the date terms trim inside them
+    expression = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        term = ((ds.field('year') > start.year) | ((ds.field('year') == start.year) & (ds.field('month') >= start.month))) \
+            & (ds.field('date') >= pa.scalar(start.to_pydatetime(), type=pa.timestamp('ms')))
+        expression = term
+    if end is not None:
+        end = pd.Timestamp(end)
+        term = ((ds.field('year') < end.year) | ((ds.field('year') == end.year) & (ds.field('month') <= end.month))) \
+            & (ds.field('date') <= pa.scalar(end.to_pydatetime(), type=pa.timestamp('ms')))
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def read_processed(root=PARQUET_PATH, columns=None, start=None, end=None, row_ids=None):
+    """Load only `columns` (all when None) for rows dated between start and end, optionally just the given row_ids."""
+    expression = date_filter(start, end)
+    if row_ids is not None:
+        term = ds.field('row_id').isin(pa.array(row_ids, type=pa.int64()))
+        expression = term if expression is None else expression & term
+    table = dataset(root).to_table(columns=columns, filter=expression)
+    if 'row_id' in table.column_names:
+        table = table.sort_by('row_id') # partitions come back in directory order, keep the CSV's row order
+    return table.to_pandas()
+
+
+def load_processed(path, columns=None, start=None, end=None):
+    """Read the processed data from the Parquet store if `path` is one, otherwise from the CSV."""
+    if os.path.isdir(path):
+        return read_processed(path, columns, start, end)
+    df = pd.read_csv(path, usecols=columns)
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'])
+        if start is not None:
+            df = df[df['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['date'] <= pd.Timestamp(end)]
+    return df
+
+
+def iter_processed(path, columns=None, start=None, end=None, chunk_size=200_000):
+    """load_processed() in DataFrames of at most chunk_size rows, so memory stays flat however big the data is."""
+    if os.path.isdir(path):
+        # batches come per row group, a month partition gives a small one, so they're gathered up to chunk_size
+        batches, rows = [], 0
+        for batch in dataset(path).to_batches(columns=columns, filter=date_filter(start, end), batch_size=chunk_size):
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunk_size:
+                yield pa.Table.from_batches(batches).to_pandas()
+                batches, rows = [], 0
+        if rows:
+            yield pa.Table.from_batches(batches).to_pandas()
+        return
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size):
+        if 'date' in chunk.columns:
+            chunk['date'] = pd.to_datetime(chunk['date'])
+            if start is not None:
+                chunk = chunk[chunk['date'] >= pd.Timestamp(start)]
+            if end is not None:
+                chunk = chunk[chunk['date'] <= pd.Timestamp(end)]
+        if len(chunk):
+            yield chunk
+
+
+def update_labels(root, labels):
+    """Fill sentiment/ai_reason for {row_id: (sentiment, reason)} in place, rewriting only the files that hold those rows."""
+    if not labels or not os.path.isdir(root):
+        return 0
+    wanted = np.array(sorted(labels), dtype=np.int64)
+    updated = 0
+    for fragment in dataset(root).get_fragments():
+        row_ids = pq.read_table(fragment.path, columns=['row_id'])['row_id'].to_numpy()
+        if not np.isin(row_ids, wanted).any():
+            continue
+        table = pq.read_table(fragment.path)
+        frame = table.to_pandas()
+        hits = frame['row_id'].isin(wanted)
+        sentiments = frame['sentiment'].astype(object)
+        reasons = frame['ai_reason'].astype(object)
+        sentiments[hits] = [labels[row_id][0] for row_id in frame.loc[hits, 'row_id']]
+        reasons[hits] = [labels[row_id][1] for row_id in frame.loc[hits, 'row_id']]
+        sentiment_array = pa.array(sentiments.where(sentiments.notna(), None).tolist(), type=pa.string())
+        table = table.set_column(table.schema.get_field_index('sentiment'), 'sentiment',
+                                 sentiment_array.dictionary_encode().cast(SCHEMA.field('sentiment').type))
+        table = table.set_column(table.schema.get_field_index('ai_reason'), 'ai_reason',
+                                 pa.array(reasons.where(reasons.notna(), None).tolist(), type=pa.string()))
+        # dot-prefixed so a leftover temp file is never picked up as part of the dataset
+        temp_path = os.path.join(os.path.dirname(fragment.path), f".{os.path.basename(fragment.path)}.tmp")
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, fragment.path)
+        updated += int(hits.sum())
+    return updated
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    root = sys.argv[2] if len(sys.argv) > 2 else PARQUET_PATH
+    if not os.path.exists(csv_path):
+        print(f"Error: The file '{csv_path}' was not found.")
+        exit(1)
+    print(f"Done: {convert_csv(csv_path, root):,} rows written to '{root}'")
@@ -0,0 +1,109 @@
+# Sorts ticker rows before they're labeled, so posts with nothing to label and texts already labeled don't cost a call.
+#  - dead rows: selftext "[removed]"/"[deleted]", titles "[deleted by user]", and link posts, where dig_through.py
+#    writes the url as the selftext. Skipped (sentiment left empty, reason "skipped: ...") or labeled from the title
+#    alone with the local lexicon scorer (sentiment_backends.py)
+#  - repeats: a text that shows up again in the same batch, or was labeled before (looked up in the sentiment cache
+#    under its sentiment_cache.normalized_key, case and urls ignored), gets the same label
+# Everything else is handed to the labeling function as before. stats counts every case and the calls avoided.
+import re
+import time
+from sentiment_backends import make_backend
+from sentiment_cache import SentimentCache
+
+DEAD_ROW_ACTION = 'title' # 'title' labels dead rows from their title locally, 'skip' leaves them unlabeled
+SKIPPED_PREFIX = "skipped: " # ai_reason of skipped rows, so openai_batch.py doesn't queue them again
+REMOVED_TEXTS = {'[removed]': 'removed', '[deleted]': 'deleted'}
+DELETED_TITLES = {'[deleted by user]'}
+LINK_ONLY = re.compile(r'https?://\S+')
+
+
+def dead_kind(title, selftext):
+    """'removed', 'deleted' or 'link' when the post body has nothing to label, None otherwise. Expects lowercased text."""
+    title = title.strip()
+    body = selftext.strip()
+    if title in DELETED_TITLES:
+        return 'deleted'
+    if body in REMOVED_TEXTS:
+        return REMOVED_TEXTS[body]
+    if body and LINK_ONLY.fullmatch(body):
+        return 'link'
+    return None
+
+
+def label_namespace(sentiment_backend, local_backend, threshold, model, prompt_version):
+    # everything that decides what label a text gets, pipeline.py and sentimize_data.py build it the same way
+    return f"{sentiment_backend}/{local_backend}/{threshold}/{model}/{prompt_version}"
+
+
+class RowTriage:
+    """Dead-row and repeat handling in front of a labeling function. namespace should name whatever produces the
+    labels (backend, model, prompt), so a repeat never picks up a label from a different setup. Labels are kept in
+    cache (a SentimentCache, opened in the thread that calls label()); without one repeats are only found within the
+    run, with dedup=False not at all."""
+
+    def __init__(self, dead_row_action=DEAD_ROW_ACTION, cache=None, namespace='', dedup=True, title_backend='lexicon'):
+        if dead_row_action not in ('title', 'skip', None):
+            raise ValueError(f"dead_row_action has to be 'title', 'skip' or None, not '{dead_row_action}'")
+        self.dead_row_action = dead_row_action
+        self.namespace = namespace
+        self.dedup = dedup
+        self.title_backend = make_backend(title_backend) if dead_row_action == 'title' else None
+        self.owns_cache = dedup and cache is None
+        self.cache = SentimentCache(':memory:', None) if self.owns_cache else cache
+        self.stats = {'rows': 0, 'removed': 0, 'deleted': 0, 'link': 0, 'repeats': 0, 'cached': 0,
+                      'labeled': 0, 'calls_avoided': 0, 'seconds': 0.0}
+
+    def label(self, rows, label_texts):
+        """rows are (title, selftext, combined text) lowercased, as extraction() builds them. label_texts(texts) returns
+        a (sentiment, reason) per text. Returns a (sentiment, reason) per row, in order."""
+        started = time.perf_counter()
+        results = [None] * len(rows)
+        dead_titles = [] # (position, kind, title) labeled locally
+        first_of = {} # key -> position of its first row in this batch
+        repeats = [] # (position, first position)
+        for position, (title, selftext, text) in enumerate(rows):
+            kind = self.dead_row_action and dead_kind(title, selftext)
+            if kind:
+                self.stats[kind] += 1
+                if self.dead_row_action == 'title' and title.strip() and title.strip() not in DELETED_TITLES:
+                    dead_titles.append((position, kind, title))
+                else:
+                    results[position] = (None, f"{SKIPPED_PREFIX}{kind} post")
+                continue
+            key = self.cache.normalized_key(text, self.namespace) if self.dedup else position
+            if key in first_of:
+                repeats.append((position, first_of[key]))
+            else:
+                first_of[key] = position
+        if dead_titles:
+            for (position, kind, _), (sentiment, reason, _) in zip(dead_titles, self.title_backend.label_texts([title for _, _, title in dead_titles])):
+                results[position] = (sentiment, f"{kind} post, title only: {reason}")
+
+        cached = self.cache.get_many(list(first_of), count=False) if self.dedup else {}
+        pending = [] # (key, position) actually sent to label_texts
+        for key, position in first_of.items():
+            if key in cached:
+                results[position] = cached[key]
+                self.stats['cached'] += 1
+            else:
+                pending.append((key, position))
+        self.stats['seconds'] += time.perf_counter() - started
+        if pending:
+            for (_, position), result in zip(pending, label_texts([rows[position][2] for _, position in pending])):
+                results[position] = result
+        started = time.perf_counter()
+        if self.dedup and pending:
+            self.cache.put_many([(key, *results[position]) for key, position in pending]) # only valid labels are kept
+        for position, first in repeats:
+            results[position] = results[first]
+        self.stats['repeats'] += len(repeats)
+        self.stats['rows'] += len(rows)
+        self.stats['labeled'] += len(pending)
+        self.stats['calls_avoided'] += len(rows) - len(pending)
+        self.stats['seconds'] += time.perf_counter() - started
+        return results
+
+    def close(self):
+        # a cache that was passed in belongs to the caller
+        if self.owns_cache:
+            self.cache.close()
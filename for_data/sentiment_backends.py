@@ -0,0 +1,273 @@
+# Local sentiment backends, so not every ticker row has to be a gpt-4o-mini call. A backend labels a list of texts on
+# the CPU and says how sure it is about each label; LocalFirstClient keeps the labels it's sure about and only sends
+# the rest to the API client. It has the same analyze_texts() as AsyncSentimentClient, so pipeline.py and
+# sentimize_data.py take either one.
+#   python sentiment_backends.py [wsb_sub_processed.csv] [rows]
+# scores rows the API already labeled with the local backend and prints, per confidence threshold, how many API calls
+# it would save and how often it agrees with the API. Pick LOCAL_CONFIDENCE_THRESHOLD from that.
+import math
+import re
+import sys
+import time
+from array import array
+import pandas as pd
+from sentiment_client import truncate_text
+try:
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+except ImportError:
+    SentimentIntensityAnalyzer = None
+
+# compound score cut-offs for Positive/Negative, VADER's defaults
+POSITIVE_THRESHOLD = 0.05
+NEGATIVE_THRESHOLD = -0.05
+DEFAULT_CONFIDENCE_THRESHOLD = 0.6
+file_path = 'wsb_sub_processed.csv'
+rows = 20_000
+
+# valences on VADER's -4..4 scale. General words are close to VADER's own values, the rest is how WSB talks:
+# calls and rockets are bullish, puts, bags and drilling are not
+LEXICON = {
+    # general
+    'good': 1.9, 'great': 3.1, 'love': 3.2, 'amazing': 2.8, 'awesome': 3.1, 'best': 3.2, 'happy': 2.7, 'nice': 1.8,
+    'excited': 2.2, 'win': 2.8, 'winning': 2.4, 'won': 2.7, 'strong': 2.3, 'safe': 1.9, 'easy': 1.9, 'lucky': 1.8,
+    'bad': -2.5, 'terrible': -2.5, 'worst': -3.1, 'hate': -2.7, 'fear': -2.2, 'scared': -2.2, 'panic': -2.5,
+    'worried': -2.0, 'sad': -2.1, 'lose': -2.4, 'losing': -2.4, 'lost': -2.1, 'weak': -1.9, 'risk': -1.1,
+    'risky': -1.5, 'pain': -2.3, 'painful': -2.4, 'dead': -3.3, 'ugly': -2.3, 'stupid': -2.4, 'scam': -3.1,
+    'fraud': -3.0, 'regret': -2.0, 'disaster': -3.1, 'help': 0.5, 'problem': -1.7, 'wrong': -2.1,
+    # market
+    'bull': 1.5, 'bulls': 1.5, 'bullish': 2.5, 'bear': -1.5, 'bears': -1.5, 'bearish': -2.5, 'rally': 2.0,
+    'surge': 2.2, 'soar': 2.5, 'soaring': 2.8, 'skyrocket': 3.0, 'breakout': 1.8, 'rebound': 1.5, 'recovery': 1.5,
+    'gain': 2.0, 'gains': 2.0, 'profit': 2.0, 'profits': 2.0, 'beat': 1.2, 'upgrade': 2.0, 'undervalued': 2.0,
+    'crash': -2.6, 'crashing': -2.8, 'plunge': -2.8, 'tank': -2.0, 'tanking': -2.5, 'tanked': -2.5, 'dip': -0.8,
+    'drop': -1.5, 'dropping': -1.8, 'selloff': -2.2, 'loss': -2.0, 'losses': -2.2, 'miss': -1.3, 'downgrade': -2.0,
+    'overvalued': -2.0, 'bubble': -1.8, 'recession': -2.5, 'bankrupt': -3.0, 'bankruptcy': -3.0, 'collapse': -3.0,
+    'dilution': -2.0, 'default': -2.0, 'lawsuit': -1.8, 'green': 1.5, 'red': -1.5,
+    # wsb
+    'moon': 2.5, 'mooning': 3.0, 'rocket': 2.2, 'rockets': 2.2, 'tendies': 2.5, 'calls': 1.2, 'squeeze': 1.8,
+    'printing': 2.0, 'lambo': 2.0, 'hodl': 1.2, 'stonks': 1.0, 'bagholder': -2.2, 'bagholders': -2.2, 'bags': -1.5,
+    'puts': -1.2, 'drill': -2.0, 'drilling': -2.4, 'rip': -2.0, 'guh': -2.5, 'wrecked': -2.6, 'rekt': -2.6,
+    'fucked': -2.5, 'fd': -0.5, 'fds': -0.5, 'wendys': -1.2, 'ruined': -2.6, 'broke': -1.8, 'margin': -0.3,
+    # emoji
+    '🚀': 2.5, '🌙': 2.0, '💎': 1.8, '🙌': 1.2, '📈': 2.0, '🤑': 2.2, '💰': 1.8, '🔥': 1.5, '🦍': 0.8,
+    '📉': -2.0, '🐻': -1.5, '🌈': -1.0, '💀': -1.5, '😭': -2.0, '🤡': -1.5, '🩸': -2.0,
+}
+# two word phrases, scored instead of their words
+PHRASES = {
+    ('diamond', 'hands'): 2.0, ('paper', 'hands'): -1.5, ('free', 'money'): 2.5, ('short', 'squeeze'): 2.0,
+    ('all', 'in'): 1.0, ('to', 'moon'): 3.0, ('buy', 'dip'): 1.5, ('bag', 'holder'): -2.2, ('bag', 'holding'): -2.2,
+    ('rug', 'pull'): -3.0, ('margin', 'call'): -3.0, ('going', 'down'): -2.0, ('going', 'up'): 2.0,
+    ('all', 'time'): 1.0, ('dead', 'cat'): -2.0, ('load', 'up'): 1.5, ('loading', 'up'): 1.5,
+}
+NEGATIONS = {'not', 'no', 'never', 'none', 'nobody', 'nothing', 'neither', 'nor', 'without', 'cant', "can't", 'dont',
+             "don't", 'doesnt', "doesn't", 'didnt', "didn't", 'isnt', "isn't", 'wont', "won't", 'wasnt', "wasn't",
+             'aint', "ain't", 'shouldnt', "shouldn't", 'wouldnt', "wouldn't", 'havent', "haven't"}
+BOOSTERS = {'very': 0.293, 'really': 0.293, 'extremely': 0.293, 'so': 0.293, 'super': 0.293, 'hugely': 0.293,
+            'fucking': 0.293, 'absolutely': 0.293, 'totally': 0.293, 'insanely': 0.293, 'mega': 0.293,
+            'slightly': -0.293, 'somewhat': -0.293, 'kinda': -0.293, 'barely': -0.293, 'little': -0.293}
+NEGATION_SCALAR = -0.74 # VADER's constants from here down
+EXCLAMATION_BOOST = 0.292
+MAX_EXCLAMATIONS = 4
+NORMALIZE_ALPHA = 15
+# a negation or booster doesn't reach past these: in "not bad but great" the "not" is only about "bad"
+CLAUSE_BREAKS = {'but', '.', ',', ';', '!', '?'}
+# words and apostrophes, the punctuation in CLAUSE_BREAKS as tokens of its own, plus any single emoji
+TOKEN = re.compile(r"[a-z0-9']+|[.,;!?]|[\U0001F300-\U0001FAFF☀-➿]")
+
+
+def compound_score(valences, exclamations=0):
+    total = sum(valences)
+    if total:
+        total += math.copysign(min(exclamations, MAX_EXCLAMATIONS) * EXCLAMATION_BOOST, total)
+    return total / math.sqrt(total * total + NORMALIZE_ALPHA)
+
+
+def label_compound(compound):
+    if compound >= POSITIVE_THRESHOLD:
+        return 'Positive'
+    if compound <= NEGATIVE_THRESHOLD:
+        return 'Negative'
+    return 'Neutral'
+
+
+class LexiconBackend:
+    """VADER-style rule scorer with a WSB lexicon: negation, boosters, "but" shifts and '!' emphasis, no model file.
+    Confidence is the size of the compound score, so a post with no sentiment words at all is never confident."""
+
+    name = 'lexicon'
+
+    def __init__(self, lexicon=None, phrases=None):
+        self.lexicon = LEXICON if lexicon is None else lexicon
+        self.phrases = PHRASES if phrases is None else phrases
+
+    def score(self, text):
+        """(compound, words that counted) for one text."""
+        text = truncate_text(text).lower()
+        tokens = TOKEN.findall(text)
+        valences = []
+        found = []
+        after_but = False
+        skip_until = -1 # last token of a phrase that was already scored
+        for position, token in enumerate(tokens):
+            if position <= skip_until:
+                continue
+            if token == 'but':
+                # what comes before "but" counts half, what comes after 1.5 times
+                valences = [valence * 0.5 for valence in valences]
+                after_but = True
+                continue
+            valence = None
+            if position + 1 < len(tokens):
+                phrase_end = position + 1
+                valence = self.phrases.get((token, tokens[phrase_end]))
+                if valence is None and tokens[phrase_end] in ('the', 'a') and phrase_end + 1 < len(tokens):
+                    phrase_end += 1 # "to the moon", "buy the dip"
+                    valence = self.phrases.get((token, tokens[phrase_end]))
+                if valence is not None:
+                    skip_until = phrase_end
+                    token = f"{token} {tokens[phrase_end]}"
+            if valence is None:
+                valence = self.lexicon.get(token)
+            if valence is None:
+                continue
+            for back in (1, 2, 3):
+                if position - back < 0:
+                    break
+                previous = tokens[position - back]
+                if previous in CLAUSE_BREAKS:
+                    break
+                boost = BOOSTERS.get(previous)
+                if boost is not None:
+                    # VADER damps boosters that are further away
+                    valence += math.copysign(boost, valence) * (1.0, 0.95, 0.9)[back - 1]
+                if previous in NEGATIONS:
+                    valence *= NEGATION_SCALAR
+                    token = f"not {token}"
+                    break
+            if after_but:
+                valence *= 1.5
+            valences.append(valence)
+            found.append(token)
+        return compound_score(valences, text.count('!')), found
+
+    def label_texts(self, texts):
+        """(sentiment, reason, confidence) per text."""
+        results = []
+        for text in texts:
+            compound, found = self.score(text)
+            words = ", ".join(found[:6]) if found else "no sentiment words"
+            results.append((label_compound(compound), f"{self.name} {compound:+.2f}: {words}", abs(compound)))
+        return results
+
+
+class VaderBackend(LexiconBackend):
+    """The vaderSentiment package's scorer with the WSB words added to its lexicon (pip install vaderSentiment)."""
+
+    name = 'vader'
+
+    def __init__(self, lexicon=None, phrases=None):
+        if SentimentIntensityAnalyzer is None:
+            raise ImportError("the 'vader' backend needs the vaderSentiment package")
+        super().__init__(lexicon, phrases)
+        self.analyzer = SentimentIntensityAnalyzer()
+        self.analyzer.lexicon.update({word: valence for word, valence in self.lexicon.items() if word.isalpha()})
+
+    def score(self, text):
+        text = truncate_text(text)
+        found = [word for word in TOKEN.findall(text.lower()) if word in self.analyzer.lexicon]
+        return self.analyzer.polarity_scores(text)['compound'], found
+
+
+BACKENDS = {'lexicon': LexiconBackend, 'vader': VaderBackend}
+
+
+def make_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f"unknown sentiment backend '{name}', pick one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+class LocalFirstClient:
+    """Labels with a local backend and sends only the texts it's less than confidence_threshold sure about to
+    api_client. Without an api_client every text keeps its local label. Local reasons start with the backend's name."""
+
+    def __init__(self, backend, api_client=None, confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+        self.backend = backend
+        self.api_client = api_client
+        self.confidence_threshold = confidence_threshold
+        self.stats = {'backend': backend.name, 'threshold': confidence_threshold, 'local': 0, 'sent_to_api': 0,
+                      'local_seconds': 0.0}
+        # so metrics.share_samples('api_latency', ...) works the same with either client
+        self.latencies = api_client.latencies if api_client is not None else array('d')
+
+    def analyze_texts(self, texts):
+        texts = list(texts)
+        started = time.perf_counter()
+        scored = self.backend.label_texts(texts)
+        self.stats['local_seconds'] += time.perf_counter() - started
+        results = []
+        uncertain = []
+        for position, (sentiment, reason, confidence) in enumerate(scored):
+            if self.api_client is None or confidence >= self.confidence_threshold:
+                results.append((sentiment, reason))
+            else:
+                results.append(None)
+                uncertain.append(position)
+        self.stats['local'] += len(texts) - len(uncertain)
+        if uncertain:
+            self.stats['sent_to_api'] += len(uncertain)
+            for position, result in zip(uncertain, self.api_client.analyze_texts([texts[position] for position in uncertain])):
+                results[position] = result
+        return results
+
+    def report(self):
+        done = self.stats['local'] + self.stats['sent_to_api']
+        local_seconds = self.stats['local_seconds']
+        return {**self.stats, 'local_seconds': round(local_seconds, 3),
+                'local_share': round(self.stats['local'] / done, 4) if done else 0.0,
+                'local_rows_per_second': round(done / local_seconds, 1) if local_seconds else None}
+
+
+def api_labeled_sample(file_path, rows):
+    # ticker rows the API labeled, with the same combined text extraction() sends
+    samples = []
+    for chunk in pd.read_csv(file_path, chunksize=50_000, usecols=['title', 'selftext', 'sentiment', 'ai_reason', 'tickers']):
+        labeled = chunk['sentiment'].isin(['Positive', 'Negative', 'Neutral']) & (chunk['tickers'] != '[]')
+        labeled &= ~chunk['ai_reason'].fillna('').str.startswith(tuple(f"{name} " for name in BACKENDS))
+        chunk = chunk[labeled]
+        texts = (chunk['title'].fillna('').astype(str).str.lower() + " " + chunk['selftext'].fillna('').astype(str).str.lower())
+        samples.append(pd.DataFrame({'text': texts.tolist(), 'api': chunk['sentiment'].tolist()}))
+        if sum(len(sample) for sample in samples) >= rows:
+            break
+    return pd.concat(samples, ignore_index=True).iloc[:rows] if samples else pd.DataFrame(columns=['text', 'api'])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        file_path = sys.argv[1]
+    if len(sys.argv) > 2:
+        rows = int(sys.argv[2])
+    try:
+        sample = api_labeled_sample(file_path, rows)
+    except FileNotFoundError:
+        print(f"Error: The file '{file_path}' was not found.")
+        exit(1)
+    if sample.empty:
+        print(f"Error: '{file_path}' has no API-labeled ticker rows to compare against.")
+        exit(1)
+    backend = LexiconBackend()
+    start = time.perf_counter()
+    scored = backend.label_texts(sample['text'])
+    seconds = time.perf_counter() - start
+    sample['local'] = [sentiment for sentiment, _, _ in scored]
+    sample['confidence'] = [confidence for _, _, confidence in scored]
+    agree = sample['local'] == sample['api']
+    print(f"{len(sample):,} API-labeled rows from '{file_path}', {backend.name} backend at {len(sample) / seconds:,.0f} rows/s, "
+          f"{agree.mean():.1%} agreement overall")
+    print("threshold  local share  agreement on local rows  hybrid agreement")
+    for threshold in (0.0, 0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9):
+        local = sample['confidence'] >= threshold
+        share = local.mean()
+        local_agreement = agree[local].mean() if local.any() else float('nan')
+        # the API answers the rest, so those agree by definition
+        hybrid = (agree & local).sum() / len(sample) + (1 - share)
+        print(f"{threshold:9.1f}  {share:11.1%}  {local_agreement:23.1%}  {hybrid:16.1%}")
@@ -0,0 +1,184 @@
+# Persistent sentiment cache, so reruns and reposts don't pay for the same API call twice.
+# Entries are keyed on a hash of (model, prompt version, normalized truncated text). row_triage.py looks up reposts
+# under a looser normalized_key (case and urls ignored too) in the same table.
+#   python sentiment_cache.py stats|export|import [cache.sqlite] [file.jsonl]
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from sentiment_client import OPENAI_MODEL_NAME, PROMPT_VERSION, truncate_text
+
+CACHE_PATH = 'sentiment_cache.sqlite'
+VALID_SENTIMENTS = ('Positive', 'Negative', 'Neutral')
+URL = re.compile(r'https?://\S+|www\.\S+')
+
+
+def normalize_text(text):
+    # same truncation as the request, then whitespace collapsed so reposts that only differ in spacing share an entry
+    return re.sub(r'\s+', ' ', truncate_text(text)).strip()
+
+
+def normalize_repost(text):
+    # for spotting reposts: case, urls and whitespace don't count. Everything else does, emoji included, so
+    # "tsla 🚀🚀" and "tsla 📉📉" stay different texts
+    return re.sub(r'\s+', ' ', URL.sub(' ', truncate_text(text).lower())).strip()
+
+
+def normalized_key(text, namespace='', model=OPENAI_MODEL_NAME, prompt_version=PROMPT_VERSION):
+    # namespace names whatever else decides the label (backend, threshold), see row_triage.label_namespace
+    digest = hashlib.sha256()
+    digest.update(f"repost\0{model}\0{prompt_version}\0{namespace}\0".encode('utf-8'))
+    digest.update(normalize_repost(text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_key(text, model=OPENAI_MODEL_NAME, prompt_version=PROMPT_VERSION):
+    digest = hashlib.sha256()
+    digest.update(f"{model}\0{prompt_version}\0".encode('utf-8'))
+    digest.update(normalize_text(text).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SentimentCache:
+    """SQLite-backed (sentiment, ai_reason) cache with LRU eviction once it holds more than max_entries."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=5_000_000, model=OPENAI_MODEL_NAME, prompt_version=PROMPT_VERSION):
+        self.path = path
+        self.max_entries = max_entries
+        self.model = model
+        self.prompt_version = prompt_version
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS sentiment_cache (
+            key TEXT PRIMARY KEY,
+            sentiment TEXT NOT NULL,
+            ai_reason TEXT,
+            model TEXT,
+            prompt_version TEXT,
+            last_used REAL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS sentiment_cache_last_used ON sentiment_cache(last_used)")
+        self.connection.commit()
+
+    def key(self, text):
+        return cache_key(text, self.model, self.prompt_version)
+
+    def normalized_key(self, text, namespace=''):
+        return normalized_key(text, namespace, self.model, self.prompt_version)
+
+    def get_many(self, keys, count=True):
+        """Return {key: (sentiment, ai_reason)} for the keys that are cached, counting hits and misses unless count is
+        False (row_triage's repost lookups have their own stats)."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), 500): # stay under SQLite's bound parameter limit
+            batch = unique_keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.connection.execute(
+                f"SELECT key, sentiment, ai_reason FROM sentiment_cache WHERE key IN ({placeholders})", batch)
+            for key, sentiment, reason in rows:
+                found[key] = (sentiment, reason)
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE sentiment_cache SET last_used = ? WHERE key = ?",
+                                        [(now, key) for key in found])
+            self.connection.commit()
+        if not count:
+            return found
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def get(self, text):
+        key = self.key(text)
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """Store [(key, sentiment, ai_reason), ...]. Errors and parse failures are never cached."""
+        now = time.time()
+        rows = [(key, sentiment, reason, self.model, self.prompt_version, now)
+                for key, sentiment, reason in items if sentiment in VALID_SENTIMENTS]
+        if not rows:
+            return
+        self.connection.executemany("INSERT OR REPLACE INTO sentiment_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+        self.evict()
+
+    def put(self, text, sentiment, reason):
+        self.put_many([(self.key(text), sentiment, reason)])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()[0]
+
+    def evict(self):
+        if self.max_entries is None:
+            return 0
+        extra = len(self) - self.max_entries
+        if extra <= 0:
+            return 0
+        self.connection.execute("""DELETE FROM sentiment_cache WHERE key IN (
+            SELECT key FROM sentiment_cache ORDER BY last_used LIMIT ?)""", (extra,))
+        self.connection.commit()
+        return extra
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def export_jsonl(self, file_path):
+        count = 0
+        with open(file_path, 'w', encoding='utf-8') as handle:
+            for key, sentiment, reason, model, prompt_version, last_used in self.connection.execute(
+                    "SELECT key, sentiment, ai_reason, model, prompt_version, last_used FROM sentiment_cache"):
+                handle.write(json.dumps({'key': key, 'sentiment': sentiment, 'ai_reason': reason, 'model': model,
+                                         'prompt_version': prompt_version, 'last_used': last_used}))
+                handle.write("\n")
+                count += 1
+        return count
+
+    def import_jsonl(self, file_path):
+        # existing entries win, so importing someone else's export never overwrites local labels
+        rows = []
+        with open(file_path, 'r', encoding='utf-8') as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('sentiment') not in VALID_SENTIMENTS:
+                    continue
+                rows.append((entry['key'], entry['sentiment'], entry.get('ai_reason'), entry.get('model'),
+                             entry.get('prompt_version'), entry.get('last_used', time.time())))
+        self.connection.executemany("INSERT OR IGNORE INTO sentiment_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+        self.evict()
+        return len(rows)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ('stats', 'export', 'import'):
+        print("Usage: python sentiment_cache.py stats|export|import [cache.sqlite] [file.jsonl]")
+        exit(1)
+    command = sys.argv[1]
+    path = sys.argv[2] if len(sys.argv) > 2 else CACHE_PATH
+    if command != 'import' and not os.path.exists(path):
+        print(f"Error: The cache '{path}' was not found.")
+        exit(1)
+    cache = SentimentCache(path, max_entries=None)
+    if command == 'stats':
+        print(cache.stats())
+    elif command == 'export':
+        jsonl_path = sys.argv[3] if len(sys.argv) > 3 else 'sentiment_cache.jsonl'
+        print(f"Exported {cache.export_jsonl(jsonl_path):,} entries to '{jsonl_path}'")
+    else:
+        jsonl_path = sys.argv[3] if len(sys.argv) > 3 else 'sentiment_cache.jsonl'
+        print(f"Imported {cache.import_jsonl(jsonl_path):,} entries from '{jsonl_path}'")
+    cache.close()
@@ -0,0 +1,345 @@
+# Async OpenAI sentiment client: bounded concurrency, token buckets for requests/tokens per minute,
+# and jittered backoff on 429s. Point OPENAI_BASE_URL (or base_url) at mock_openai_server.py to try it offline.
+import asyncio
+import json
+import random
+import time
+from array import array
+import openai
+from metrics import percentiles
+
+OPENAI_MODEL_NAME = "gpt-4o-mini"
+# bump whenever SYSTEM_PROMPT or the request shape changes, so cached labels from the old prompt aren't reused
+PROMPT_VERSION = "v1"
+# Reddit has a 40_000 character limit for body section!
+MAX_CHARS = 1500
+SYSTEM_PROMPT = ("You are an AI expert in financial and meme sentiment analysis. Analyze the sentiment of the provided Reddit post text. "
+                 "Respond with a JSON object containing two keys: "
+                 "'sentiment' (string: 'Positive', 'Negative', or 'Neutral') and "
+                 "'ai_reason' (string: a brief, one-sentence explanation for the sentiment).")
+MAX_RESPONSE_TOKENS = 150
+
+# Packed mode: several posts per request, so the system prompt is paid once per request instead of once per post
+PACKED_PROMPT_VERSION = "packed-v1"
+PACKED_SYSTEM_PROMPT = ("You are an AI expert in financial and meme sentiment analysis. You will receive a JSON array of Reddit posts, "
+                        "each with an 'id' and a 'text'. Analyze the sentiment of every post independently. "
+                        "Respond with a JSON object with one key, 'results': an array with exactly one entry per post, each containing "
+                        "'id' (the post's id, unchanged), 'sentiment' (string: 'Positive', 'Negative', or 'Neutral') and "
+                        "'ai_reason' (string: a brief, one-sentence explanation for the sentiment).")
+MAX_POSTS_PER_REQUEST = 20
+RESPONSE_TOKENS_PER_POST = 60
+PACKED_TOKENS_PER_POST = 12 # id and JSON punctuation around each post
+# gpt-4o-mini list prices, USD per million tokens, for the cost reports
+INPUT_PRICE_PER_MILLION = 0.15
+OUTPUT_PRICE_PER_MILLION = 0.60
+
+
+def truncate_text(text):
+    processed_text = str(text)
+    if len(processed_text) > MAX_CHARS:
+        processed_text = processed_text[:MAX_CHARS]  # Truncate to max_chars
+    return processed_text
+
+
+def build_messages(processed_text):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Analyze the following text: \"{processed_text}\""}
+    ]
+
+
+def estimate_tokens(processed_text):
+    # ~4 characters per token is close enough for budgeting, the real usage is settled after each response
+    return (len(SYSTEM_PROMPT) + len(processed_text)) // 4 + MAX_RESPONSE_TOKENS
+
+
+def build_packed_messages(processed_texts):
+    posts = [{"id": f"p{position}", "text": text} for position, text in enumerate(processed_texts)]
+    return [
+        {"role": "system", "content": PACKED_SYSTEM_PROMPT},
+        {"role": "user", "content": json.dumps(posts, ensure_ascii=False)}
+    ]
+
+
+def estimate_packed_tokens(processed_texts):
+    return (len(PACKED_SYSTEM_PROMPT) // 4 + packed_max_tokens(len(processed_texts))
+            + sum(len(text) // 4 + PACKED_TOKENS_PER_POST for text in processed_texts))
+
+
+def packed_max_tokens(post_count):
+    return RESPONSE_TOKENS_PER_POST * post_count + 50
+
+
+def pack_texts(texts, token_budget, max_posts=MAX_POSTS_PER_REQUEST):
+    """Group text positions so each request stays under token_budget prompt tokens (short posts pack more per request)."""
+    groups = []
+    group = []
+    group_tokens = len(PACKED_SYSTEM_PROMPT) // 4
+    for position, text in enumerate(texts):
+        tokens = len(truncate_text(text)) // 4 + PACKED_TOKENS_PER_POST
+        if group and (group_tokens + tokens > token_budget or len(group) >= max_posts):
+            groups.append(group)
+            group = []
+            group_tokens = len(PACKED_SYSTEM_PROMPT) // 4
+        group.append(position)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def parse_packed_response(api_response_content, post_count):
+    """Return {position: (sentiment, reason)} for the well-formed entries only; the caller falls back for the rest."""
+    try:
+        entries = json.loads(api_response_content).get('results', [])
+    except (json.JSONDecodeError, AttributeError):
+        return {}
+    results = {}
+    if not isinstance(entries, list):
+        return results
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        post_id = str(entry.get('id', ''))
+        if not post_id.startswith('p') or not post_id[1:].isdigit():
+            continue
+        position = int(post_id[1:])
+        sentiment = entry.get('sentiment')
+        if position >= post_count or position in results or sentiment not in ('Positive', 'Negative', 'Neutral'):
+            continue
+        results[position] = (sentiment, entry.get('ai_reason', 'Parse Error'))
+    return results
+
+
+def parse_sentiment_response(api_response_content):
+    if not api_response_content:
+        return "API Error", "Empty API response content"
+    result = json.loads(api_response_content)
+    if not isinstance(result, dict): # valid JSON but not an object, e.g. a bare list or string
+        return "Parse Error", "Parse Error"
+    return result.get('sentiment', 'Parse Error'), result.get('ai_reason', 'Parse Error')
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute, with bursts up to `capacity`."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        # takes the units now (possibly going negative) and returns how long the caller must wait for them.
+        # Reserving up front means concurrent callers queue up fairly without needing a lock
+        self._refill()
+        self.available -= amount
+        if self.available >= 0:
+            return 0.0
+        return -self.available / self.rate
+
+    def settle(self, reserved, actual):
+        # give back (or take more) once the real usage is known
+        self._refill()
+        self.available = min(self.capacity, self.available + reserved - actual)
+
+
+def retry_after_seconds(error):
+    # OpenAI sends retry-after / retry-after-ms, and x-ratelimit-reset-* like "1.5s" or "20ms"
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+    waits = []
+    for name in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+        value = headers.get(name)
+        if not value:
+            continue
+        try:
+            if value.endswith('ms'):
+                waits.append(float(value[:-2]) / 1000)
+            elif value.endswith('s'):
+                waits.append(float(value[:-1]))
+        except ValueError:
+            pass
+    return max(waits) if waits else None
+
+
+def estimated_cost(stats):
+    """USD for the tokens counted in an AsyncSentimentClient's stats, at the list prices above."""
+    return (stats['prompt_tokens'] * INPUT_PRICE_PER_MILLION + stats['completion_tokens'] * OUTPUT_PRICE_PER_MILLION) / 1_000_000
+
+
+class AsyncSentimentClient:
+    """Labels many texts concurrently while staying under the account's rate limits."""
+
+    def __init__(self, model=OPENAI_MODEL_NAME, max_concurrency=50, requests_per_minute=5000,
+                 tokens_per_minute=2_000_000, max_retries=6, base_backoff=1.0, max_backoff=60.0, base_url=None, cache=None,
+                 pack_token_budget=None, max_posts_per_request=MAX_POSTS_PER_REQUEST):
+        self.model = model
+        self.cache = cache # optional sentiment_cache.SentimentCache
+        # with a token budget, several posts are sent per request (see pack_texts)
+        self.pack_token_budget = pack_token_budget
+        self.max_posts_per_request = max_posts_per_request
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute, capacity=max(1, requests_per_minute // 60))
+        self.tokens = TokenBucket(tokens_per_minute, capacity=max(1, tokens_per_minute // 60))
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.base_url = base_url
+        self.paused_until = 0.0
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'errors': 0, 'tokens': 0,
+                      'prompt_tokens': 0, 'completion_tokens': 0, 'packed_posts': 0, 'packed_fallbacks': 0}
+        self.latencies = array('d') # seconds per answered request, for the p50/p95/p99 in report()
+
+    def _backoff(self, attempt, hinted):
+        # full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+        if hinted is not None:
+            delay = max(delay, hinted)
+        return delay
+
+    async def _wait_for_capacity(self, estimated_tokens):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        pause = self.paused_until - time.monotonic()
+        if max(wait, pause) > 0:
+            await asyncio.sleep(max(wait, pause))
+
+    async def _complete(self, client, messages, estimated_tokens, max_tokens, label):
+        """One chat completion with pacing and retries. Returns the message content, or None on failure."""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_capacity(estimated_tokens)
+            self.stats['requests'] += 1
+            try:
+                started = time.perf_counter()
+                response = await client.chat.completions.create(
+                    model=self.model, messages=messages, temperature=0.2,
+                    max_tokens=max_tokens, response_format={"type": "json_object"}
+                )
+                self.latencies.append(time.perf_counter() - started)
+                usage = getattr(response, 'usage', None)
+                used = usage.total_tokens if usage else estimated_tokens
+                self.tokens.settle(estimated_tokens, used)
+                self.stats['tokens'] += used
+                if usage:
+                    self.stats['prompt_tokens'] += usage.prompt_tokens
+                    self.stats['completion_tokens'] += usage.completion_tokens
+                return response.choices[0].message.content
+            except openai.RateLimitError as e:
+                self.stats['rate_limited'] += 1
+                delay = self._backoff(attempt, retry_after_seconds(e))
+                # everyone waits, not just this request, otherwise the other workers keep hitting the limit
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            except (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                delay = self._backoff(attempt, None)
+                print(f"OpenAI transient error for {label}: {e}. Retrying in {delay:.1f}s")
+            except openai.APIError as e:
+                self.stats['errors'] += 1
+                print(f"OpenAI API Error for {label}: {e}")
+                return None
+            if attempt < self.max_retries:
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+        self.stats['errors'] += 1
+        print(f"Giving up after {self.max_retries} retries for {label}")
+        return None
+
+    async def analyze(self, client, text):
+        processed_text = truncate_text(text)
+        label = f"text '{processed_text[:50]}...'"
+        content = await self._complete(client, build_messages(processed_text), estimate_tokens(processed_text),
+                                       MAX_RESPONSE_TOKENS, label)
+        if content is None:
+            return None, None
+        try:
+            return parse_sentiment_response(content)
+        except json.JSONDecodeError as e:
+            self.stats['errors'] += 1
+            print(f"JSON Decode Error for {label}: {e}")
+            return None, None
+
+    async def analyze_bounded(self, client, text, semaphore):
+        async with semaphore:
+            return await self.analyze(client, text)
+
+    async def analyze_packed(self, client, texts, semaphore):
+        """Label several texts in one request; any id missing or malformed in the reply is retried on its own. The
+        packed request and every one of those retries take their own slot of semaphore."""
+        processed_texts = [truncate_text(text) for text in texts]
+        async with semaphore:
+            content = await self._complete(client, build_packed_messages(processed_texts), estimate_packed_tokens(processed_texts),
+                                           packed_max_tokens(len(processed_texts)), f"packed request of {len(texts)} posts")
+        results = parse_packed_response(content, len(processed_texts)) if content is not None else {}
+        self.stats['packed_posts'] += len(results)
+        missing = [position for position in range(len(texts)) if position not in results]
+        if missing:
+            self.stats['packed_fallbacks'] += len(missing)
+            singles = await asyncio.gather(*(self.analyze_bounded(client, texts[position], semaphore) for position in missing))
+            results.update(zip(missing, singles))
+        return [results[position] for position in range(len(texts))]
+
+    async def analyze_many(self, texts):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # retries are handled above, so the SDK's own retry loop is switched off
+        async with openai.AsyncOpenAI(base_url=self.base_url, max_retries=0) as client:
+            if self.pack_token_budget:
+                groups = pack_texts(texts, self.pack_token_budget, self.max_posts_per_request)
+                packed_results = await asyncio.gather(*(self.analyze_packed(client, [texts[position] for position in group], semaphore)
+                                                        for group in groups))
+                results = [None] * len(texts)
+                for group, group_results in zip(groups, packed_results):
+                    for position, result in zip(group, group_results):
+                        results[position] = result
+                return results
+            return await asyncio.gather(*(self.analyze_bounded(client, text, semaphore) for text in texts))
+
+    def report(self, rows, seconds):
+        """Throughput, latency and estimated cost per 1k rows for what this client has sent so far."""
+        cost = estimated_cost(self.stats)
+        return {
+            'rows': rows,
+            'seconds': round(seconds, 2),
+            'rows_per_second': round(rows / seconds, 1) if seconds else 0.0,
+            'requests': self.stats['requests'],
+            'retries': self.stats['retries'],
+            'rate_limited': self.stats['rate_limited'],
+            'errors': self.stats['errors'],
+            'latency_seconds': percentiles(self.latencies),
+            'tokens_per_row': round(self.stats['tokens'] / rows, 1) if rows else 0.0,
+            'cost_usd': round(cost, 4),
+            'cost_per_1k_rows_usd': round(cost / rows * 1000, 4) if rows else 0.0,
+        }
+
+    def analyze_texts(self, texts):
+        """Blocking wrapper for scripts: returns a (sentiment, reason) tuple per text, in order."""
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.cache is None:
+            return asyncio.run(self.analyze_many(texts))
+
+        keys = [self.cache.key(text) for text in texts]
+        results = self.cache.get_many(keys)
+        missing = {} # key -> text, so repeats inside the chunk are only sent once
+        for key, text in zip(keys, texts):
+            if key not in results:
+                missing.setdefault(key, text)
+        if missing:
+            fresh = dict(zip(missing, asyncio.run(self.analyze_many(list(missing.values())))))
+            self.cache.put_many([(key, sentiment, reason) for key, (sentiment, reason) in fresh.items()])
+            results.update(fresh)
+        return [results[key] for key in keys]
@@ -1,10 +1,18 @@
 
-import re
-from time import sleep
+from time import sleep, perf_counter
 import pandas as pd
 import json
 import os
 import openai
+from ticker_matcher import build_ticker_matcher, match_tickers
+from sentiment_client import AsyncSentimentClient, estimated_cost, PACKED_PROMPT_VERSION, PROMPT_VERSION, build_messages, parse_sentiment_response, truncate_text
+from sentiment_cache import SentimentCache
+from sentiment_backends import LocalFirstClient, make_backend
+from row_triage import RowTriage, label_namespace
+from checkpoint import Checkpoint, iter_csv_chunks, offset_after_rows
+import processed_store
+from ticker_index import TickerIndex
+from metrics import Metrics
 
 try:
     client = openai.OpenAI() 
@@ -14,10 +22,14 @@ except openai.OpenAIError as e:
     exit()
 
 OPENAI_MODEL_NAME = "gpt-4o-mini" # Cost-effective and capable OpenAI model
+sentiment_cache = None # opened in chunkify_batch when USE_SENTIMENT_CACHE is set
+metrics = Metrics() # replaced at the start of chunkify_batch
+row_triage = None # opened in chunkify_batch when DEAD_ROW_ACTION or DEDUP_TEXTS is set
 
 TITLE_COLUMN = 'title'
 SELFTEXT_COLUMN = 'selftext'
 CHECK_ONLY_FIRST_CHUNK = False # Set to True to process only the first chunk
+VERBOSE_CHUNK_OUTPUT = True # Set to False to skip printing each chunk's head and value counts
 
 # Configurations
 file_path = 'wsb_sub_sentiment.csv'
@@ -27,68 +39,178 @@ chunk_size = CHUNK_SIZE = 500
 
 
 DELAY_BETWEEN_API_CALLS_SECONDS = 0.02
+# Async client (sentiment_client.py): sends each chunk's rows concurrently instead of one blocking call at a time
+USE_ASYNC_CLIENT = True
+MAX_CONCURRENT_REQUESTS = 50
+REQUESTS_PER_MINUTE = 5000 # account limits, the client paces itself below these
+TOKENS_PER_MINUTE = 2_000_000
+MAX_API_RETRIES = 6
+# Packed prompts: several posts per request, as many as fit this many prompt tokens (None sends one post per request)
+PACK_TOKEN_BUDGET = None # e.g. 4000
+MAX_POSTS_PER_REQUEST = 20
+# Only extract tickers and leave sentiment empty; label them afterwards in bulk with openai_batch.py
+DEFER_TO_BATCH_API = False
+# Result cache (sentiment_cache.py): labels already paid for are looked up before calling the API
+USE_SENTIMENT_CACHE = True
+SENTIMENT_CACHE_PATH = 'sentiment_cache.sqlite'
+SENTIMENT_CACHE_MAX_ENTRIES = 5_000_000
+# Sentiment backend (sentiment_backends.py): 'api' sends every ticker row to OpenAI, 'local' labels them all on the CPU
+# with LOCAL_BACKEND, 'hybrid' only sends the rows the local backend is less than LOCAL_CONFIDENCE_THRESHOLD sure about.
+# Local and hybrid work on whole chunks, so their API rows always go through the async client
+SENTIMENT_BACKEND = 'api'
+LOCAL_BACKEND = 'lexicon'
+LOCAL_CONFIDENCE_THRESHOLD = 0.6
+# Row triage (row_triage.py): removed/deleted/link-only posts are labeled from their title locally ('title'), left
+# unlabeled ('skip') or sent like any other row (None). With DEDUP_TEXTS, texts labeled before, in this run or in
+# earlier ones (kept in the sentiment cache, this run only without USE_SENTIMENT_CACHE), get the same label again
+# instead of another call
+DEAD_ROW_ACTION = 'title'
+DEDUP_TEXTS = True
+# Columnar copy of the output (processed_store.py) that the analysis scripts read instead of the CSV
+WRITE_PARQUET = True
+PARQUET_PATH = 'wsb_sub_processed_parquet'
+# Ticker -> rows index (ticker_index.py), kept up to date chunk by chunk for per-ticker queries
+WRITE_TICKER_INDEX = True
+TICKER_INDEX_PATH = 'ticker_index.sqlite'
+# Resume journal (checkpoint.py): records committed rows and byte offsets, so restarts seek straight to new work
+CHECKPOINT_PATH = 'wsb_sub_processed.checkpoint.json'
+# Timings per stage, API latency p50/p95/p99 and cost (metrics.py): a progress line every PROGRESS_SECONDS, the full report as json when the run ends
+PROGRESS_SECONDS = 30
+METRICS_REPORT_PATH = 'wsb_sub_processed.metrics.json'
+# Only used once, to seed the journal for an output that was written before checkpoints existed
 CHUNKS_ALREADY_PROCESSED_COUNT = 217
 ROWS_TO_SKIP_IN_INPUT = CHUNKS_ALREADY_PROCESSED_COUNT * CHUNK_SIZE
 
 
 
 def chunkify_batch(file_path, output_path, chunk_size, tickers, chunks_already_processed):
+    global sentiment_cache, metrics, row_triage
+    metrics = Metrics(PROGRESS_SECONDS)
+    sentiment_client = None
+    rows_this_run = 0
     try:
-        write_header_to_output = True
-        output_exists = os.path.exists(output_path)
-        for i,chunk in enumerate(pd.read_csv(file_path, chunksize=chunk_size)):
+        # packed and single-post labels come from different prompts, so they are cached separately
+        prompt_version = PACKED_PROMPT_VERSION if (USE_ASYNC_CLIENT or SENTIMENT_BACKEND == 'hybrid') and PACK_TOKEN_BUDGET else PROMPT_VERSION
+        if USE_SENTIMENT_CACHE:
+            sentiment_cache = SentimentCache(SENTIMENT_CACHE_PATH, SENTIMENT_CACHE_MAX_ENTRIES, OPENAI_MODEL_NAME, prompt_version)
+        # compile the ticker list once for the whole run
+        ticker_matcher = build_ticker_matcher(tickers)
+        if SENTIMENT_BACKEND == 'hybrid' or (USE_ASYNC_CLIENT and SENTIMENT_BACKEND != 'local'):
+            sentiment_client = AsyncSentimentClient(OPENAI_MODEL_NAME, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE,
+                                                    TOKENS_PER_MINUTE, MAX_API_RETRIES, cache=sentiment_cache,
+                                                    pack_token_budget=PACK_TOKEN_BUDGET, max_posts_per_request=MAX_POSTS_PER_REQUEST)
+        if SENTIMENT_BACKEND in ('local', 'hybrid'):
+            sentiment_client = LocalFirstClient(make_backend(LOCAL_BACKEND), sentiment_client, LOCAL_CONFIDENCE_THRESHOLD)
+        if sentiment_client is not None:
+            metrics.share_samples('api_latency', sentiment_client.latencies)
+        if DEAD_ROW_ACTION is not None or DEDUP_TEXTS:
+            row_triage = RowTriage(DEAD_ROW_ACTION, sentiment_cache, label_namespace(SENTIMENT_BACKEND, LOCAL_BACKEND,
+                                   LOCAL_CONFIDENCE_THRESHOLD, OPENAI_MODEL_NAME, prompt_version), DEDUP_TEXTS)
+        ticker_index = TickerIndex(TICKER_INDEX_PATH) if WRITE_TICKER_INDEX else None
+        checkpoint = Checkpoint.load(CHECKPOINT_PATH, file_path, output_path)
+        if not checkpoint.exists() and os.path.exists(output_path) and chunks_already_processed:
+            # older output without a journal: trust the hand-set chunk count one last time
+            checkpoint.input_offset = offset_after_rows(file_path, chunks_already_processed * chunk_size)
+            checkpoint.rows_done = chunks_already_processed * chunk_size
+            checkpoint.chunks_done = chunks_already_processed
+            checkpoint.output_size = os.path.getsize(output_path)
+            checkpoint.save()
+        checkpoint.repair_output()
+        if checkpoint.rows_done:
+            print(f"Resuming after {checkpoint.chunks_done} chunks ({checkpoint.rows_done:,} rows) at byte {checkpoint.input_offset:,}")
+
+        chunks = iter_csv_chunks(file_path, chunk_size, checkpoint.input_offset)
+        read_started = perf_counter()
+        for i, (chunk, input_offset) in enumerate(chunks, start=checkpoint.chunks_done):
+            metrics.add_time('csv_read', perf_counter() - read_started, len(chunk))
             # Process each chunk here
-            current_index = i
-            # For example, you can print the first few rows of each chunk
-            if current_index < chunks_already_processed:
-                print(f"Skipping chunk {current_index + 1} as it has already been processed.")
-                continue
             print(f'--- Processing chunk {i + 1} ---')
-            processed_chunk = extraction(chunk, tickers)
-            print("Head of processed chunk:")
-            print(processed_chunk.head(10))
-            print("\nValue counts for 'sentiment' column in this chunk:")
-            print(processed_chunk['sentiment'].value_counts().head(10))
-
-            print("\nValue counts for 'ai_reason' column in this chunk:")
-            print(processed_chunk['ai_reason'].value_counts().head(10))
-
-            # Ticker check
-            if 'tickers' in processed_chunk.columns:
-                print("\nValue counts for 'tickers' column in this chunk:")
-                print(processed_chunk['tickers'].value_counts().head(10)) # Show top 10 for brevity
-            else:
-                print("'tickers' column not found in chunk.")
+            processed_chunk = extraction(chunk, ticker_matcher, sentiment_client)
+            if VERBOSE_CHUNK_OUTPUT:
+                print("Head of processed chunk:")
+                print(processed_chunk.head(10))
+                print("\nValue counts for 'sentiment' column in this chunk:")
+                print(processed_chunk['sentiment'].value_counts().head(10))
+
+                print("\nValue counts for 'ai_reason' column in this chunk:")
+                print(processed_chunk['ai_reason'].value_counts().head(10))
+
+                # Ticker check
+                if 'tickers' in processed_chunk.columns:
+                    print("\nValue counts for 'tickers' column in this chunk:")
+                    print(processed_chunk['tickers'].value_counts().head(10)) # Show top 10 for brevity
+                else:
+                    print("'tickers' column not found in chunk.")
 
             
-            # save the processed chunk to a new CSV file
-            if write_header_to_output and not output_exists:
-                processed_chunk.to_csv(output_path, mode='w', header=True, index=False)
-                write_header_to_output = False # Headers are now written, subsequent appends
-                print(f"Chunk {i + 1} saved to '{output_path}' with headers.")
-            else:
-                processed_chunk.to_csv(output_path, mode='a', header=False, index=False)
-                print(f"Chunk {i + 1} appended to '{output_path}'.")
+            # append the processed chunk, fsync it, and only then move the journal past it.
+            # A crash in between leaves extra bytes that repair_output() cuts off on the next start
+            if WRITE_PARQUET:
+                # named after the chunk's first row, so a chunk redone after a crash overwrites its own files
+                with metrics.time('parquet_write', len(processed_chunk)):
+                    processed_store.append_chunk(processed_chunk, checkpoint.rows_done, PARQUET_PATH)
+            if ticker_index is not None:
+                with metrics.time('ticker_index', len(processed_chunk)):
+                    ticker_index.add_chunk(processed_chunk, checkpoint.rows_done)
+            write_header = checkpoint.output_size == 0
+            with metrics.time('csv_write', len(processed_chunk)):
+                with open(output_path, 'a', encoding='utf-8', newline='') as output_handle:
+                    processed_chunk.to_csv(output_handle, header=write_header, index=False)
+                    output_handle.flush()
+                    os.fsync(output_handle.fileno())
+                    output_size = os.fstat(output_handle.fileno()).st_size
+                checkpoint.commit(input_offset, len(processed_chunk), output_size)
+            rows_this_run += len(processed_chunk)
+            print(f"Chunk {i + 1} {'saved' if write_header else 'appended'} to '{output_path}' ({checkpoint.rows_done:,} rows committed).")
+            metrics.log_progress(rows_this_run, **progress_details(sentiment_client))
 
-            if i == 0 and CHECK_ONLY_FIRST_CHUNK:
+            if CHECK_ONLY_FIRST_CHUNK:
                 print("\nProcessed only the first chunk as requested. Stopping.")
                 break # Stop after processing the first chunk
             
 
             # You can also save each chunk to a new file if needed
             # chunk.to_csv(f'chunk_{i}.csv', index=False)
+            read_started = perf_counter()
     except Exception as e:
         print(f"An error occurred while processing the file: {e}")
         exit(1)
+    finally:
+        # also written when the run dies, the timings up to that point are usually what you want to look at
+        local = sentiment_client.report() if isinstance(sentiment_client, LocalFirstClient) else None
+        api_client = sentiment_client.api_client if local is not None else sentiment_client
+        report = metrics.write_report(METRICS_REPORT_PATH, rows_this_run, **progress_details(sentiment_client),
+                                      api=api_client.stats if api_client is not None else None, local=local,
+                                      triage=row_triage.stats if row_triage is not None else None)
+        print(f"Processed {rows_this_run:,} rows at {report['rows_per_second']:,.1f} rows/s, metrics saved to '{METRICS_REPORT_PATH}'")
+
+
+def progress_details(sentiment_client):
+    details = {}
+    if isinstance(sentiment_client, LocalFirstClient):
+        details['local_share'] = sentiment_client.report()['local_share']
+        sentiment_client = sentiment_client.api_client # the rest is about what went to the API
+    if sentiment_client is not None:
+        details['cost_usd'] = round(estimated_cost(sentiment_client.stats), 4)
+        details['retries'] = sentiment_client.stats['retries']
+    if row_triage is not None:
+        details['calls_avoided'] = row_triage.stats['calls_avoided']
+    if sentiment_cache is not None:
+        details['cache_hit_rate'] = sentiment_cache.stats()['hit_rate']
+    return details
 
         
-def extraction(chunk, tickers, title_col='title', selftext_col='selftext'):
+def extraction(chunk, ticker_matcher, sentiment_client=None, title_col='title', selftext_col='selftext'):
     # This function should contain the logic to extract tickers from the chunk
     # tickers will be located in either the title or selftext column
-    # You can use regex or any other method to find the tickers
+    # ticker_matcher comes from build_ticker_matcher(), so every ticker is found in one pass
+    # with a sentiment_client the chunk's API calls are made concurrently once all tickers are found
+    # with a row_triage (chunkify_batch opens one), dead rows and repeats are sorted out before any of that
     found_tickers = []
     sentiments = []
     reasons = []
+    pending_texts = [] # (position in chunk, title, selftext, combined text) to label once the chunk's tickers are found
+    tickers_started = perf_counter()
     for index, row in chunk.iterrows():
         title_text = str(row.get(title_col, '')).lower() if pd.notna(row.get(title_col)) else ""
         self_text = str(row.get(selftext_col, '')).lower() if pd.notna(row.get(selftext_col)) else ""
@@ -98,56 +220,69 @@ def extraction(chunk, tickers, title_col='title', selftext_col='selftext'):
         # ------------ TICKER EXTRACTION ------------- 
         tickers_in_this_row = set()
         if combined_text_to_search.strip(): # if combined_text is not empty otherwise skip
-            for ticker_symbol in tickers:
-                # Using regex to escape other characters:
-                pattern = r'(?:[\s\(\[\"\']|^)(\$|#)?(' + re.escape(ticker_symbol) + r')\b'
-                if re.search(pattern, combined_text_to_search): # regex is fast
-                    tickers_in_this_row.add(ticker_symbol.upper())
+            tickers_in_this_row = match_tickers(ticker_matcher, combined_text_to_search)
         found_tickers.append(json.dumps(sorted(list(tickers_in_this_row))))
         # --------- END TICKER EXTRACTION ------------- 
-        sentiment = None
-        reason = None
-        if len(tickers_in_this_row) > 0:
-            if combined_text_to_search.strip(): # if combined_text is not empty otherwise skip
-                sentiment, reason = sentiment_analysis(combined_text_to_search)
-                if sentiment and reason:
-                    if sentiment == "Rate Limited":
-                        sentiment, reason = sentiment_analysis(combined_text_to_search)
-                sleep(DELAY_BETWEEN_API_CALLS_SECONDS)
-        sentiments.append(sentiment)
-        reasons.append(reason)
+        if len(tickers_in_this_row) > 0 and not DEFER_TO_BATCH_API and combined_text_to_search.strip():
+            pending_texts.append((len(sentiments), title_text, self_text, combined_text_to_search))
+        sentiments.append(None)
+        reasons.append(None)
+    metrics.add_time('tickers', perf_counter() - tickers_started, len(chunk))
+
+    if pending_texts:
+        label_texts = sentiment_client.analyze_texts if sentiment_client is not None else blocking_sentiment_analysis
+        with metrics.time('sentiment', len(pending_texts)):
+            if row_triage is not None:
+                results = row_triage.label([(title, self_text, text) for _, title, self_text, text in pending_texts], label_texts)
+            else:
+                results = label_texts([text for _, _, _, text in pending_texts])
+        for (position, _, _, _), (sentiment, reason) in zip(pending_texts, results):
+            sentiments[position] = sentiment
+            reasons[position] = reason
+        if VERBOSE_CHUNK_OUTPUT and sentiment_client is not None:
+            print(f"API stats so far: {sentiment_client.stats}")
+        if VERBOSE_CHUNK_OUTPUT and row_triage is not None:
+            print(f"Row triage: {row_triage.stats}")
+    if sentiment_cache is not None and VERBOSE_CHUNK_OUTPUT:
+        print(f"Sentiment cache: {sentiment_cache.stats()}")
 
     chunk['sentiment'] = sentiments
     chunk['ai_reason'] = reasons
     chunk['tickers'] = found_tickers
     return chunk
 
+def blocking_sentiment_analysis(texts):
+    # one call at a time, the way extraction() worked before the async client
+    results = []
+    for text in texts:
+        sentiment, reason = sentiment_analysis(text)
+        if sentiment and reason:
+            if sentiment == "Rate Limited":
+                sentiment, reason = sentiment_analysis(text)
+        sleep(DELAY_BETWEEN_API_CALLS_SECONDS)
+        results.append((sentiment, reason))
+    return results
+
 def sentiment_analysis(text,):
-    # Reddit has a 40_000 character limit for body section!
-    max_chars = 1500
-    processed_text = str(text)
-    if len(processed_text) > max_chars:
-        processed_text = processed_text[:max_chars]  # Truncate to max_chars
+    # Reddit has a 40_000 character limit for body section! (truncated to 1500 chars)
+    processed_text = truncate_text(text)
+    if sentiment_cache is not None:
+        cached = sentiment_cache.get(processed_text)
+        if cached is not None:
+            return cached
     try: 
-        messages = [
-            {"role": "system", "content": "You are an AI expert in financial and meme sentiment analysis. Analyze the sentiment of the provided Reddit post text. "
-                                         "Respond with a JSON object containing two keys: "
-                                         "'sentiment' (string: 'Positive', 'Negative', or 'Neutral') and "
-                                         "'ai_reason' (string: a brief, one-sentence explanation for the sentiment)."},
-            {"role": "user", "content": f"Analyze the following text: \"{processed_text}\""}
-        ]
+        messages = build_messages(processed_text)
+        request_started = perf_counter()
         response = client.chat.completions.create(
             model=OPENAI_MODEL_NAME, messages=messages, temperature=0.2,
             max_tokens=150, response_format={"type": "json_object"}
         )
+        metrics.observe('api_latency', perf_counter() - request_started)
         api_response_content = response.choices[0].message.content
-        if api_response_content:
-            result = json.loads(api_response_content)
-            sentiment_val = result.get('sentiment', 'Parse Error')
-            reason_val = result.get('ai_reason', 'Parse Error')
-            return sentiment_val, reason_val
-        else:
-            return "API Error", "Empty API response content"
+        sentiment_val, reason_val = parse_sentiment_response(api_response_content)
+        if sentiment_cache is not None:
+            sentiment_cache.put(processed_text, sentiment_val, reason_val)
+        return sentiment_val, reason_val
     except openai.RateLimitError as e: # Specific error for rate limits
         print(f"OpenAI Rate Limit Error hit: {e}. Sleeping for 60 seconds...")
         sleep(60) # Reactive sleep
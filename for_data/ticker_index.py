@@ -0,0 +1,111 @@
+# Inverted index from ticker to the rows that mention it, so per-ticker queries don't scan every row.
+# sentimize_data.py adds each chunk as it is written; build it for existing data with:
+#   python ticker_index.py [wsb_sub_processed_parquet or wsb_sub_processed.csv] [ticker_index.sqlite]
+import os
+import sqlite3
+import sys
+import pandas as pd
+try:
+    from processed_store import load_processed, parse_tickers
+except ImportError: # imported from the repo root as for_data.ticker_index
+    from for_data.processed_store import load_processed, parse_tickers
+
+TICKER_INDEX_PATH = 'ticker_index.sqlite'
+
+
+class TickerIndex:
+    """SQLite postings table clustered on (ticker, date, row_id): one ticker over a date range is a single range read."""
+
+    def __init__(self, path=TICKER_INDEX_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS postings (
+            ticker TEXT NOT NULL,
+            date TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            PRIMARY KEY (ticker, date, row_id)) WITHOUT ROWID""")
+        self.connection.commit()
+
+    def add_chunk(self, chunk, first_row_id=None):
+        """Index a processed chunk whose first row is data row first_row_id (or that has a row_id column).
+
+        Re-adding the same chunk is a no-op, so a chunk redone after a crash is safe.
+        """
+        dates = pd.to_datetime(chunk['date']).dt.strftime('%Y-%m-%d')
+        if 'row_id' in chunk.columns:
+            row_ids = chunk['row_id'].astype(int).tolist()
+        else:
+            row_ids = range(first_row_id, first_row_id + len(chunk))
+        postings = []
+        for row_id, date, tickers in zip(row_ids, dates, chunk['tickers']):
+            for ticker in parse_tickers(tickers):
+                postings.append((ticker, date, row_id))
+        self.connection.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", postings)
+        self.connection.commit()
+        return len(postings)
+
+    def delete_from(self, first_row_id):
+        """Drop the postings of rows first_row_id and up, e.g. rows a crashed append never committed."""
+        deleted = self.connection.execute("DELETE FROM postings WHERE row_id >= ?", (first_row_id,)).rowcount
+        self.connection.commit()
+        return deleted
+
+    def lookup(self, ticker, start=None, end=None):
+        """Sorted row ids mentioning ticker, optionally between two dates (inclusive)."""
+        return [row_id for row_id, _ in self.lookup_with_dates(ticker, start, end)]
+
+    def lookup_with_dates(self, ticker, start=None, end=None):
+        query = "SELECT row_id, date FROM postings WHERE ticker = ?"
+        params = [ticker.upper()]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            query += " AND date <= ?"
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        return sorted(self.connection.execute(query, params).fetchall())
+
+    def ticker_counts(self, start=None, end=None):
+        """Mentions per ticker, most mentioned first."""
+        query = "SELECT ticker, COUNT(*) FROM postings"
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("date >= ?")
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            clauses.append("date <= ?")
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " GROUP BY ticker ORDER BY COUNT(*) DESC"
+        return pd.Series(dict(self.connection.execute(query, params).fetchall()), name='mentions', dtype='int64')
+
+    def close(self):
+        self.connection.close()
+
+
+def build_index(data_path, index_path=TICKER_INDEX_PATH, chunk_size=100_000):
+    index = TickerIndex(index_path)
+    if os.path.isdir(data_path):
+        df = load_processed(data_path, ['row_id', 'date', 'tickers'])
+        for start in range(0, len(df), chunk_size):
+            index.add_chunk(df.iloc[start:start + chunk_size])
+    else:
+        row_id = 0
+        for chunk in pd.read_csv(data_path, chunksize=chunk_size, usecols=['date', 'tickers']):
+            index.add_chunk(chunk, row_id)
+            row_id += len(chunk)
+    return index
+
+
+if __name__ == "__main__":
+    data_path = sys.argv[1] if len(sys.argv) > 1 else 'wsb_sub_processed_parquet'
+    index_path = sys.argv[2] if len(sys.argv) > 2 else TICKER_INDEX_PATH
+    if not os.path.exists(data_path):
+        print(f"Error: The file '{data_path}' was not found.")
+        exit(1)
+    index = build_index(data_path, index_path)
+    print(index.ticker_counts().head(20))
+    index.close()
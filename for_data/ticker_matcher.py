@@ -0,0 +1,62 @@
+# Single-pass ticker matching, built once per run instead of one re.search per ticker per row.
+import re
+
+# same boundary rules as the old per-ticker loop in extraction():
+#   r'(?:[\s\(\[\"\']|^)(\$|#)?(' + re.escape(ticker_symbol) + r')\b'
+# the ticker itself sits in a lookahead so matches are zero width and can never swallow a neighbour
+PREFIX_PATTERN = r'(?:(?<=[\s\(\[\"\'])|^)[\$#]?'
+
+
+def _is_word_char(char):
+    return bool(re.match(r'\w', char))
+
+
+def _conflicts(short, long):
+    # two tickers can only both match at the same spot if one is a prefix of the other AND the
+    # word boundary after the short one still holds inside the long one (e.g. "brk" vs "brk.b")
+    if not long.startswith(short) or short == long:
+        return False
+    return _is_word_char(short[-1]) != _is_word_char(long[len(short)])
+
+
+def _split_into_layers(tickers):
+    # an alternation only reports one ticker per position, so tickers that could match at the same
+    # spot are put in separate layers. With ticker_list.txt this is always a single layer.
+    layers = []
+    for ticker in sorted(set(tickers), key=len):
+        for layer in layers:
+            if not any(_conflicts(other, ticker) for other in layer):
+                layer.append(ticker)
+                break
+        else:
+            layers.append([ticker])
+    return layers
+
+
+def build_ticker_matcher(tickers):
+    """Compile the ticker list (already lowercased) into as few regexes as possible."""
+    patterns = []
+    for layer in _split_into_layers(tickers):
+        # longest first so "googl" is tried before "goog"
+        alternation = '|'.join(re.escape(ticker) for ticker in sorted(layer, key=len, reverse=True))
+        patterns.append(re.compile(PREFIX_PATTERN + r'(?=(' + alternation + r')\b)'))
+    return patterns
+
+
+def match_tickers(matcher, text):
+    """Return the set of (uppercased) tickers found in already lowercased text."""
+    found = set()
+    for pattern in matcher:
+        for match in pattern.finditer(text):
+            found.add(match.group(1).upper())
+    return found
+
+
+def match_tickers_loop(tickers, text):
+    """The original one-regex-per-ticker loop, kept as the reference for benchmarks."""
+    found = set()
+    for ticker_symbol in tickers:
+        pattern = r'(?:[\s\(\[\"\']|^)(\$|#)?(' + re.escape(ticker_symbol) + r')\b'
+        if re.search(pattern, text):
+            found.add(ticker_symbol.upper())
+    return found
@@ -1,6 +1,10 @@
-import pandas as pd
+import os
+from for_data.processed_store import load_processed
 file_path = 'wsb_sub_processed.csv'
-df = pd.read_csv(file_path)
+parquet_path = 'wsb_sub_processed_parquet' # read instead of the CSV when it exists
+if os.path.isdir(parquet_path):
+    file_path = parquet_path
+df = load_processed(file_path)
 print(df.head(20))
 print(df.tail(20))
 print(df.shape)
@@ -1,12 +1,40 @@
 import pandas as pd
-import json
 import os
-import yfinance as yf
+from for_data.aggregates import aggregate_sentiment, ticker_period
+from for_data.processed_store import load_processed, read_processed
+from for_data.ticker_index import TickerIndex
+from for_data.price_store import PriceStore, align_prices
+from for_data.aggregate_cube import AggregateCube
 
 PROCESSED_FILE_PATH = 'wsb_sub_processed.csv'
+PROCESSED_PARQUET_PATH = 'wsb_sub_processed_parquet' # used instead of the CSV when it exists
+TICKER_INDEX_PATH = 'ticker_index.sqlite' # ticker -> rows, lets the parquet store be read for just the target's rows
 TARGET_TICKER = 'TSLA' 
+PRICE_DIR = 'price_data' # local OHLCV store (for_data/price_store.py), only ranges it doesn't have yet are downloaded
+USE_AGGREGATE_CUBE = True # charts from the materialized ticker x day cube (for_data/aggregate_cube.py), False re-reads the rows
+
+def aggregate_rows(processed_file_path, target_ticker, start=None, end=None):
+    # only the columns used below; with the parquet store the date range also skips whole months
+    if os.path.isdir(processed_file_path) and os.path.exists(TICKER_INDEX_PATH):
+        # the index knows exactly which rows (and dates) mention the ticker, so nothing else is read
+        postings = TickerIndex(TICKER_INDEX_PATH).lookup_with_dates(target_ticker, start, end)
+        if not postings:
+            print(f"no posts found mentioning the target ticker: {target_ticker}")
+            exit(0)
+        dates = [date for _, date in postings]
+        df = read_processed(processed_file_path, ['row_id', 'date', 'sentiment', 'tickers'], min(dates), max(dates),
+                            row_ids=[row_id for row_id, _ in postings])
+    else:
+        df = load_processed(processed_file_path, ['date', 'sentiment', 'tickers'], start, end)
+    print(f"loaded {len(df)} rows from {processed_file_path}")
+
+    df['date'] = pd.to_datetime(df['date'])
+
+    # one vectorized pass gives weekly and daily counts, mean score and proportions for every ticker in df
+    # (rows without a valid sentiment are left out, tickers come as JSON strings from the CSV or arrays from parquet)
+    return aggregate_sentiment(df, periods=('W', 'D'), include_all=False)
 
-def analyze_ticker(processed_file_path, target_ticker):
+def analyze_ticker(processed_file_path, target_ticker, start=None, end=None):
     # check if the processed data file exists
     if not os.path.exists(processed_file_path):
         print(f"error: processed file not found at {processed_file_path}")
@@ -14,90 +42,38 @@ def analyze_ticker(processed_file_path, target_ticker):
         return pd.DataFrame() # return empty dataframe if file not found
 
     try:
-        df = pd.read_csv(processed_file_path)
-        print(f"loaded {len(df)} rows from {processed_file_path}")
-
-        df['date'] = pd.to_datetime(df['date'])
-
-        def parse_ticker_json_string(ticker_json_str):
-            try:
-                # check if it's a string and looks like a json list before parsing
-                if isinstance(ticker_json_str, str) and ticker_json_str.startswith('['):
-                    return json.loads(ticker_json_str)
-                return []
-            except json.JSONDecodeError:
-                return [] # return empty list if json parsing fails
-        # parse tickers
-        df['tickers_list'] = df['tickers'].apply(parse_ticker_json_string)
-
-        # filter the dataframe for rows where 'tickers_list' contains the target_ticker
-        df_target_ticker = df[df['tickers_list'].apply(lambda tl: isinstance(tl, list) and target_ticker in tl)].copy()
-        
-        # if no posts are found for the target ticker, print a message and return an empty dataframe
-        if df_target_ticker.empty:
-            print(f"no posts found mentioning the target ticker: {target_ticker}")
+        if USE_AGGREGATE_CUBE:
+            # the cube has the ticker's daily counts already, weeks are summed from those. It's only built the first
+            # time (or after the data changed), later runs read a few KB
+            aggregates = AggregateCube(processed_file_path).aggregates(('W', 'D'), tickers=[target_ticker], start=start, end=end)
+        else:
+            aggregates = aggregate_rows(processed_file_path, target_ticker, start, end)
+        weekly = ticker_period(aggregates, target_ticker, 'W')
+        daily = ticker_period(aggregates, target_ticker, 'D')
+
+        # if no labeled posts are found for the target ticker there is nothing to chart
+        if weekly.empty:
+            print(f"no posts with sentiment found mentioning the target ticker: {target_ticker}")
             exit(0) # exit the script if no posts found
 
-        # SENTIMENT
-
-        # map sentiment
-        sentiment_to_score_map = {'Positive': 1, 'Neutral': 0, 'Negative': -1}
-        # valid sentiment ( we know data is good, so to be sure )
-        valid_sentiment_values = ['Positive', 'Negative', 'Neutral']
-        
-        # filter out rows that don't have a valid sentiment value
-        df_target_ticker_cleaned = df_target_ticker[df_target_ticker['sentiment'].isin(valid_sentiment_values)].copy()
-        # create a new 'sentiment_score' column using the map
-        df_target_ticker_cleaned['sentiment_score'] = df_target_ticker_cleaned['sentiment'].map(sentiment_to_score_map)
-        
-
-        if df_target_ticker_cleaned.empty:
-            print(f"No sentiments found for {target_ticker}")
-            return pd.DataFrame()
-
         # AGGREGATION
-        
-        # date needed as index for resampling
-        df_indexed_by_date = df_target_ticker_cleaned.set_index('date')
 
-        # calculate the average daily sentiment score
-        # 'W' stands for daily frequency
-        # .fillna(0) replaces any days with no data (NaN) with a neutral score of 0 -- this won't be hit, as we filter out empty posts above
-        daily_avg_sentiment_score = df_indexed_by_date['sentiment_score'].resample('W').mean().fillna(0)
-        
-        # count the number of posts per day for the target ticker
-        daily_post_counts = df_indexed_by_date.resample('W').size() 
-        # rename the series for clarity when merging
-        daily_post_counts.name = 'post_count'
-
-
-        # calculate the daily proportion of each sentiment type
-        # normalize=True gives proportions instead of raw counts
-        # .unstack(fill_value=0) pivots sentiment types into columns, filling missing ones with 0
-        daily_sentiment_proportions = df_indexed_by_date.groupby(pd.Grouper(freq='D'))['sentiment'] \
-                                                        .value_counts(normalize=True) \
-                                                        .unstack(fill_value=0)
-        #print(daily_sentiment_proportions.head()) # debug print to check proportions
-        
-        # aggregate all into one df
-        
-        # start with average sentiment and post counts
+        # every week between the first and last post, like resample('W') gives
+        weeks = pd.date_range(weekly.index.min(), weekly.index.max(), freq='W')
+
+        # average sentiment score per week, weeks with no data get a neutral score of 0
+        # post count per week for the target ticker
         analysis_df = pd.DataFrame({
-            'avg_sentiment_score': daily_avg_sentiment_score,
-            'post_count': daily_post_counts
+            'avg_sentiment_score': weekly['mean_score'].reindex(weeks).fillna(0),
+            'post_count': weekly['count'].reindex(weeks).fillna(0).astype(int)
         })
-        #print(analysis_df.head()) # debug print to check initial aggregation
-        
-        # add proportion columns for 'Positive', 'Negative', 'Neutral' sentiments
-        for sentiment_category in valid_sentiment_values: # iterate through defined valid sentiments
-            if sentiment_category in daily_sentiment_proportions.columns:
-                analysis_df[f'{sentiment_category}_proportion'] = daily_sentiment_proportions[sentiment_category]
-            else:
-                # if a sentiment category never appeared, add a column of zeros for it
-                analysis_df[f'{sentiment_category}_proportion'] = 0 
-        
+
+        # daily proportion of each sentiment type, lined up on the weekly index
+        for sentiment_category in ['Positive', 'Negative', 'Neutral']:
+            analysis_df[f'{sentiment_category}_proportion'] = daily[f'{sentiment_category}_proportion'].reindex(weeks)
+
         # fill any remaining NaN values in the final dataframe with 0
-        # this can happen if a date exists in one aggregated series but not others before merging
+        # this happens when a week's last day had no posts
         analysis_df = analysis_df.fillna(0)
 
         return analysis_df
@@ -111,7 +87,8 @@ def analyze_ticker(processed_file_path, target_ticker):
 
 if __name__ == "__main__":
 
-    target_daily_analysis = analyze_ticker(PROCESSED_FILE_PATH, TARGET_TICKER)
+    data_path = PROCESSED_PARQUET_PATH if os.path.isdir(PROCESSED_PARQUET_PATH) else PROCESSED_FILE_PATH
+    target_daily_analysis = analyze_ticker(data_path, TARGET_TICKER)
     
     if not target_daily_analysis.empty:
         print(f"\n--- Daily Analysis for {TARGET_TICKER} (first 5 days) ---")
@@ -122,12 +99,12 @@ if __name__ == "__main__":
     end_date = target_daily_analysis.index.max()
     print(f"\nFetching stock price data for {TARGET_TICKER} from {start_date} to {end_date}...")
     try:
-        tsla_stock_data = yf.download(TARGET_TICKER, start=start_date, end=end_date, interval='1d')
+        tsla_stock_data = PriceStore(PRICE_DIR).load([TARGET_TICKER], start_date, end_date)
         combined_df = target_daily_analysis.copy()
         all_days_index = pd.date_range(start=combined_df.index.min(), end=combined_df.index.max(), freq='D')
-        tsla_stock_data_resampled = tsla_stock_data.reindex(all_days_index).ffill() # Forward fill prices for non-trading days
-        combined_df['TSLA_Close'] = tsla_stock_data_resampled['Close']
-        combined_df['TSLA_Volume'] = tsla_stock_data_resampled['Volume']
+        # Forward fill prices for non-trading days
+        combined_df['TSLA_Close'] = align_prices(tsla_stock_data, 'close', all_days_index)[TARGET_TICKER]
+        combined_df['TSLA_Volume'] = align_prices(tsla_stock_data, 'volume', all_days_index)[TARGET_TICKER]
         combined_df['TSLA_Price_Change'] = combined_df['TSLA_Close'].diff()
         # remove NaN rows in the beginning
         combined_df = combined_df.dropna()